@@ -1,3 +1,4 @@
+import os
 import streamlit as st
 import ee
 from datetime import datetime, timedelta
@@ -7,11 +8,28 @@ import utils.auth as auth
 import utils.helpers as helpers
 import utils.map_utils as map_utils
 import utils.ui as ui
+import utils.jobs as jobs
+import utils.roi_index as roi_index
+import utils.geometry as geometry
+import utils.vector_export as vector_export
+import utils.report as report
+import utils.session_store as session_store
 import modules.rainfall as rainfall
 import modules.rwh as rwh
 import modules.encroachment as encroachment
 import modules.flood as flood
 import modules.water_quality as water_quality
+import modules.inventory as inventory
+
+# Mode -> module (each module declares its PIXEL_BUDGET)
+MODULES = {
+    "Rainfall & Climate Analysis": rainfall,
+    "Rainwater Harvesting Potential": rwh,
+    "Encroachment (S1 SAR)": encroachment,
+    "Flood Extent Mapping": flood,
+    "Water Quality": water_quality,
+    "Waterbody Inventory": inventory,
+}
 
 # --- 1. PAGE CONFIG ---
 st.set_page_config(
@@ -33,6 +51,15 @@ if 'roi' not in st.session_state: st.session_state['roi'] = None
 if 'mode' not in st.session_state: st.session_state['mode'] = "Rainfall & Climate Analysis"
 if 'detected_state' not in st.session_state: st.session_state['detected_state'] = None 
 
+# Reattach to a saved analysis after a page reload (?job=<id>)
+if st.session_state['roi'] is None and 'job' in st.query_params:
+    saved = jobs.load_analysis(st.query_params['job'])
+    if saved:
+        st.session_state['roi'] = helpers.geojson_to_ee(saved['roi'])
+        st.session_state['mode'] = st.session_state['app_mode'] = saved['mode']
+        st.session_state['params'] = saved['params']
+        st.session_state['calculated'] = True
+
 # --- 4. SIDEBAR ---
 with st.sidebar:
     st.image("geosarovar.png", width=150)
@@ -48,8 +75,9 @@ with st.sidebar:
                          "Rainwater Harvesting Potential",
                          "Encroachment (S1 SAR)",
                          "Flood Extent Mapping",
-                         "Water Quality"],
-                        label_visibility="collapsed")
+                         "Water Quality",
+                         "Waterbody Inventory"],
+                        label_visibility="collapsed", key='app_mode')
     st.markdown("---")
 
     st.markdown("### 2. Location (ROI)")
@@ -71,8 +99,9 @@ with st.sidebar:
         c1, c2 = st.columns(2)
         lat = c1.number_input("Lat", value=20.59)
         lon = c2.number_input("Lon", value=78.96)
-        rad = st.number_input("Radius (m)", value=5000)
-        new_roi = ee.Geometry.Point([lon, lat]).buffer(rad).bounds()
+        rad = st.number_input("Radius (m)", value=geometry.DEFAULT_RADIUS_M)
+        # Bounding box of the geodesic buffer, built locally so its size is known without a request
+        new_roi = helpers.geojson_to_ee(geometry.bbox_polygon(geometry.summary(geometry.circle(lon, lat, rad))['bounds']))
         if new_roi:
             st.session_state['roi'] = new_roi
             
@@ -98,6 +127,20 @@ with st.sidebar:
         else:
              st.success(f"ROI Locked ({st.session_state['detected_state']})")
 
+    # --- ROI SIZE & COST (local, before any analysis request) ---
+    roi_ok = True
+    if st.session_state['roi'] is not None:
+        est = geometry.estimate(helpers.roi_geojson(st.session_state['roi']), **MODULES[app_mode].PIXEL_BUDGET)
+        st.caption(f"Area: {est['area_km2']:,.1f} km² | {est['parts']} part(s), {est['vertices']} vertices | "
+                   f"~{est['pixels'] / 1e6:,.1f} M px at {est['scale']} m ({est['load']:.0%} of module budget)")
+        if est['load'] > 1:
+            roi_ok = False
+            st.error("ROI is too large for this module. Draw a smaller area or split it.")
+        elif est['load'] > 0.25:
+            st.warning("Large ROI: expect a long run (progressive preview recommended).")
+        if est['vertices'] > geometry.MAX_VERTICES:
+            st.warning(f"Complex boundary ({est['vertices']} vertices); consider simplifying it.")
+
     st.markdown("---")
 
     params = {}
@@ -112,43 +155,35 @@ with st.sidebar:
         rain_end = col2.date_input("End Date", datetime(2023, 9, 30))
         calc_mode = st.radio("Calculation Mode", ["Total Accumulation (mm)", "Rainfall Anomaly (%)"])
         params = {'dataset': dataset, 'start': rain_start.strftime("%Y-%m-%d"), 'end': rain_end.strftime("%Y-%m-%d"), 'calc_mode': calc_mode}
+        if "Anomaly" in calc_mode:
+            spec = rainfall.dataset_spec(dataset)
+            st.markdown("**Climatology Baseline**")
+            col3, col4 = st.columns(2)
+            base_from = col3.number_input("From Year", spec['first_year'], datetime.now().year - 1, spec['baseline'][0])
+            base_to = col4.number_input("To Year", spec['first_year'], datetime.now().year - 1, spec['baseline'][1])
+            params['baseline'] = (int(min(base_from, base_to)), int(max(base_from, base_to)))
 
     elif app_mode == "Rainwater Harvesting Potential":
         st.markdown("### 3. Suitability Criteria")
-        rwh_type = st.selectbox("Target Structure", ["Percolation Tank (Recharge)", "Check Dam (Streams)", "Farm Pond (Storage)"])
+        rwh_type = st.selectbox("Target Structure", rwh.STRUCTURES)
         
         # Smart Auto-Weights
-        def_rain, def_slope, def_soil, def_lulc, def_drain = 0.25, 0.20, 0.20, 0.15, 0.20
-        geo_zone = "General (Plateau)"
-        state_for_logic = st.session_state.get('detected_state', None)
-
-        if state_for_logic:
-            if state_for_logic in ["Rajasthan", "Gujarat", "Haryana"]:
-                geo_zone = "Arid/Semi-Arid"
-                def_rain, def_slope, def_soil, def_lulc, def_drain = 0.35, 0.15, 0.25, 0.10, 0.15
-            elif state_for_logic in ["Himachal Pradesh", "Uttarakhand", "Sikkim", "Arunachal Pradesh", "Jammu and Kashmir", "Ladakh"]:
-                geo_zone = "Hilly/Mountainous"
-                def_rain, def_slope, def_soil, def_lulc, def_drain = 0.10, 0.40, 0.15, 0.10, 0.25
-            elif state_for_logic in ["Kerala", "Goa", "Konkan"]:
-                geo_zone = "Coastal/Wet"
-                def_rain, def_slope, def_soil, def_lulc, def_drain = 0.10, 0.30, 0.20, 0.20, 0.20
-            elif state_for_logic in ["Uttar Pradesh", "Bihar", "West Bengal", "Punjab"]:
-                geo_zone = "Alluvial Plains"
-                def_rain, def_slope, def_soil, def_lulc, def_drain = 0.20, 0.10, 0.15, 0.30, 0.25
+        geo_zone = rwh.detect_zone(st.session_state.get('detected_state', None))
+        def_w = rwh.ZONE_WEIGHTS[geo_zone]
 
         st.info(f"Detected Zone: **{geo_zone}**")
         st.caption("Weights auto-adjusted for this terrain.")
 
         st.markdown("**Criteria Weights (0-1)**")
-        w_rain = st.slider("Rainfall", 0.0, 1.0, def_rain, 0.05)
-        w_slope = st.slider("Slope (Topography)", 0.0, 1.0, def_slope, 0.05)
-        w_soil = st.slider("Soil Texture", 0.0, 1.0, def_soil, 0.05)
-        w_lulc = st.slider("Land Use", 0.0, 1.0, def_lulc, 0.05)
-        w_drain = st.slider("Drainage Density", 0.0, 1.0, def_drain, 0.05)
+        w_rain = st.slider("Rainfall", 0.0, 1.0, def_w['rain'], 0.05)
+        w_slope = st.slider("Slope (Topography)", 0.0, 1.0, def_w['slope'], 0.05)
+        w_soil = st.slider("Soil Texture", 0.0, 1.0, def_w['soil'], 0.05)
+        w_lulc = st.slider("Land Use", 0.0, 1.0, def_w['lulc'], 0.05)
+        w_drain = st.slider("Drainage Density", 0.0, 1.0, def_w['drain'], 0.05)
         
         total = w_rain + w_slope + w_soil + w_lulc + w_drain
         if total == 0: total = 1
-        params = {'type': rwh_type, 'w': {'rain': w_rain/total, 'slope': w_slope/total, 'soil': w_soil/total, 'lulc': w_lulc/total, 'drain': w_drain/total}}
+        params = {'type': rwh_type, 'zone': geo_zone, 'w': {'rain': w_rain/total, 'slope': w_slope/total, 'soil': w_soil/total, 'lulc': w_lulc/total, 'drain': w_drain/total}}
 
     elif app_mode == "Encroachment (S1 SAR)":
         st.markdown("### 3. Comparison Dates")
@@ -170,32 +205,79 @@ with st.sidebar:
         col1, col2 = st.columns(2)
         pre_start = col1.date_input("Pre Start", datetime(2023, 4, 1))
         pre_end = col2.date_input("Pre End", datetime(2023, 6, 1))
-        st.markdown("**After Flood (Wet)**")
+        multi_event = st.checkbox("Multi-event (season)", help="Maps every post-event window of a season against the same dry baseline.")
+        st.markdown("**Season (Wet)**" if multi_event else "**After Flood (Wet)**")
         col3, col4 = st.columns(2)
-        post_start = col3.date_input("Post Start", datetime(2023, 9, 29))
+        post_start = col3.date_input("Post Start", datetime(2023, 6, 15) if multi_event else datetime(2023, 9, 29))
         post_end = col4.date_input("Post End", datetime(2023, 10, 15))
         threshold = st.slider("Difference Threshold", 1.0, 1.5, 1.25, 0.05)
         params = {'pre_start': pre_start.strftime("%Y-%m-%d"), 'pre_end': pre_end.strftime("%Y-%m-%d"), 'post_start': post_start.strftime("%Y-%m-%d"), 'post_end': post_end.strftime("%Y-%m-%d"), 'threshold': threshold, 'orbit': orbit}
+        if multi_event:
+            # Sentinel-1 revisits every 12 days, so one window per pass by default
+            window = st.number_input("Window Length (days)", 1, 60, 12)
+            events, day = [], post_start
+            while day < post_end:
+                nxt = min(post_end, day + timedelta(days=int(window)))
+                events.append((day.strftime("%Y-%m-%d"), nxt.strftime("%Y-%m-%d")))
+                day = nxt
+            params['events'] = events
+            st.caption(f"{len(events)} post-event windows")
 
     elif app_mode == "Water Quality":
         st.markdown("### 3. Monitoring Config")
-        wq_param = st.selectbox("Parameter", ["Turbidity (NDTI)", "Total Suspended Solids (TSS)", "Cyanobacteria Index", "Chlorophyll-a", "CDOM (Organic Matter)"])
+        wq_param = st.selectbox("Parameter", ["Turbidity (NDTI)", "Total Suspended Solids (TSS)", "Cyanobacteria Index", "Chlorophyll-a", "CDOM (Organic Matter)"], key='wq_param')
+        all_indices = st.checkbox("Compute all indices (single pass)", help="Computes all five indices in one run; switching Parameter then only re-styles the cached results.")
         st.markdown("**Timeframe**")
         col1, col2 = st.columns(2)
         wq_start = col1.date_input("Start", datetime.now()-timedelta(days=90))
         wq_end = col2.date_input("End", datetime.now())
         cloud_thresh = st.slider("Max Cloud Cover %", 5, 50, 20)
-        params = {'param': wq_param, 'start': wq_start.strftime("%Y-%m-%d"), 'end': wq_end.strftime("%Y-%m-%d"), 'cloud': cloud_thresh}
+        params = {'param': wq_param, 'start': wq_start.strftime("%Y-%m-%d"), 'end': wq_end.strftime("%Y-%m-%d"), 'cloud': cloud_thresh, 'all_indices': all_indices}
+
+    elif app_mode == "Waterbody Inventory":
+        st.markdown("### 3. Inventory Config")
+        # No default: global lake datasets (e.g. HydroLAKES, >= 10 ha) miss village-scale tanks and ponds
+        asset = st.text_input("Waterbody Polygons (EE Asset)", "", placeholder="projects/<project>/assets/<waterbodies>",
+                              help="FeatureCollection of the waterbodies to track, e.g. a surveyed tank/Amrit Sarovar layer.")
+        id_field = st.text_input("ID Property", "id")
+        season = st.selectbox("Season", list(inventory.SEASONS))
+        orbit = st.radio("Orbit Pass", ["BOTH", "ASCENDING", "DESCENDING"])
+        water_db = st.slider("Water Threshold (dB)", -25.0, -10.0, float(encroachment.WATER_DB), 0.5)
+        col1, col2 = st.columns(2)
+        year_start = col1.number_input("From Year", 2015, datetime.now().year, 2017)
+        year_end = col2.number_input("To Year", 2015, datetime.now().year, datetime.now().year - 1)
+        drop_pct = st.slider("Flag Area Drop > (%)", 5, 90, 30)
+        params = {'asset': asset.strip(), 'id_field': id_field, 'season': season, 'year_start': int(year_start), 'year_end': int(max(year_start, year_end)),
+                  'drop_pct': drop_pct, 'orbit': orbit, 'water_db': water_db}
+        if not params['asset']: st.warning("Enter a waterbody polygon asset to run the inventory.")
+
+    if app_mode in ["Encroachment (S1 SAR)", "Flood Extent Mapping", "Water Quality"]:
+        params['progressive'] = st.checkbox("Progressive preview", value=True, help="Shows coarse preliminary statistics first on large ROIs and refines them at full resolution in the background.")
 
     st.markdown("###")
     if st.button("RUN ANALYSIS"):
-        if st.session_state['roi']:
+        if st.session_state['roi'] and not roi_ok:
+            st.error("ROI exceeds the module's processing budget.")
+        elif st.session_state['roi']:
             st.session_state['calculated'] = True
             st.session_state['mode'] = app_mode
             st.session_state['params'] = params
+            # Persist the analysis so a reload of this URL restores it, and index the ROI for reuse
+            roi_json = helpers.roi_geojson(st.session_state['roi'])
+            roi_index.register(roi_json)
+            st.query_params['job'] = jobs.save_analysis(app_mode, params, roi_json)
         else:
             st.error("Please draw or select an ROI first.")
 
+    # Result store usage on this server (staged arrays, grids and series are shared between sessions)
+    mem = session_store.metrics()
+    with st.expander("Memory"):
+        st.caption(f"This session: {mem['session_bytes'] / session_store.MB:.1f} / {session_store.SESSION_BYTES / session_store.MB:.0f} MB ({mem['session_items']} items)")
+        st.caption(f"Shared in memory: {mem['resident_bytes'] / session_store.MB:.1f} / {session_store.MEMORY_BYTES / session_store.MB:.0f} MB ({mem['resident_items']} items)")
+        st.caption(f"On disk: {mem['disk_bytes'] / session_store.MB:.1f} / {session_store.DISK_BYTES / session_store.MB:.0f} MB")
+        st.caption(f"Active sessions: {mem['active_sessions']} referencing {mem['referenced_bytes'] / session_store.MB:.1f} MB")
+        st.caption(f"Hits {mem['hits']} | disk loads {mem['loads']} | evictions {mem['memory_evictions'] + mem['session_evictions'] + mem['disk_evictions']}")
+
 
 # --- 5. MAIN CONTENT ---
 st.markdown(f"""
@@ -220,7 +302,9 @@ if roi_method == "Draw on Map" and st.session_state['roi'] is None:
     if st.button("Set as ROI", type="primary"):
         if map_output and isinstance(map_output, dict) and map_output.get('last_active_drawing'):
             drawn_geom = map_output['last_active_drawing']['geometry']
-            ee_geom = helpers.geojson_to_ee(drawn_geom)
+            # Circles arrive as a Point with the radius in the feature properties
+            radius = (map_output['last_active_drawing'].get('properties') or {}).get('radius')
+            ee_geom = helpers.geojson_to_ee(drawn_geom, radius)
             
             if ee_geom:
                 st.session_state['roi'] = ee_geom
@@ -288,6 +372,8 @@ else:
         image_to_export, vis_export = flood.render(m, roi, p, col_res)
     elif mode == "Water Quality":
         image_to_export, vis_export = water_quality.render(m, roi, p, col_res)
+    elif mode == "Waterbody Inventory":
+        image_to_export, vis_export = inventory.render(m, roi, p, col_res)
 
     # --- EXPORT TOOLS (COMMON) ---
     with col_res:
@@ -305,6 +391,28 @@ else:
             else:
                 st.warning("No result to export.")
 
+        module = MODULES[mode]
+        if image_to_export and hasattr(module, 'vector_zones'):
+            st.markdown("---")
+            vec_fmt = st.selectbox("Vector Format", list(vector_export.FORMATS))
+            if st.button("Export Zones (Vector)"):
+                with st.spinner("Vectorising zones..."):
+                    try:
+                        zones, names = module.vector_zones(image_to_export)
+                        path = vector_export.export(zones, helpers.roi_geojson(roi), module.PIXEL_BUDGET['scale'], names, vec_fmt,
+                                                    name=f"GeoSarovar_{mode.split(' ')[0]}_zones")
+                        st.session_state['vector_export'] = (mode, vec_fmt, path)
+                    except Exception as e:
+                        st.error(f"Vector Export Error: {e}")
+            saved = st.session_state.get('vector_export')
+            if saved and not os.path.exists(saved[2]):
+                # Pruned from the cache since it was exported
+                st.session_state.pop('vector_export')
+            elif saved and saved[:2] == (mode, vec_fmt):
+                mime = vector_export.FORMATS[vec_fmt][1]
+                with open(saved[2], 'rb') as f:
+                    st.download_button(f"Download {vec_fmt}", f, os.path.basename(saved[2]), mime, use_container_width=True)
+
         st.markdown("---")
         report_title = st.text_input("Report Title", f"Analysis: {mode}")
         if st.button("Generate Map Image"):
@@ -323,6 +431,35 @@ else:
                     buf = helpers.generate_static_map_display(image_to_export, roi, vis_export, report_title, cmap_colors=cmap, is_categorical=is_cat, class_names=c_names)
                     if buf:
                         st.download_button("Download JPG", buf, "GeoSarovar_Map.jpg", "image/jpeg", use_container_width=True)
+
+        # Multi-page PDF: analyses queued here for this ROI are re-run (or read from cache) in one go
+        st.markdown("---")
+        roi_fp = helpers.roi_fingerprint(roi)
+        if st.session_state.get('report_items', (None,))[0] != roi_fp:
+            st.session_state['report_items'] = (roi_fp, [])
+        report_items = st.session_state['report_items'][1]
+        if hasattr(MODULES[mode], 'report_page') and st.button("Add to PDF Report"):
+            if (mode, p) not in report_items: report_items.append((mode, dict(p)))
+        if report_items:
+            st.caption(f"{len(report_items)} page(s): " + ", ".join(m_ for m_, _ in report_items))
+            c1, c2 = st.columns(2)
+            if c1.button("Build PDF"):
+                with st.spinner(f"Building {len(report_items) + 1}-page report..."):
+                    try:
+                        st.session_state['report_pdf'] = report.build(roi, [(m_, MODULES[m_], p_) for m_, p_ in report_items], report_title)
+                    except Exception as e:
+                        st.error(f"Report Error: {e}")
+            if c2.button("Clear Pages"):
+                report_items.clear()
+                st.session_state.pop('report_pdf', None)
+        if st.session_state.get('report_pdf') and not os.path.exists(st.session_state['report_pdf'][0]):
+            st.session_state.pop('report_pdf')
+        if st.session_state.get('report_pdf'):
+            pdf_path, timings = st.session_state['report_pdf']
+            with open(pdf_path, 'rb') as f:
+                st.download_button("Download PDF Report", f, os.path.basename(pdf_path), "application/pdf", use_container_width=True)
+            st.caption(f"Total {timings[['Analysis (s)', 'Render (s)', 'Write (s)']].to_numpy().sum():.1f} s of page work")
+            st.dataframe(timings, hide_index=True, use_container_width=True)
         st.markdown("</div>", unsafe_allow_html=True)
 
     with col_map:
@@ -0,0 +1,100 @@
+"""Expression-graph size of the module requests, before and after utils.graph_opt.
+
+Usage:
+    python benchmark_graphs.py --project my-ee-project [--lon 73.85 --lat 18.52 --size 0.1] [--evaluate]
+
+Builds the graphs the modules actually submit over a square ROI: the metric reductions and the
+map tile layers (each image visualised as map_utils.tile_graph does before getMapId). For every graph it prints the
+expanded tree size, distinct nodes as submitted and after optimisation, the node delta and removed
+clips. With --evaluate each metric request is also sent to Earth Engine as-is and optimised, and timed.
+"""
+import argparse
+import time
+import ee
+import pandas as pd
+
+import utils.graph_opt as graph_opt
+import utils.helpers as helpers
+import utils.geometry as geometry
+import modules.encroachment as encroachment
+import modules.flood as flood
+import modules.rainfall as rainfall
+import modules.rwh as rwh
+
+ENCROACHMENT = {'d1_start': '2018-01-01', 'd1_end': '2018-03-31', 'd2_start': '2024-01-01', 'd2_end': '2024-03-31', 'orbit': "DESCENDING"}
+FLOOD = {'pre_start': '2023-05-01', 'pre_end': '2023-05-31', 'post_start': '2023-08-01', 'post_end': '2023-08-15', 'orbit': "DESCENDING", 'threshold': 1.25}
+RAINFALL = {'dataset': "CHIRPS", 'start': '2023-06-01', 'end': '2023-09-30', 'calc_mode': "Total Accumulation (mm)"}
+RWH = {'type': rwh.STRUCTURES[0], 'w': list(rwh.ZONE_WEIGHTS.values())[0]}
+
+def encroachment_graphs(roi):
+    layers = encroachment.change_layers(roi, ENCROACHMENT)
+    if not layers: return {}, {}
+    _, _, loss, gain, change_map, _, _ = layers
+    # Same two-band reduction as encroachment.change_areas
+    area = ee.Image.pixelArea()
+    metric = graph_opt.band_reduction({'loss': loss.unmask(0).multiply(area), 'gain': gain.unmask(0).multiply(area)},
+                                      ee.Reducer.sum(), roi, 10, maxPixels=1e9)
+    return {'encroachment areas': metric}, {'encroachment loss tiles': (loss, {'palette': 'red'}),
+                                            'encroachment change map': (change_map, encroachment.CHANGE_VIS)}
+
+def flood_graphs(roi):
+    layers = flood.flood_layers(roi, FLOOD)
+    if not layers: return {}, {}
+    _, after_f, flooded, _, _ = layers
+    metric = flooded.multiply(ee.Image.pixelArea()).reduceRegion(ee.Reducer.sum(), roi, 10, bestEffort=True).values().get(0)
+    return {'flood area': metric}, {'flood after tiles': (after_f, {'min': -25, 'max': 0}),
+                                    'flood extent tiles': (flooded, {'palette': ['#0000FF']})}
+
+def rwh_graphs(roi):
+    criteria, final_idx = rwh.suitability_image(roi, RWH, rwh.rain_range())
+    metric = final_idx.reduceRegion(ee.Reducer.mean(), roi, scale=1000, bestEffort=True).values().get(0)
+    return {'rwh mean': metric}, {'rwh rain input tiles': (criteria.select('rain'), {'min': 0, 'max': 1, 'palette': ['white', 'blue']}),
+                                       'rwh slope input tiles': (criteria.select('slope'), {'min': 0, 'max': 1, 'palette': ['black', 'white']}),
+                                       'rwh suitability tiles': (final_idx, rwh.SUIT_VIS),
+                                       'rwh high potential tiles': (final_idx.updateMask(final_idx.gt(rwh.HIGH_POTENTIAL)), {'palette': ['cyan']})}
+
+def rainfall_graphs(roi):
+    spec = rainfall.dataset_spec(RAINFALL['dataset'])
+    col = ee.ImageCollection(spec['id']).filterDate(RAINFALL['start'], RAINFALL['end']).filterBounds(roi)
+    layer, vis, _ = rainfall.rain_layer(col, roi, RAINFALL, spec)
+    metric = layer.reduceRegion(ee.Reducer.mean(), roi, scale=spec['scale'], bestEffort=True)
+    return {'rainfall mean': metric}, {'rainfall tiles': (layer, vis)}
+
+def timed(fn):
+    t0 = time.time()
+    fn()
+    return round(time.time() - t0, 2)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--project', required=True, help="Earth Engine cloud project")
+    parser.add_argument('--lon', type=float, default=73.85)
+    parser.add_argument('--lat', type=float, default=18.52)
+    parser.add_argument('--size', type=float, default=0.1, help="ROI edge in degrees")
+    parser.add_argument('--evaluate', action='store_true', help="Also time both versions of the metric requests on Earth Engine")
+    args = parser.parse_args()
+    ee.Initialize(project=args.project)
+
+    h = args.size / 2
+    roi = helpers.geojson_to_ee(geometry.bbox_polygon((args.lon - h, args.lat - h, args.lon + h, args.lat + h)))
+    metrics, tiles = {}, {}
+    for build in (encroachment_graphs, flood_graphs, rwh_graphs, rainfall_graphs):
+        m, t = build(roi)
+        metrics.update(m)
+        tiles.update(t)
+
+    rows = []
+    graphs = [(name, obj, True) for name, obj in metrics.items()] + [(name, img.visualize(**vis), False) for name, (img, vis) in tiles.items()]
+    for name, obj, is_metric in graphs:
+        t0 = time.time()
+        optimized, stats = graph_opt.optimize(obj, with_stats=True)
+        row = {'Graph': name, 'Kind': "metric" if is_metric else "tiles", **(stats or {}), 'Optimise (ms)': round((time.time() - t0) * 1000, 1)}
+        if stats: row['node_delta'] = stats['distinct_nodes'] - stats['optimized_nodes']
+        if args.evaluate and is_metric:
+            row['As built (s)'] = timed(obj.getInfo)
+            row['Optimised (s)'] = timed(optimized.getInfo)
+        rows.append(row)
+    print(pd.DataFrame(rows).to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -4,93 +4,189 @@ try:
 except Exception:
     import geemap
 import ee
+import numpy as np
+import utils.helpers as helpers
+import utils.jobs as jobs
+import utils.map_utils as map_utils
+import utils.raster as raster
+import utils.sar_local as sar_local
+import utils.progressive as progressive
+import utils.graph_opt as graph_opt
+import utils.session_store as session_store
+
+CHANGE_VIS = {'min': 1, 'max': 3, 'palette': ['cyan', 'red', 'blue']}
+# Working scale (m) and the largest ROI (in pixels at that scale) accepted before any request
+PIXEL_BUDGET = {'scale': 10, 'max_pixels': 1e8}
+WATER_DB = -16
+
+def get_sar_collection(start_d, end_d, roi_geom, orbit_pass):
+    s1 = ee.ImageCollection('COPERNICUS/S1_GRD')\
+        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))\
+        .filter(ee.Filter.eq('instrumentMode', 'IW'))\
+        .filterDate(start_d, end_d)\
+        .filterBounds(roi_geom)
+    if orbit_pass != "BOTH":
+        s1 = s1.filter(ee.Filter.eq('orbitProperties_pass', orbit_pass))
+    return s1
+
+def water_composite(col):
+    """Minimum of the speckle-filtered (50 m focal median) VV scenes."""
+    def speckle_filter(img): return img.select('VV').focal_median(50, 'circle', 'meters').rename('VV_smoothed')
+    return col.map(speckle_filter).min()
+
+def change_areas(loss, gain, roi, scale):
+    """Water loss and gain (ha) from one two-band area reduction."""
+    area = ee.Image.pixelArea()
+    vals = graph_opt.reduce_bands({'loss': loss.unmask(0).multiply(area), 'gain': gain.unmask(0).multiply(area)},
+                                  ee.Reducer.sum(), roi, scale, maxPixels=1e9)
+    return round((vals.get('loss') or 0) / 10000, 2), round((vals.get('gain') or 0) / 10000, 2)
+
+def vector_zones(image):
+    """Class image and class names for the vector export."""
+    return image.selfMask().toInt(), {1: 'Stable Water', 2: 'Encroachment', 3: 'New Water'}
+
+def process_water_mask(col, roi_geom):
+    """(water mask, first scene date) of a period; (None, "N/A") without scenes."""
+    if col.size().getInfo() == 0: return None, "N/A"
+    date_found = ee.Date(col.first().get('system:time_start')).format('YYYY-MM-dd').getInfo()
+    mosaic = water_composite(col).clip(roi_geom)
+    return mosaic.lt(WATER_DB).selfMask(), date_found
+
+def change_layers(roi, params):
+    """(initial water, final water, loss, gain, change classes, dates) between the two periods; None without scenes."""
+    col_initial = get_sar_collection(params['d1_start'], params['d1_end'], roi, params['orbit'])
+    col_final = get_sar_collection(params['d2_start'], params['d2_end'], roi, params['orbit'])
+
+    water_initial, date_init = process_water_mask(col_initial, roi)
+    water_final, date_fin = process_water_mask(col_final, roi)
+    if not (water_initial and water_final): return None
+
+    # Each unmasked period is built once and shared by the three classes
+    initial, final = water_initial.unmask(0), water_final.unmask(0)
+    encroachment = initial.And(final.Not()).selfMask()
+    new_water = initial.Not().And(final).selfMask()
+    stable_water = initial.And(final).selfMask()
+
+    change_map = ee.Image(0).where(stable_water, 1).where(encroachment, 2).where(new_water, 3).clip(roi).selfMask()
+    return water_initial, water_final, encroachment, new_water, change_map, date_init, date_fin
+
+def report_page(roi, params):
+    """Report content: change class map with water loss/gain areas."""
+    layers = change_layers(roi, params)
+    if not layers: raise ValueError("Insufficient SAR data for selected dates and orbit.")
+    _, _, encroachment, new_water, change_map, date_init, date_fin = layers
+    loss, gain = change_areas(encroachment, new_water, roi, 10)
+    legend = list(zip(['Stable Water', 'Encroachment', 'New Water'], CHANGE_VIS['palette']))
+    metrics = [("Water Loss (Encroachment)", f"{loss} Ha"), ("Water Gain", f"{gain} Ha"), ("Net Change", f"{round(gain - loss, 2)} Ha"),
+               ("Base", date_init), ("Current", date_fin), ("Orbit", params['orbit'])]
+    chart = {'kind': 'bar', 'x': ['Loss', 'Gain'], 'y': [loss, gain], 'ylabel': "Area (ha)", 'colors': ['red', 'blue']}
+    return {'title': "Encroachment (S1 SAR)", 'image': change_map, 'vis': CHANGE_VIS, 'legend': legend, 'metrics': metrics, 'chart': chart}
+
+@st.fragment
+def local_engine(roi, params):
+    """Stages both periods as local chips; the threshold slider then re-runs without server calls."""
+    key = (helpers.roi_fingerprint(roi), params['d1_start'], params['d1_end'], params['d2_start'], params['d2_end'], params['orbit'])
+    if st.button("Stage SAR Chips", help="Downloads the VV scenes of both periods once for local threshold tuning."):
+        with st.spinner("Staging Sentinel-1 chips..."):
+            try:
+                geo = helpers.roi_geojson(roi)
+                periods = [(params['d1_start'], params['d1_end']), (params['d2_start'], params['d2_end'])]
+                stacks = [sar_local.stage_stack(('enc_vv', s, e, params['orbit']), geo,
+                                                get_sar_collection(s, e, roi, params['orbit']).select('VV').toBands())
+                          for s, e in periods]
+                grid_bounds = stacks[0][1]['bounds']
+                radius = sar_local.radius_px(50, grid_bounds)
+                composites = [sar_local.water_composite(stack, radius) for stack, _ in stacks]
+                session_store.put('enc_local', (composites, grid_bounds, raster.polygon_mask(geo, grid_bounds, composites[0].shape)), key=key)
+            except Exception as e: st.error(f"Staging Error: {e}")
+
+    cached = session_store.get('enc_local', key=key)
+    if cached:
+        (comp_initial, comp_final), bounds, roi_mask = cached
+        threshold = st.slider("Water Threshold (dB)", -25.0, -10.0, float(WATER_DB), 0.5)
+        initial = sar_local.water_mask(comp_initial, threshold) & roi_mask
+        final = sar_local.water_mask(comp_final, threshold) & roi_mask
+        loss, gain = initial & ~final, ~initial & final
+
+        c1, c2 = st.columns(2)
+        c1.metric("Water Loss", f"{round(sar_local.area_ha(loss, bounds), 2)} Ha")
+        c2.metric("Water Gain", f"{round(sar_local.area_ha(gain, bounds), 2)} Ha")
+        change = np.full(loss.shape, np.nan, dtype=np.float32)
+        change[initial & final], change[loss], change[gain] = 1, 2, 3
+        st.image(raster.to_rgba(change, CHANGE_VIS), use_container_width=True)
+        st.caption("Local preview: stable (cyan), loss (red), gain (blue)")
+
+def analysis(roi, params):
+    """Map layers, change areas (coarse when progressive) and dates of one run; runs as a background job."""
+    layers = change_layers(roi, params)
+    if not layers: raise ValueError("Insufficient SAR data for selected dates and orbit.")
+    water_initial, water_final, encroachment, new_water, change_map, date_init, date_fin = layers
+    coarse = progressive.auto_scale(roi, 10) if params.get('progressive') else 10
+    return {'split': [map_utils.tile_layer(water_initial, {'palette': 'blue'}, "Initial Water"),
+                      map_utils.tile_layer(water_final, {'palette': 'cyan'}, "Final Water")],
+            'layers': [map_utils.tile_layer(encroachment, {'palette': 'red'}, '🔴 Encroachment (Loss)'),
+                       map_utils.tile_layer(new_water, {'palette': 'blue'}, '🔵 New Water (Gain)')],
+            'areas': change_areas(encroachment, new_water, roi, coarse), 'scale': coarse,
+            'dates': (date_init, date_fin), 'export': map_utils.image_json(change_map)}
+
+def full_areas(roi, params):
+    _, _, encroachment, new_water, _, _, _ = change_layers(roi, params)
+    return change_areas(encroachment, new_water, roi, 10)
 
 def render(m, roi, params, col_res):
     st.markdown("### Encroachment Detection Results")
-    with st.spinner("Processing Sentinel-1 SAR Data..."):
-
-        def get_sar_collection(start_d, end_d, roi_geom, orbit_pass):
-            s1 = ee.ImageCollection('COPERNICUS/S1_GRD')\
-                .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))\
-                .filter(ee.Filter.eq('instrumentMode', 'IW'))\
-                .filterDate(start_d, end_d)\
-                .filterBounds(roi_geom)
-            if orbit_pass != "BOTH":
-                s1 = s1.filter(ee.Filter.eq('orbitProperties_pass', orbit_pass))
-            return s1
-
-        def process_water_mask(col, roi_geom):
-            if col.size().getInfo() == 0: return None, "N/A"
-            date_found = ee.Date(col.first().get('system:time_start')).format('YYYY-MM-dd').getInfo()
-            def speckle_filter(img): return img.select('VV').focal_median(50, 'circle', 'meters').rename('VV_smoothed')
-            mosaic = col.map(speckle_filter).min().clip(roi_geom)
-            water_mask = mosaic.lt(-16).selfMask()
-            return water_mask, date_found
-
-        try:
-            col_initial = get_sar_collection(params['d1_start'], params['d1_end'], roi, params['orbit'])
-            col_final = get_sar_collection(params['d2_start'], params['d2_end'], roi, params['orbit'])
-
-            water_initial, date_init = process_water_mask(col_initial, roi)
-            water_final, date_fin = process_water_mask(col_final, roi)
-
-            if water_initial and water_final:
-                encroachment = water_initial.unmask(0).And(water_final.unmask(0).Not()).selfMask()
-                new_water = water_initial.unmask(0).Not().And(water_final.unmask(0)).selfMask()
-                stable_water = water_initial.unmask(0).And(water_final.unmask(0)).selfMask()
-
-                change_map = ee.Image(0).where(stable_water, 1).where(encroachment, 2).where(new_water, 3).clip(roi).selfMask()
-                image_to_export = change_map
-                vis_export = {'min': 1, 'max': 3, 'palette': ['cyan', 'red', 'blue']}
-
-                left_layer = geemap.ee_tile_layer(water_initial, {'palette': 'blue'}, "Initial Water")
-                right_layer = geemap.ee_tile_layer(water_final, {'palette': 'cyan'}, "Final Water")
-                m.split_map(left_layer, right_layer)
-
-                m.addLayer(encroachment, {'palette': 'red'}, '🔴 Encroachment (Loss)')
-                m.addLayer(new_water, {'palette': 'blue'}, '🔵 New Water (Gain)')
-
-                pixel_area = encroachment.multiply(ee.Image.pixelArea())
-                val_loss = pixel_area.reduceRegion(ee.Reducer.sum(), roi, 10, maxPixels=1e9).values().get(0).getInfo()
-                loss_ha = round((val_loss or 0) / 10000, 2)
-
-                pixel_area_gain = new_water.multiply(ee.Image.pixelArea())
-                val_gain = pixel_area_gain.reduceRegion(ee.Reducer.sum(), roi, 10, maxPixels=1e9).values().get(0).getInfo()
-                gain_ha = round((val_gain or 0) / 10000, 2)
-
-                with col_res:
-                    st.markdown('<div class="alert-card">', unsafe_allow_html=True)
-                    st.markdown(f"### Change Report")
-                    st.metric("Water Loss", f"{loss_ha} Ha", help="Potential Encroachment")
-                    st.metric("Water Gain", f"{gain_ha} Ha", help="Flooding/New Storage")
-
-                    st.markdown(f"""
-                    <div class="date-badge">Base: {date_init}</div>
-                    <div class="date-badge">Curr: {date_fin}</div>
-                    """, unsafe_allow_html=True)
-                    st.markdown("</div>", unsafe_allow_html=True)
-
-                    st.markdown('<div class="glass-card">', unsafe_allow_html=True)
-                    st.markdown('<div class="card-label">TIMELAPSE</div>', unsafe_allow_html=True)
-                    if st.button("Create Timelapse"):
-                        with st.spinner("Generating GIF..."):
-                            try:
-                                s1_tl = get_sar_collection(params['d1_start'], params['d2_end'], roi, params['orbit']).select('VV')
-                                video_args = {'dimensions': 600, 'region': roi, 'framesPerSecond': 5, 'min': -25, 'max': -5, 'palette': ['black', 'blue', 'white']}
-                                # Note: geemap.create_timeseries might be available in foliumap or implicitly
-                                # If it fails, we might need a standard geemap import. 
-                                # For now assuming it works as per original code.
-                                monthly = geemap.create_timeseries(s1_tl, params['d1_start'], params['d2_end'], frequency='year', reducer='median')
-                                gif_url = monthly.getVideoThumbURL(video_args)
-                                st.image(gif_url, caption="Radar Intensity (Dark=Water)", use_container_width=True)
-                            except Exception as e: st.error(f"Timelapse Error: {e}")
-                    st.markdown("</div>", unsafe_allow_html=True)
-                
-                return image_to_export, vis_export
+    try:
+        key = ('encroachment', helpers.roi_fingerprint(roi), params)
+        result = progressive.analysis(key, lambda: analysis(roi, params), jobs.expiry(params['d2_end']), "Processing Sentinel-1 SAR Data...")
+        if result is None: return None, {}
+        date_init, date_fin = result['dates']
+
+        left_layer, right_layer = result['split']
+        m.split_map(map_utils.tile(left_layer), map_utils.tile(right_layer))
+        map_utils.add_tiles(m, result['layers'])
 
+        def show_areas(areas):
+            st.metric("Water Loss", f"{areas[0]} Ha", help="Potential Encroachment")
+            st.metric("Water Gain", f"{areas[1]} Ha", help="Flooding/New Storage")
+
+        with col_res:
+            st.markdown('<div class="alert-card">', unsafe_allow_html=True)
+            st.markdown(f"### Change Report")
+            # Coarse areas first with the 10 m pass in the background
+            if result['scale'] > 10:
+                progressive.refine(key + ('areas',), lambda: full_areas(roi, params), show_areas,
+                                   lambda: show_areas(result['areas']), jobs.expiry(params['d2_end']))
             else:
-                st.warning("Insufficient SAR data for selected dates and orbit.")
-                return ee.Image(0), {}
-        except Exception as e:
-            st.error(f"Computation Error: {e}")
-            return None, {}
+                show_areas(result['areas'])
+
+            st.markdown(f"""
+            <div class="date-badge">Base: {date_init}</div>
+            <div class="date-badge">Curr: {date_fin}</div>
+            """, unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+
+            st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+            st.markdown('<div class="card-label">TIMELAPSE</div>', unsafe_allow_html=True)
+            if st.button("Create Timelapse"):
+                with st.spinner("Generating GIF..."):
+                    try:
+                        s1_tl = get_sar_collection(params['d1_start'], params['d2_end'], roi, params['orbit']).select('VV')
+                        video_args = {'dimensions': 600, 'region': roi, 'framesPerSecond': 5, 'min': -25, 'max': -5, 'palette': ['black', 'blue', 'white']}
+                        # Note: geemap.create_timeseries might be available in foliumap or implicitly
+                        # If it fails, we might need a standard geemap import. 
+                        # For now assuming it works as per original code.
+                        monthly = geemap.create_timeseries(s1_tl, params['d1_start'], params['d2_end'], frequency='year', reducer='median')
+                        gif_url = monthly.getVideoThumbURL(video_args)
+                        st.image(gif_url, caption="Radar Intensity (Dark=Water)", use_container_width=True)
+                    except Exception as e: st.error(f"Timelapse Error: {e}")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+            st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+            st.markdown('<div class="card-label">LOCAL ENGINE</div>', unsafe_allow_html=True)
+            local_engine(roi, params)
+            st.markdown("</div>", unsafe_allow_html=True)
+
+        return map_utils.image_from_json(result['export']), CHANGE_VIS
+    except Exception as e:
+        st.error(f"Computation Error: {e}")
+        return None, {}
@@ -1,76 +1,257 @@
 import streamlit as st
 import ee
+import numpy as np
+import pandas as pd
+import utils.helpers as helpers
+import utils.jobs as jobs
+import utils.map_utils as map_utils
+import utils.raster as raster
+import utils.sar_local as sar_local
+import utils.progressive as progressive
+import utils.pruning as pruning
+import utils.graph_opt as graph_opt
+import utils.session_store as session_store
 
-def render(m, roi, params, col_res):
-    st.markdown("### Flood Extent Mapping Results")
-    with st.spinner("Processing Flood Extent..."):
-        try:
-            collection = ee.ImageCollection('COPERNICUS/S1_GRD') \
-                .filter(ee.Filter.eq('instrumentMode', 'IW')) \
-                .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')) \
-                .filter(ee.Filter.eq('resolution_meters', 10)) \
-                .filterBounds(roi) \
-                .select('VH')
+SMOOTHING = 50  # meters
+# A post-event pass is often the only acquisition, so any scene with valid pixels over the ROI is kept
+# (pruning then only drops same-date duplicates)
+POST_MIN_COVERAGE = 0.01
+# Working scale (m) and the largest ROI (in pixels at that scale) accepted before any request
+PIXEL_BUDGET = {'scale': 10, 'max_pixels': 1e8}
+
+def s1_collection(roi, orbit):
+    collection = ee.ImageCollection('COPERNICUS/S1_GRD') \
+        .filter(ee.Filter.eq('instrumentMode', 'IW')) \
+        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')) \
+        .filter(ee.Filter.eq('resolution_meters', 10)) \
+        .filterBounds(roi) \
+        .select('VH')
+
+    if orbit != "BOTH":
+        collection = collection.filter(ee.Filter.eq('orbitProperties_pass', orbit))
+    return collection
+
+def post_scenes(collection, roi, start, end):
+    """Post-event scenes of a window, pruned exactly as the EE and local paths both mosaic them."""
+    return pruning.prune(collection.filterDate(start, end), roi, helpers.roi_geojson(roi), "COPERNICUS/S1_GRD",
+                         min_coverage=POST_MIN_COVERAGE)
+
+def static_mask():
+    """Excludes permanent water (JRC occurrence > 30%) and slopes >= 5 degrees."""
+    gsw = ee.Image("JRC/GSW1_4/GlobalSurfaceWater")
+    permanent_water_mask = gsw.select('occurrence').gt(30)
 
-            if params['orbit'] != "BOTH":
-                collection = collection.filter(ee.Filter.eq('orbitProperties_pass', params['orbit']))
+    dem = ee.Image('WWF/HydroSHEDS/03VFDEM')
+    slope = ee.Algorithms.Terrain(dem).select('slope')
+    return permanent_water_mask.Not().And(slope.lt(5))
 
-            before_col = collection.filterDate(params['pre_start'], params['pre_end'])
-            after_col = collection.filterDate(params['post_start'], params['post_end'])
+def detect_flood(before_f, after_f, mask, threshold):
+    difference = after_f.divide(before_f)
+    flooded = difference.gt(threshold).updateMask(mask)
+    flooded = flooded.updateMask(flooded.connectedPixelCount().gte(8))
+    return flooded.selfMask()
 
-            if before_col.size().getInfo() > 0 and after_col.size().getInfo() > 0:
-                date_pre = ee.Date(before_col.first().get('system:time_start')).format('YYYY-MM-dd').getInfo()
-                date_post = ee.Date(after_col.first().get('system:time_start')).format('YYYY-MM-dd').getInfo()
+def flood_area_ha(flooded, roi, scale):
+    stats = flooded.multiply(ee.Image.pixelArea()).reduceRegion(reducer=ee.Reducer.sum(), geometry=roi, scale=scale, bestEffort=True)
+    return round((graph_opt.optimize(stats.values().get(0)).getInfo() or 0) / 10000, 2)
 
-                before = before_col.median().clip(roi)
-                after = after_col.mosaic().clip(roi)
+def vector_zones(image):
+    """Class image and class names for the vector export."""
+    return image.selfMask().toInt(), {1: 'Flood Extent'}
 
-                smoothing = 50
-                before_f = before.focal_mean(smoothing, 'circle', 'meters')
-                after_f = after.focal_mean(smoothing, 'circle', 'meters')
+def flood_layers(roi, params):
+    """(before, after, flooded, pre date, post date) for one event; None without scenes on both sides."""
+    collection = s1_collection(roi, params['orbit'])
 
-                difference = after_f.divide(before_f)
-                difference_binary = difference.gt(params['threshold'])
+    before_col = collection.filterDate(params['pre_start'], params['pre_end'])
+    # Post-event scenes barely touching the ROI or duplicating a same-date pass are not mosaicked
+    after_col = post_scenes(collection, roi, params['post_start'], params['post_end'])
+    if before_col.size().getInfo() == 0 or after_col.size().getInfo() == 0: return None
 
-                gsw = ee.Image("JRC/GSW1_4/GlobalSurfaceWater")
-                occurrence = gsw.select('occurrence')
-                permanent_water_mask = occurrence.gt(30)
+    date_pre = ee.Date(before_col.first().get('system:time_start')).format('YYYY-MM-dd').getInfo()
+    date_post = ee.Date(after_col.first().get('system:time_start')).format('YYYY-MM-dd').getInfo()
 
-                flooded = difference_binary.updateMask(permanent_water_mask.Not())
+    before_f = before_col.median().clip(roi).focal_mean(SMOOTHING, 'circle', 'meters')
+    after_f = after_col.mosaic().clip(roi).focal_mean(SMOOTHING, 'circle', 'meters')
+    return before_f, after_f, detect_flood(before_f, after_f, static_mask(), params['threshold']), date_pre, date_post
 
-                dem = ee.Image('WWF/HydroSHEDS/03VFDEM')
-                slope = ee.Algorithms.Terrain(dem).select('slope')
-                flooded = flooded.updateMask(slope.lt(5))
+def event_layers(roi, params):
+    """(before, frequency, max extent, per-event areas, max extent ha) for N post-event windows; None without scenes."""
+    collection = s1_collection(roi, params['orbit'])
+    before_col = collection.filterDate(params['pre_start'], params['pre_end'])
+    season = (params['events'][0][0], params['events'][-1][1])
+    post_col = post_scenes(collection, roi, *season)
 
-                flooded = flooded.updateMask(flooded.connectedPixelCount().gte(8))
-                flooded = flooded.selfMask()
+    # One request for every scene count (baseline first)
+    counts = ee.List([before_col.size()] + [post_col.filterDate(s, e).size() for s, e in params['events']]).getInfo()
+    events = [w for w, n in zip(params['events'], counts[1:]) if n > 0]
+    if counts[0] == 0 or not events: return None
 
-                vis_export = {'min': 0, 'max': 1, 'palette': ['#0000FF']}
+    # Shared baseline, masks and filtered pre-image are built once
+    before_f = before_col.median().clip(roi).focal_mean(SMOOTHING, 'circle', 'meters')
+    mask = static_mask()
+    threshold = params['threshold']
 
-                m.addLayer(before_f, {'min': -25, 'max': 0}, 'Before Flood (Dry)', False)
-                m.addLayer(after_f, {'min': -25, 'max': 0}, 'After Flood (Wet)', True)
-                m.addLayer(flooded, {'palette': ['#0000FF']}, 'Estimated Flood Extent')
+    def map_event(window):
+        window = ee.List(window)
+        after_f = post_col.filterDate(window.get(0), window.get(1)).mosaic().clip(roi).focal_mean(SMOOTHING, 'circle', 'meters')
+        return detect_flood(before_f, after_f, mask, threshold).unmask(0).rename('flood').toByte()
 
-                flood_stats = flooded.multiply(ee.Image.pixelArea()).reduceRegion(reducer=ee.Reducer.sum(), geometry=roi, scale=10, bestEffort=True)
-                flood_area_ha = round(flood_stats.values().get(0).getInfo() / 10000, 2)
+    event_col = ee.ImageCollection(ee.List([list(w) for w in events]).map(map_event))
+    frequency = event_col.sum().clip(roi)
+    max_extent = frequency.gt(0).selfMask().rename('flood')
 
-                with col_res:
-                    st.markdown('<div class="alert-card">', unsafe_allow_html=True)
-                    st.markdown("### Flood Report")
-                    st.metric("Estimated Extent", f"{flood_area_ha} Ha")
-                    st.markdown(f"""
-                    <div class="date-badge">Pre: {date_pre}</div>
-                    <div class="date-badge">Post: {date_post}</div>
-                    """, unsafe_allow_html=True)
-                    st.caption(f"Orbit: {params['orbit']} | Pol: VH")
-                    st.markdown("</div>", unsafe_allow_html=True)
+    # All per-event areas (plus the max extent) from one grouped reduction over a band stack; bands are
+    # named here in event order rather than relying on the system:index prefixes toBands generates
+    names = [f"event_{i}" for i in range(len(events))]
+    stack = event_col.toBands().rename(names).addBands(max_extent.rename('max_extent')).multiply(ee.Image.pixelArea())
+    areas = graph_opt.optimize(stack.reduceRegion(reducer=ee.Reducer.sum(), geometry=roi, scale=10, bestEffort=True)).getInfo()
 
-                return flooded, vis_export
+    rows = []
+    for i, (s, e) in enumerate(events):
+        rows.append({'Event': i + 1, 'Window': f"{s} to {e}", 'Flood Area (Ha)': round((areas.get(names[i]) or 0) / 10000, 2)})
+    return before_f, frequency, max_extent, pd.DataFrame(rows), round((areas.get('max_extent') or 0) / 10000, 2)
 
+def report_page(roi, params):
+    """Report content: flood extent map and area (per-event areas in multi-event mode)."""
+    vis = {'min': 0, 'max': 1, 'palette': ['#0000FF']}
+    base = [("Orbit", params['orbit']), ("Threshold", params['threshold'])]
+    if params.get('events'):
+        layers = event_layers(roi, params)
+        if not layers: raise ValueError(f"No images found for Orbit: {params['orbit']} in these dates.")
+        _, _, max_extent, df_events, max_ha = layers
+        chart = {'kind': 'bar', 'x': df_events['Event'].tolist(), 'y': df_events['Flood Area (Ha)'].tolist(), 'xlabel': "Event", 'ylabel': "Flood area (ha)"}
+        metrics = [("Maximum Extent", f"{max_ha} Ha"), ("Events Mapped", f"{len(df_events)} / {len(params['events'])}")] + base
+        return {'title': "Flood Season", 'image': max_extent, 'vis': vis, 'legend': [('Flood Extent', '#0000FF')], 'metrics': metrics, 'chart': chart}
+    layers = flood_layers(roi, params)
+    if not layers: raise ValueError(f"No images found for Orbit: {params['orbit']} in these dates.")
+    _, _, flooded, date_pre, date_post = layers
+    metrics = [("Estimated Extent", f"{flood_area_ha(flooded, roi, 10)} Ha"), ("Pre-event", date_pre), ("Post-event", date_post)] + base
+    return {'title': "Flood Extent", 'image': flooded, 'vis': vis, 'legend': [('Flood Extent', '#0000FF')], 'metrics': metrics, 'chart': None}
+
+@st.fragment
+def local_engine(roi, params):
+    """Stages pre/post chips and the static mask; the threshold slider then re-runs locally."""
+    key = (helpers.roi_fingerprint(roi), params['pre_start'], params['pre_end'], params['post_start'], params['post_end'], params['orbit'])
+    if st.button("Stage SAR Chips", help="Downloads the VH scenes and static mask once for local threshold tuning."):
+        with st.spinner("Staging Sentinel-1 chips..."):
+            try:
+                geo = helpers.roi_geojson(roi)
+                collection = s1_collection(roi, params['orbit'])
+                (pre, meta), (post, _), (static, _) = [
+                    sar_local.stage_stack((name, *dates), geo, image) for name, dates, image in [
+                        ('flood_vh', (params['pre_start'], params['pre_end'], params['orbit']), collection.filterDate(params['pre_start'], params['pre_end']).toBands()),
+                        # The same pruned scenes the EE path mosaics
+                        ('flood_vh_pruned', (params['post_start'], params['post_end'], params['orbit']),
+                         post_scenes(collection, roi, params['post_start'], params['post_end']).toBands()),
+                        ('flood_static', (), static_mask().rename('static')),
+                    ]]
+                before_f, after_f = sar_local.flood_composites(pre, post, sar_local.radius_px(SMOOTHING, meta['bounds']))
+                valid = (np.asarray(static[0]) == 1) & raster.polygon_mask(geo, meta['bounds'], before_f.shape)
+                session_store.put('flood_local', (before_f, after_f, valid, meta['bounds']), key=key)
+            except Exception as e: st.error(f"Staging Error: {e}")
+
+    cached = session_store.get('flood_local', key=key)
+    if cached:
+        before_f, after_f, valid, bounds = cached
+        threshold = st.slider("Local Threshold", 1.0, 1.5, float(params['threshold']), 0.01)
+        flooded = sar_local.flood_mask(before_f, after_f, valid, threshold)
+        st.metric("Estimated Extent", f"{round(sar_local.area_ha(flooded, bounds), 2)} Ha")
+        st.image(raster.to_rgba(np.where(flooded, 1, np.nan), {'palette': ['#0000FF']}), use_container_width=True)
+        st.caption("Local preview of the flood mask")
+
+def analysis(roi, params):
+    """Map layers, flood area (coarse when progressive) and dates of one event; runs as a background job."""
+    layers = flood_layers(roi, params)
+    if not layers: raise ValueError(f"No images found for Orbit: {params['orbit']} in these dates.")
+    before_f, after_f, flooded, date_pre, date_post = layers
+    coarse = progressive.auto_scale(roi, 10) if params.get('progressive') else 10
+    return {'layers': [map_utils.tile_layer(before_f, {'min': -25, 'max': 0}, 'Before Flood (Dry)', False),
+                       map_utils.tile_layer(after_f, {'min': -25, 'max': 0}, 'After Flood (Wet)', True),
+                       map_utils.tile_layer(flooded, {'palette': ['#0000FF']}, 'Estimated Flood Extent')],
+            'area': flood_area_ha(flooded, roi, coarse), 'scale': coarse,
+            'dates': (date_pre, date_post), 'export': map_utils.image_json(flooded)}
+
+def events_analysis(roi, params):
+    """Map layers and per-event areas of a flood season; runs as a background job."""
+    layers = event_layers(roi, params)
+    if not layers: raise ValueError(f"No images found for Orbit: {params['orbit']} in these dates.")
+    before_f, frequency, max_extent, df_events, max_ha = layers
+    vis_freq = {'min': 1, 'max': len(df_events), 'palette': ['#c6dbef', '#6baed6', '#2171b5', '#08306b']}
+    return {'layers': [map_utils.tile_layer(before_f, {'min': -25, 'max': 0}, 'Before Flood (Dry)', False),
+                       map_utils.tile_layer(frequency.selfMask(), vis_freq, 'Flood Frequency (events)'),
+                       map_utils.tile_layer(max_extent, {'palette': ['#0000FF']}, 'Maximum Flood Extent', False)],
+            'vis_freq': vis_freq, 'events': df_events, 'max_ha': max_ha, 'export': map_utils.image_json(max_extent)}
+
+def render(m, roi, params, col_res):
+    if params.get('events'):
+        return render_events(m, roi, params, col_res)
+
+    st.markdown("### Flood Extent Mapping Results")
+    try:
+        key = ('flood', helpers.roi_fingerprint(roi), params)
+        result = progressive.analysis(key, lambda: analysis(roi, params), jobs.expiry(params['post_end']), "Processing Flood Extent...")
+        if result is None: return None, {}
+        date_pre, date_post = result['dates']
+
+        vis_export = {'min': 0, 'max': 1, 'palette': ['#0000FF']}
+        map_utils.add_tiles(m, result['layers'])
+
+        show_area = lambda ha: st.metric("Estimated Extent", f"{ha} Ha")
+        with col_res:
+            st.markdown('<div class="alert-card">', unsafe_allow_html=True)
+            st.markdown("### Flood Report")
+            # Coarse area first with the 10 m pass in the background
+            if result['scale'] > 10:
+                full = lambda: flood_area_ha(flood_layers(roi, params)[2], roi, 10)
+                progressive.refine(key + ('area',), full, show_area, lambda: show_area(result['area']), jobs.expiry(params['post_end']))
             else:
-                st.error(f"No images found for Orbit: {params['orbit']} in these dates.")
-                return None, {}
+                show_area(result['area'])
+            st.markdown(f"""
+            <div class="date-badge">Pre: {date_pre}</div>
+            <div class="date-badge">Post: {date_post}</div>
+            """, unsafe_allow_html=True)
+            st.caption(f"Orbit: {params['orbit']} | Pol: VH")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+            st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+            st.markdown('<div class="card-label">LOCAL ENGINE</div>', unsafe_allow_html=True)
+            local_engine(roi, params)
+            st.markdown("</div>", unsafe_allow_html=True)
+
+        return map_utils.image_from_json(result['export']), vis_export
+
+    except Exception as e:
+        st.error(f"Error: {e}")
+        return None, {}
+
+def render_events(m, roi, params, col_res):
+    """Maps N post-event windows against one shared dry baseline in a single batched graph."""
+    st.markdown("### Multi-Event Flood Mapping Results")
+    try:
+        key = ('flood_events', helpers.roi_fingerprint(roi), params)
+        result = progressive.analysis(key, lambda: events_analysis(roi, params), jobs.expiry(params['post_end']),
+                                      f"Processing {len(params['events'])} Flood Events...")
+        if result is None: return None, {}
+        df_events = result['events']
+
+        vis_export = {'min': 0, 'max': 1, 'palette': ['#0000FF']}
+        map_utils.add_tiles(m, result['layers'])
+        m.add_colorbar(result['vis_freq'], label="Flood Frequency (events)")
+
+        with col_res:
+            st.markdown('<div class="alert-card">', unsafe_allow_html=True)
+            st.markdown("### Season Report")
+            st.metric("Maximum Extent", f"{result['max_ha']} Ha")
+            st.metric("Events Mapped", f"{len(df_events)} / {len(params['events'])}")
+            st.bar_chart(df_events, x='Event', y='Flood Area (Ha)', color="#005792")
+            st.dataframe(df_events, hide_index=True, use_container_width=True)
+            st.download_button("Download CSV", df_events.to_csv(index=False).encode('utf-8'), "flood_events.csv", "text/csv")
+            st.caption(f"Orbit: {params['orbit']} | Pol: VH")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+        return map_utils.image_from_json(result['export']), vis_export
 
-        except Exception as e:
-            st.error(f"Error: {e}")
-            return None, {}
+    except Exception as e:
+        st.error(f"Error: {e}")
+        return None, {}
@@ -0,0 +1,239 @@
+import streamlit as st
+import ee
+import os
+import heapq
+import math
+import pandas as pd
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+import modules.encroachment as encroachment
+import utils.helpers as helpers
+import utils.jobs as jobs
+import utils.map_utils as map_utils
+import utils.progressive as progressive
+from utils.cache import cache_path
+from utils.tile_store import slug
+
+# The ROI only selects polygons, so the SAR budget is looser than in encroachment
+PIXEL_BUDGET = {'scale': 10, 'max_pixels': 5e8}
+
+# Per-polygon annual water area, one parquet per (asset, season, orbit, threshold, year):
+# <cache>/inventory/<asset>/<season>/<orbit>_<threshold>/<year>.parquet with columns id, area_ha
+ROOT = "inventory"
+# Season windows as (start MM-DD, end MM-DD, end year offset); ends are exclusive
+SEASONS = {
+    "Annual": ("01-01", "01-01", 1),
+    "Monsoon (Jun-Sep)": ("06-01", "10-01", 0),
+    "Post-Monsoon (Oct-Dec)": ("10-01", "01-01", 1),
+}
+SCALE = 10
+# Batch sizing: cost is in pixel-years, with a fixed per-feature overhead for tiny polygons
+FEATURE_OVERHEAD_PX = 2000
+BATCH_COST = 2e7
+MAX_BATCH_FEATURES = 500
+MAX_WORKERS = 8
+
+def season_window(season, year):
+    s, e, offset = SEASONS[season]
+    return f"{year}-{s}", f"{year + offset}-{e}"
+
+def _season_collection(season, year, region, orbit):
+    start, end = season_window(season, year)
+    return encroachment.get_sar_collection(start, end, region, orbit)
+
+def scene_years(season, years, region, orbit="BOTH"):
+    """Years whose season window has S1 scenes over region, from one request."""
+    sizes = ee.List([_season_collection(season, y, region, orbit).size() for y in years]).getInfo()
+    return [y for y, n in zip(years, sizes) if n]
+
+def water_area_image(season, years, region, orbit="BOTH", water_db=encroachment.WATER_DB):
+    """One band per year (y<year>): SAR water pixels (below water_db) as area in m².
+
+    Every year must have scenes (see scene_years); an empty season has no bands to composite.
+    """
+    bands = []
+    for year in years:
+        water = encroachment.water_composite(_season_collection(season, year, region, orbit)).lt(water_db)
+        bands.append(water.unmask(0).multiply(ee.Image.pixelArea()).rename(f"y{year}"))
+    return ee.Image.cat(bands)
+
+def balance_batches(costs, max_cost=BATCH_COST, max_features=MAX_BATCH_FEATURES):
+    """Packs {id: cost} into size-balanced batches (longest-processing-time first onto the lightest batch)."""
+    if not costs: return []
+    n = max(1, math.ceil(sum(costs.values()) / max_cost), math.ceil(len(costs) / max_features))
+    heap = [(0.0, i) for i in range(n)]
+    batches = [[] for _ in range(n)]
+    for pid, cost in sorted(costs.items(), key=lambda kv: -kv[1]):
+        load, i = heapq.heappop(heap)
+        batches[i].append(pid)
+        heapq.heappush(heap, (load + cost, i))
+    return [b for b in batches if b]
+
+def _year_file(key, year):
+    asset, season, orbit, water_db = key
+    return cache_path(ROOT, slug(asset), slug(season), f"{slug(orbit)}_{slug(f'{water_db:g}db')}", f"{year}.parquet")
+
+def load_year(key, year):
+    """Stored areas of one year for key = (asset, season, orbit, water threshold dB)."""
+    path = _year_file(key, year)
+    return pd.read_parquet(path) if os.path.exists(path) else pd.DataFrame({'id': pd.Series(dtype=str), 'area_ha': pd.Series(dtype=float)})
+
+def _save_year(key, year, df):
+    path = _year_file(key, year)
+    old = load_year(key, year)
+    df = pd.concat([old, df], ignore_index=True).drop_duplicates('id', keep='last')
+    df.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+def list_polygons(fc, id_field):
+    """{id: area m²} for every polygon, in one request."""
+    with_area = fc.map(lambda f: f.set('area_m2', f.geometry().area(SCALE)))
+    rows = with_area.reduceColumns(ee.Reducer.toList(2), [id_field, 'area_m2']).get('list').getInfo()
+    return {id_text(pid): area for pid, area in rows}
+
+def id_text(value):
+    """Local string form of a polygon id; integral numbers (often stored as doubles) drop the '.0'."""
+    if isinstance(value, float) and value.is_integer(): value = int(value)
+    return str(value)
+
+def _as_int(text):
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return int(value) if value.is_integer() else None
+
+def filter_ids(fc, id_field, ids):
+    # Ids are kept as strings locally but the asset may hold numbers
+    numeric = [n for n in map(_as_int, ids) if n is not None]
+    return fc.filter(ee.Filter.Or(ee.Filter.inList(id_field, ids), ee.Filter.inList(id_field, numeric)))
+
+def reduce_batch(fc, id_field, ids, season, years, orbit, water_db):
+    """Per-polygon yearly water area (ha) for one batch; rows come back as a compact column list.
+
+    Years without scenes over the batch are NaN.
+    """
+    batch = filter_ids(fc, id_field, ids)
+    # 1. Only years with scenes are reduced
+    covered = scene_years(season, years, batch.geometry(), orbit)
+    out = pd.DataFrame({'id': list(ids)})
+    if covered:
+        img = water_area_image(season, covered, batch.geometry(), orbit, water_db)
+        stats = img.reduceRegions(collection=batch, reducer=ee.Reducer.sum(), scale=SCALE, tileScale=4)
+        bands = [f"y{y}" for y in covered]
+        rows = stats.reduceColumns(ee.Reducer.toList(len(bands) + 1), [id_field] + bands).get('list').getInfo()
+        found = pd.DataFrame([[id_text(r[0])] + [(v or 0) / 10000 for v in r[1:]] for r in rows], columns=['id'] + bands)
+        out = out.merge(found, on='id', how='left')
+    # 2. NaN for the rest
+    return out.assign(**{f"y{y}": float('nan') for y in years if y not in covered})[['id'] + [f"y{y}" for y in years]]
+
+def update_inventory(fc, id_field, areas, asset, season, years, orbit="BOTH", water_db=encroachment.WATER_DB, progress=None):
+    """Computes only the (polygon, year) pairs not yet stored and returns a wide id x year table (ha).
+
+    Stored areas are kept per orbit and water threshold. Years that have not finished yet are
+    recomputed every run and never stored.
+    """
+    this_year = date.today().year
+    key = (asset, season, orbit, float(water_db))
+    stored = {y: load_year(key, y) for y in years if y < this_year}
+    stored_ids = {y: set(df['id']) for y, df in stored.items()}
+    # Polygons are grouped by the exact set of years they still need
+    missing = {}
+    for pid in areas:
+        need = tuple(y for y in years if y >= this_year or pid not in stored_ids[y])
+        missing.setdefault(need, []).append(pid)
+
+    tasks = []
+    for need, ids in missing.items():
+        if not need: continue
+        costs = {pid: (areas[pid] / SCALE ** 2 + FEATURE_OVERHEAD_PX) * len(need) for pid in ids}
+        tasks += [(batch, list(need)) for batch in balance_batches(costs)]
+
+    fresh = []
+    if tasks:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            futures = [pool.submit(reduce_batch, fc, id_field, batch, season, need, orbit, water_db) for batch, need in tasks]
+            for i, fut in enumerate(futures):
+                fresh.append(fut.result())
+                if progress: progress((i + 1) / len(futures))
+
+    table = pd.DataFrame({'id': list(areas)})
+    for y in years:
+        parts = [df[['id', f"y{y}"]].rename(columns={f"y{y}": 'area_ha'}) for df in fresh if f"y{y}" in df]
+        new = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['id', 'area_ha'])
+        if y < this_year and len(new):
+            _save_year(key, y, new)
+        known = pd.concat([stored.get(y, new.iloc[:0]), new], ignore_index=True).drop_duplicates('id', keep='last')
+        table = table.merge(known.rename(columns={'area_ha': y}), on='id', how='left')
+    return table
+
+def flag_drops(table, years, drop_pct):
+    """Polygons whose last-year area fell more than drop_pct below the first year."""
+    first, last = table[years[0]], table[years[-1]]
+    change = (last - first) / first.where(first > 0) * 100
+    out = table.assign(change_pct=change.round(1))
+    return out[out['change_pct'] < -drop_pct].sort_values('change_pct')
+
+def analysis(roi, params):
+    """Per-polygon yearly table, flagged drops and map layers; runs as a background job."""
+    orbit, water_db = params.get('orbit', "BOTH"), params.get('water_db', encroachment.WATER_DB)
+
+    # 1. Polygons inside the ROI
+    fc = ee.FeatureCollection(params['asset']).filterBounds(roi)
+    years = list(range(params['year_start'], params['year_end'] + 1))
+    areas = list_polygons(fc, params['id_field'])
+    if not areas: raise ValueError("No waterbody polygons found inside the ROI.")
+
+    # 2. Incremental per-polygon series
+    table = update_inventory(fc, params['id_field'], areas, params['asset'], params['season'], years, orbit, water_db)
+    flagged = flag_drops(table, years, params['drop_pct'])
+
+    # 3. Map: all polygons, flagged in red, latest water (if the season has scenes yet) on top
+    layers, last = [map_utils.tile_layer(ee.Image().paint(fc, 0, 1), {'palette': 'yellow'}, 'Waterbodies')], None
+    if scene_years(params['season'], years[-1:], roi, orbit):
+        last = water_area_image(params['season'], years[-1:], roi, orbit, water_db).gt(0).selfMask().clip(roi)
+        layers.insert(0, map_utils.tile_layer(last, {'min': 0, 'max': 1, 'palette': ['#00FFFF']}, f"Water {years[-1]}", False))
+    if len(flagged):
+        bad = filter_ids(fc, params['id_field'], flagged['id'].tolist())
+        layers.append(map_utils.tile_layer(ee.Image().paint(bad, 0, 2), {'palette': 'red'}, 'Flagged Waterbodies'))
+    return {'table': table, 'flagged': flagged, 'years': years, 'layers': layers, 'export': map_utils.image_json(last) if last else None}
+
+def render(m, roi, params, col_res):
+    st.markdown("### Waterbody Inventory Results")
+    try:
+        if not params.get('asset'):
+            st.error("Enter a waterbody polygon asset (EE FeatureCollection) in the sidebar.")
+            return None, {}
+        key = ('inventory', helpers.roi_fingerprint(roi), params)
+        # The running season's areas are not final until its window has passed
+        ttl = jobs.expiry(season_window(params['season'], params['year_end'])[1])
+        result = progressive.analysis(key, lambda: analysis(roi, params), ttl, "Reducing waterbody polygons...")
+        if result is None: return None, {}
+        table, flagged, years = result['table'], result['flagged'], result['years']
+
+        vis_export = {'min': 0, 'max': 1, 'palette': ['#00FFFF']}
+        map_utils.add_tiles(m, result['layers'])
+
+        with col_res:
+            st.markdown('<div class="alert-card">', unsafe_allow_html=True)
+            st.markdown("### Inventory Report")
+            st.metric("Waterbodies", len(table))
+            st.metric("Flagged", len(flagged), help=f"Water area down more than {params['drop_pct']}% since {years[0]}")
+            st.caption(f"{params['season']} | {years[0]}-{years[-1]}")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+            st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+            st.markdown('<div class="card-label">TOTAL WATER AREA</div>', unsafe_allow_html=True)
+            totals = pd.DataFrame({'Year': [str(y) for y in years], 'Area (Ha)': [table[y].sum() for y in years]})
+            st.bar_chart(totals, x='Year', y='Area (Ha)', color="#005792")
+            if len(flagged):
+                st.dataframe(flagged[['id', years[0], years[-1], 'change_pct']].head(200), hide_index=True, use_container_width=True)
+            wide = table.rename(columns={y: str(y) for y in years})
+            st.download_button("Download CSV", wide.to_csv(index=False).encode('utf-8'), "waterbody_inventory.csv", "text/csv")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+        return map_utils.image_from_json(result['export']), vis_export
+
+    except Exception as e:
+        st.error(f"Inventory Error: {e}")
+        return None, {}
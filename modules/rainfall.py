@@ -1,70 +1,196 @@
 import streamlit as st
 import ee
-from datetime import datetime
+import numpy as np
+import pandas as pd
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import utils.helpers as helpers
+import utils.jobs as jobs
+import utils.map_utils as map_utils
+import utils.progressive as progressive
+import utils.raster as raster
+import utils.climatology as climatology
+import utils.hydro as hydro
+import utils.ts_store as ts_store
+
+# to_mm converts a sum over the collection to mm; daily_factor converts a mean image to mm/day
+DATASETS = {
+    "CHIRPS": {'id': "UCSB-CHG/CHIRPS/DAILY", 'band': 'precipitation', 'scale': 5566, 'res': 0.05,
+               'to_mm': 1.0, 'daily_factor': 1.0, 'chunk': 32, 'first_year': 1981, 'baseline': (1991, 2020),
+               # Final CHIRPS days are published around the third week of the following month
+               'lag_days': 50},
+    # IMERG is half-hourly precipitation rate (mm/hr)
+    "GPM": {'id': "NASA/GPM_L3/IMERG_V06", 'band': 'precipitationCal', 'scale': 10000, 'res': 0.1,
+            'to_mm': 0.5, 'daily_factor': 24.0, 'chunk': 16, 'first_year': 2001, 'baseline': (2001, 2020), 'lag_days': 7,
+            # Baseline climatology from the monthly aggregate (mm/hr averaged over each month)
+            'monthly': {'id': "NASA/GPM_L3/IMERG_MONTHLY_V06", 'band': 'precipitation', 'daily_factor': 24.0}},
+}
+
+# Working scale (m) and the largest ROI (in pixels at that scale) accepted before any request
+PIXEL_BUDGET = {'scale': 5566, 'max_pixels': 2e5}
+
+def dataset_spec(name):
+    return DATASETS["GPM"] if "GPM" in name else DATASETS["CHIRPS"]
+
+# Days per server request when extracting ROI series
+PAGE_DAYS = 366
+
+def daily_stack(spec, roi, start, end):
+    """One band per day (mm) over [start, end); sub-daily collections are summed per day server-side."""
+    col = ee.ImageCollection(spec['id']).filterBounds(roi).select(spec['band'])
+    if spec['to_mm'] == 1.0:
+        # Daily product: bands are named <YYYYMMDD>_<band> by toBands
+        return col.filterDate(start, end).toBands()
+    t0 = ee.Date(start)
+    n_days = (date.fromisoformat(end) - date.fromisoformat(start)).days
+
+    def day_total(i):
+        day = t0.advance(i, 'day')
+        sub = col.filterDate(day, day.advance(1, 'day'))
+        total = ee.Image(ee.Algorithms.If(sub.size().gt(0), sub.sum().multiply(spec['to_mm']), ee.Image.constant(0).selfMask()))
+        return total.rename('p').toFloat()
+
+    return ee.ImageCollection(ee.List.sequence(0, n_days - 1).map(day_total)).toBands()
+
+def fetch_daily_series(spec, roi, start, end, max_workers=4):
+    """ROI-mean daily rainfall for [start, end): one reduceRegion per page of PAGE_DAYS days."""
+    pages = []
+    day, last = date.fromisoformat(start), date.fromisoformat(end)
+    while day < last:
+        nxt = min(last, day + timedelta(days=PAGE_DAYS))
+        pages.append((day.isoformat(), nxt.isoformat()))
+        day = nxt
+
+    def run(page):
+        p_start, p_end = page
+        vals = daily_stack(spec, roi, p_start, p_end).reduceRegion(ee.Reducer.mean(), roi, spec['scale'], bestEffort=True).getInfo()
+        rows = []
+        for band, v in vals.items():
+            prefix = band.split('_')[0]
+            if spec['to_mm'] == 1.0:
+                d = f"{prefix[:4]}-{prefix[4:6]}-{prefix[6:8]}"
+            else:
+                d = (date.fromisoformat(p_start) + timedelta(days=int(prefix))).isoformat()
+            rows.append((d, np.nan if v is None else v))
+        return rows
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        rows = [r for page_rows in pool.map(run, pages) for r in page_rows]
+    df = pd.DataFrame(rows, columns=['date', 'value'])
+    df['value'] = df['value'].astype(np.float32)
+    return df.sort_values('date').reset_index(drop=True)
+
+def daily_series(spec, roi, start, end):
+    """ROI-mean daily series from the local store, fetching only days not yet stored or published."""
+    return ts_store.update(helpers.roi_fingerprint(roi), f"rain_{spec['id']}", start, end,
+                           lambda s, e: fetch_daily_series(spec, roi, s, e), lag_days=spec['lag_days'], daily=True)
+
+def _mm(v):
+    return "N/A" if np.isnan(v) else f"{v:.1f} mm"
+
+def rain_layer(col, roi, params, spec):
+    """(layer, vis, legend title) for the period total or its anomaly against the baseline climatology."""
+    rain_band = spec['band']
+    if "Anomaly" in params['calc_mode']:
+        # Only the current-period sum runs in EE; the long-term mean comes from the local
+        # day-of-year climatology and is uploaded as a single constant array image
+        current_sum = col.select(rain_band).sum().multiply(spec['to_mm']).clip(roi)
+        y0, y1 = params.get('baseline', spec['baseline'])
+        bounds = raster.geojson_bounds(helpers.roi_geojson(roi))
+        ltm_arr, ltm_bounds = climatology.ltm(spec, y0, y1, bounds, params['start'], params['end'])
+        ltm = climatology.to_image(ltm_arr, ltm_bounds, spec['res']).clip(roi)
+        main_layer = current_sum.subtract(ltm).divide(ltm).multiply(100).rename('anomaly')
+        return main_layer, {'min': -50, 'max': 50, 'palette': ['red', 'orange', 'white', 'cyan', 'blue']}, "Rainfall Anomaly (%)"
+
+    main_layer = col.select(rain_band).sum().multiply(spec['to_mm']).clip(roi)
+    stats = main_layer.reduceRegion(ee.Reducer.minMax(), roi, scale=spec['scale'], bestEffort=True).getInfo()
+    vis = {'min': stats.get(f'{rain_band}_min', 0), 'max': stats.get(f'{rain_band}_max', 500),
+           'palette': ['#ffffcc', '#a1dab4', '#41b6c4', '#225ea8', '#081d58']}
+    return main_layer, vis, "Total Rainfall (mm)"
+
+def report_page(roi, params):
+    """Report content: rainfall map, ROI statistics and the monthly ROI-mean series."""
+    spec = dataset_spec(params['dataset'])
+    col = ee.ImageCollection(spec['id']).filterDate(params['start'], params['end']).filterBounds(roi)
+    layer, vis, label = rain_layer(col, roi, params, spec)
+    roi_mean = layer.reduceRegion(ee.Reducer.mean(), roi, scale=spec['scale'], bestEffort=True).values().get(0).getInfo()
+    unit = "mm" if "Accumulation" in params['calc_mode'] else "%"
+    metrics = [("Region Average", "N/A" if roi_mean is None else f"{roi_mean:.1f} {unit}"), ("Period", f"{params['start']} to {params['end']}")]
+    df_daily = daily_series(spec, roi, params['start'], params['end'])
+    chart = None
+    if len(df_daily):
+        stats = hydro.exceedance_stats(df_daily)
+        metrics += [("Rainy Days (>= 2.5 mm)", stats['rainy_days']), ("Heavy Days (>= 64.5 mm)", stats['heavy_days']),
+                    ("Max 1-Day", _mm(stats['max_1day_mm'])), ("Max 5-Day", _mm(stats['max_5day_mm']))]
+        df_month = hydro.resample(df_daily, "Monthly")
+        chart = {'kind': 'bar', 'x': pd.to_datetime(df_month['date']).dt.strftime('%Y-%m').tolist(), 'y': df_month['value'].astype(float).tolist(), 'ylabel': "Monthly rainfall (mm)"}
+    return {'title': f"Rainfall - {params['dataset'].split(' ')[0]}", 'image': layer, 'vis': vis, 'label': label, 'metrics': metrics, 'chart': chart}
+
+def analysis(roi, params):
+    """Rainfall layer and its ROI average; runs as a background job."""
+    spec = dataset_spec(params['dataset'])
+    col = ee.ImageCollection(spec['id']).filterDate(params['start'], params['end']).filterBounds(roi)
+    if col.size().getInfo() == 0: raise ValueError("No data found for the selected date range.")
+    main_layer, vis, label = rain_layer(col, roi, params, spec)
+    roi_mean = main_layer.reduceRegion(ee.Reducer.mean(), roi, scale=spec['scale'], bestEffort=True).values().get(0).getInfo()
+    return {'layer': map_utils.tile_layer(main_layer, vis, label), 'vis': vis, 'label': label,
+            'roi_mean': np.nan if roi_mean is None else roi_mean, 'export': map_utils.image_json(main_layer)}
 
 def render(m, roi, params, col_res):
     st.markdown("### Rainfall & Climate Analysis Results")
-    with st.spinner("Processing Meteorological Data..."):
-        try:
-            # 1. Dataset Selection
-            col = None
-            rain_band = ''
-            scale_res = 5000 # Meters
-
-            if "CHIRPS" in params['dataset']:
-                col = ee.ImageCollection("UCSB-CHG/CHIRPS/DAILY").filterDate(params['start'], params['end']).filterBounds(roi)
-                rain_band = 'precipitation'
-                scale_res = 5566 
-            elif "GPM" in params['dataset']:
-                col = ee.ImageCollection("NASA/GPM_L3/IMERG_V06").filterDate(params['start'], params['end']).filterBounds(roi)
-                rain_band = 'precipitationCal'
-                scale_res = 10000 
-
-            if col.size().getInfo() == 0:
-                st.error("No data found for the selected date range.")
-                return None, {}
-
-            main_layer = None
-            legend_title = ""
-            vis_params_rain = {}
-
-            if "Accumulation" in params['calc_mode']:
-                main_layer = col.select(rain_band).sum().clip(roi)
-                stats = main_layer.reduceRegion(ee.Reducer.minMax(), roi, scale=scale_res, bestEffort=True).getInfo()
-                min_val = stats.get(f'{rain_band}_min', 0)
-                max_val = stats.get(f'{rain_band}_max', 500)
-                
-                vis_params_rain = {'min': min_val, 'max': max_val, 'palette': ['#ffffcc', '#a1dab4', '#41b6c4', '#225ea8', '#081d58']}
-                legend_title = "Total Rainfall (mm)"
-                
-            elif "Anomaly" in params['calc_mode']:
-                current_sum = col.select(rain_band).sum().clip(roi)
-                start_dt = datetime.strptime(params['start'], "%Y-%m-%d")
-                end_dt = datetime.strptime(params['end'], "%Y-%m-%d")
-                baseline_years = range(start_dt.year - 5, start_dt.year)
-                baseline_imgs = []
-                for y in baseline_years:
-                    s = start_dt.replace(year=y).strftime("%Y-%m-%d")
-                    e = end_dt.replace(year=y).strftime("%Y-%m-%d")
-                    baseline_imgs.append(ee.ImageCollection("UCSB-CHG/CHIRPS/DAILY").filterDate(s, e).select('precipitation').sum())
-                ltm = ee.ImageCollection(baseline_imgs).mean().clip(roi)
-                main_layer = current_sum.subtract(ltm).divide(ltm).multiply(100).rename('anomaly')
-                vis_params_rain = {'min': -50, 'max': 50, 'palette': ['red', 'orange', 'white', 'cyan', 'blue']}
-                legend_title = "Rainfall Anomaly (%)"
-
-            m.addLayer(main_layer, vis_params_rain, legend_title)
-            m.add_colorbar(vis_params_rain, label=legend_title)
-            
-            with col_res:
-                st.markdown('<div class="glass-card">', unsafe_allow_html=True)
-                st.markdown('<div class="card-label">STATISTICS</div>', unsafe_allow_html=True)
-                roi_mean = main_layer.reduceRegion(ee.Reducer.mean(), roi, scale=scale_res, bestEffort=True).values().get(0).getInfo()
-                unit = "mm" if "Accumulation" in params['calc_mode'] else "%"
-                st.metric("Region Average", f"{roi_mean:.1f} {unit}")
-                st.markdown("</div>", unsafe_allow_html=True)
-
-            return main_layer, vis_params_rain
-
-        except Exception as e:
-            st.error(f"Error in Rainfall Module: {e}")
-            return None, {}
+    try:
+        # 1. Dataset Selection
+        spec = dataset_spec(params['dataset'])
+        key = ('rainfall', helpers.roi_fingerprint(roi), params)
+        result = progressive.analysis(key, lambda: analysis(roi, params), jobs.expiry(params['end'], spec['lag_days']),
+                                      "Processing Meteorological Data...")
+        if result is None: return None, {}
+        vis_params_rain, legend_title = result['vis'], result['label']
+        y0, y1 = params.get('baseline', spec['baseline'])
+
+        map_utils.add_tiles(m, [result['layer']])
+        m.add_colorbar(vis_params_rain, label=legend_title)
+
+        with col_res:
+            st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+            st.markdown('<div class="card-label">STATISTICS</div>', unsafe_allow_html=True)
+            unit = "mm" if "Accumulation" in params['calc_mode'] else "%"
+            st.metric("Region Average", "N/A" if np.isnan(result['roi_mean']) else f"{result['roi_mean']:.1f} {unit}")
+            if "Anomaly" in params['calc_mode']:
+                st.caption(f"Baseline: {y0}-{y1} climatology")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+            st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+            st.markdown('<div class="card-label">ROI SERIES</div>', unsafe_allow_html=True)
+            series_key = ('rain_series', helpers.roi_fingerprint(roi), spec['id'], params['start'], params['end'])
+            if st.button("Extract Daily Series"):
+                st.session_state['rain_series'] = series_key
+
+            df_daily = None
+            if st.session_state.get('rain_series') == series_key:
+                df_daily = progressive.analysis(series_key, lambda: daily_series(spec, roi, params['start'], params['end']),
+                                                jobs.expiry(params['end'], spec['lag_days']), "Reducing daily rainfall over ROI...")
+            if df_daily is not None and len(df_daily):
+                freq = st.radio("Resolution", ["Daily", "Pentad", "Monthly"], horizontal=True)
+                df_res = hydro.resample(df_daily, freq)
+                st.bar_chart(df_res, x='date', y='value', color="#225ea8")
+                st.caption(f"{freq} ROI-mean rainfall (mm)")
+
+                stats = hydro.exceedance_stats(df_daily)
+                c1, c2 = st.columns(2)
+                c1.metric("Rainy Days", stats['rainy_days'], help="Days >= 2.5 mm")
+                c2.metric("Heavy Days", stats['heavy_days'], help="Days >= 64.5 mm")
+                c1.metric("Max 1-Day", _mm(stats['max_1day_mm']))
+                c2.metric("Max 5-Day", _mm(stats['max_5day_mm']))
+                st.caption(f"P90: {_mm(stats['p90_mm'])} | P95: {_mm(stats['p95_mm'])} | P99: {_mm(stats['p99_mm'])}")
+                st.line_chart(hydro.exceedance_curve(df_daily), x='Exceedance (%)', y='Depth (mm)')
+
+                csv = df_res.to_csv(index=False).encode('utf-8')
+                st.download_button("Download CSV", csv, f"rainfall_{freq.lower()}.csv", "text/csv")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+        return map_utils.image_from_json(result['export']), vis_params_rain
+
+    except Exception as e:
+        st.error(f"Error in Rainfall Module: {e}")
+        return None, {}
@@ -1,87 +1,321 @@
 import streamlit as st
 import ee
+import numpy as np
+import folium
+import utils.helpers as helpers
+import utils.map_utils as map_utils
+import utils.progressive as progressive
+import utils.raster as raster
+import utils.geometry as geometry
+import utils.tile_store as tile_store
+import utils.sites as sites
+import utils.sensitivity as sensitivity
+import utils.graph_opt as graph_opt
+import utils.session_store as session_store
+
+STRUCTURES = ["Percolation Tank (Recharge)", "Check Dam (Streams)", "Farm Pond (Storage)"]
+CRITERIA = ['rain', 'slope', 'soil', 'lulc', 'drain']
+
+# Smart Auto-Weights per agro-climatic zone
+ZONE_WEIGHTS = {
+    "General (Plateau)": {'rain': 0.25, 'slope': 0.20, 'soil': 0.20, 'lulc': 0.15, 'drain': 0.20},
+    "Arid/Semi-Arid": {'rain': 0.35, 'slope': 0.15, 'soil': 0.25, 'lulc': 0.10, 'drain': 0.15},
+    "Hilly/Mountainous": {'rain': 0.10, 'slope': 0.40, 'soil': 0.15, 'lulc': 0.10, 'drain': 0.25},
+    "Coastal/Wet": {'rain': 0.10, 'slope': 0.30, 'soil': 0.20, 'lulc': 0.20, 'drain': 0.20},
+    "Alluvial Plains": {'rain': 0.20, 'slope': 0.10, 'soil': 0.15, 'lulc': 0.30, 'drain': 0.25},
+}
+ZONE_STATES = {
+    "Arid/Semi-Arid": ["Rajasthan", "Gujarat", "Haryana"],
+    "Hilly/Mountainous": ["Himachal Pradesh", "Uttarakhand", "Sikkim", "Arunachal Pradesh", "Jammu and Kashmir", "Ladakh"],
+    "Coastal/Wet": ["Kerala", "Goa", "Konkan"],
+    "Alluvial Plains": ["Uttar Pradesh", "Bihar", "West Bengal", "Punjab"],
+}
+
+# Soil texture classes 1:Clay ... 12:Sand
+SOIL_CLASSES = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+SOIL_SUIT = {
+    # Prefer Clay (1,2,6) for storage
+    'storage': [1.0, 0.9, 0.7, 0.6, 0.5, 0.9, 0.5, 0.4, 0.3, 0.4, 0.1, 0.2],
+    # Prefer Sand/Loam (9,10,11,12) for recharge
+    'recharge': [0.1, 0.2, 0.3, 0.4, 0.5, 0.3, 0.6, 0.7, 0.9, 0.9, 1.0, 0.9],
+}
+
+# Precomputed tiles written by precompute_rwh.py
+TILE_STORE = "rwh"
+
+# Working scale (m) and the largest ROI (in pixels at that scale) accepted before any request
+PIXEL_BUDGET = {'scale': 30, 'max_pixels': 1e8}
+HIGH_POTENTIAL = 0.65
+SUIT_VIS = {'min': 0, 'max': 0.8, 'palette': ['red', 'orange', 'yellow', 'green', 'darkgreen']}
+
+def detect_zone(state):
+    for zone, states in ZONE_STATES.items():
+        if state in states: return zone
+    return "General (Plateau)"
+
+def soil_key(structure):
+    return 'storage' if "Pond" in structure else 'recharge'
+
+def suitability_layer(structure, zone):
+    return f"suit_{tile_store.slug(structure)}_{tile_store.slug(zone)}"
+
+def rain_mean_image(region):
+    # 4-year CHIRPS pentad mean
+    chirps = ee.ImageCollection("UCSB-CHG/CHIRPS/PENTAD").filterDate('2020-01-01', '2023-12-31').filterBounds(region)
+    return chirps.reduce(ee.Reducer.mean()).rename('rain')
+
+def national_rain_range():
+    """(min, max) of the rainfall mean over India, from one coarse minMax reduction."""
+    india = ee.FeatureCollection("FAO/GAUL/2015/level0").filter(ee.Filter.eq('ADM0_NAME', 'India')).geometry()
+    stats = rain_mean_image(india).reduceRegion(ee.Reducer.minMax(), india, 5000, bestEffort=True).getInfo()
+    return [stats.get('rain_min', 0), stats.get('rain_max', 2000)]
+
+def rain_range():
+    """Rainfall normalisation range shared by the precomputed tiles and the live EE path.
+
+    One national range keeps tiles seamless across districts and gives an ROI the same scores
+    whether or not tiles cover it; it is computed once and kept in the tile store index.
+    """
+    index = tile_store.load_index(TILE_STORE)
+    if 'rain_range' not in index:
+        index['rain_range'] = national_rain_range()
+        tile_store.save_index(TILE_STORE, index)
+    return index['rain_range']
+
+def criteria_image(region, r_min, r_max):
+    """Normalised criteria bands: rain, slope, lulc, drain, soil_storage, soil_recharge."""
+    # Rainfall (Norm)
+    norm_rain = rain_mean_image(region).unitScale(r_min, r_max)
+
+    # Slope (Norm: Flatter is better 2-8%)
+    slope = ee.Terrain.slope(ee.Image("USGS/SRTMGL1_003"))
+    # Invert: High slope = 0 suitability, Low slope = 1
+    norm_slope = slope.unitScale(0, 30).multiply(-1).add(1).clamp(0, 1).rename('slope')
+
+    # Drainage (Flow Acc)
+    flow_acc = ee.Image("WWF/HydroSHEDS/15ACC")
+    norm_drain = flow_acc.log().unitScale(0, 12).clamp(0, 1).rename('drain')
+
+    # Soil (OpenLandMap)
+    soil_tex = ee.Image("OpenLandMap/SOL/SOL_TEXTURE-CLASS_USDA-TT_M/v02")
+    soil_storage = soil_tex.remap(SOIL_CLASSES, SOIL_SUIT['storage']).rename('soil_storage')
+    soil_recharge = soil_tex.remap(SOIL_CLASSES, SOIL_SUIT['recharge']).rename('soil_recharge')
+
+    # LULC (ESA WorldCover)
+    esa = ee.ImageCollection("ESA/WorldCover/v100").first()
+    # 40:Ag(1.0), 30:Grass(0.9), 50:Urban(0.0)
+    lulc_suit = esa.remap([10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 100],
+                          [0.6, 0.8, 0.9, 1.0, 0.0, 0.1, 0.2, 0.0, 0.5, 0.0, 0.1]).rename('lulc')
+
+    return ee.Image.cat([norm_rain, norm_slope, lulc_suit, norm_drain, soil_storage, soil_recharge])
+
+def select_criteria(criteria, structure):
+    """Picks the five criteria for a structure type, renamed to CRITERIA."""
+    return criteria.select(['rain', 'slope', 'soil_' + soil_key(structure), 'lulc', 'drain'], CRITERIA)
+
+def weighted_overlay(criteria, ws):
+    final_idx = criteria.select('rain').multiply(ws['rain'])
+    for k in CRITERIA[1:]:
+        final_idx = final_idx.add(criteria.select(k).multiply(ws[k]))
+    return final_idx.rename('suitability')
+
+def weighted_overlay_array(arrays, ws):
+    final_idx = arrays['rain'] * ws['rain']
+    for k in CRITERIA[1:]:
+        final_idx = final_idx + arrays[k] * ws[k]
+    return final_idx
+
+def vector_zones(image):
+    """High-potential zones (suitability above HIGH_POTENTIAL) for the vector export."""
+    return image.gt(HIGH_POTENTIAL).selfMask().toInt(), {1: 'High Potential'}
+
+def suitability_image(roi, params, r_range):
+    """(criteria, suitability index) EE images over the ROI."""
+    criteria = select_criteria(criteria_image(roi, *r_range), params['type']).clip(roi)
+    return criteria, weighted_overlay(criteria, params['w'])
+
+def report_page(roi, params):
+    """Report content: suitability map, high-potential share of the ROI and the criteria weights."""
+    _, final_idx = suitability_image(roi, params, rain_range())
+    vals = graph_opt.reduce_bands({'mean': final_idx, 'high': final_idx.gt(HIGH_POTENTIAL)}, ee.Reducer.mean(), roi, 100, bestEffort=True)
+    metrics = [("Structure", params['type']), ("Mean Suitability", f"{vals.get('mean') or 0:.3f}"),
+               (f"High Potential (>{HIGH_POTENTIAL})", f"{(vals.get('high') or 0) * 100:.1f} % of ROI")]
+    chart = {'kind': 'bar', 'x': CRITERIA, 'y': [params['w'][k] for k in CRITERIA], 'ylabel': "Criteria weight"}
+    return {'title': "Rainwater Harvesting Potential", 'image': final_idx, 'vis': SUIT_VIS, 'label': "Suitability Index (0-1)", 'metrics': metrics, 'chart': chart}
+
+def load_precomputed(roi, params):
+    """Reads precomputed criteria/suitability tiles for the ROI; None if it is not fully covered."""
+    index = tile_store.load_index(TILE_STORE)
+    if not index.get('districts'): return None
+    roi_json = helpers.roi_geojson(roi)
+    # Tiles are masked to the ROI outline, so only areal ROIs can use them
+    if not geometry.polygons(roi_json): return None
+    bounds = raster.geojson_bounds(roi_json)
+    z = tile_store.pick_level(bounds, index['levels'])
+
+    arrays = {}
+    layers = {'rain': 'rain', 'slope': 'slope', 'soil': 'soil_' + soil_key(params['type']), 'lulc': 'lulc', 'drain': 'drain'}
+    for k, layer in layers.items():
+        window = tile_store.read_window(TILE_STORE, layer, bounds, z)
+        if window is None: return None
+        arrays[k], grid_bounds = window
+
+    # Default zone weights have a precomputed suitability raster; custom weights are combined locally
+    zone = params.get('zone')
+    window = None
+    if zone in ZONE_WEIGHTS and all(abs(ZONE_WEIGHTS[zone][k] - params['w'][k]) < 1e-6 for k in CRITERIA):
+        window = tile_store.read_window(TILE_STORE, suitability_layer(params['type'], zone), bounds, z)
+    suit = np.array(window[0]) if window else weighted_overlay_array(arrays, params['w'])
+
+    inside = raster.polygon_mask(roi_json, grid_bounds, suit.shape)
+    suit[~inside] = np.nan
+    return {'arrays': arrays, 'suitability': suit, 'bounds': grid_bounds, 'level': z,
+            'rain_range': index['rain_range']}
+
+def download_arrays(roi, params, criteria, max_pixels=4_000_000):
+    """Downloads the criteria for the ROI from EE when no precomputed tiles cover it."""
+    roi_json = helpers.roi_geojson(roi)
+    bounds = raster.geojson_bounds(roi_json)
+    res = raster.BASE_RES
+    while ((bounds[2] - bounds[0]) / res) * ((bounds[3] - bounds[1]) / res) > max_pixels: res *= 2
+    arrays, grid_bounds = raster.fetch_array(criteria, bounds, res)
+    suit = weighted_overlay_array(arrays, params['w'])
+    suit[~raster.polygon_mask(roi_json, grid_bounds, suit.shape)] = np.nan
+    return {'arrays': arrays, 'suitability': suit, 'bounds': grid_bounds, 'level': None}
+
+def get_arrays(roi, params, criteria, local):
+    """Local criteria/suitability arrays for the ROI, downloaded once per ROI and parameter set."""
+    if local: return local
+    key = (helpers.roi_fingerprint(roi), str(params))
+    cached = session_store.get('rwh_arrays', key=key)
+    if cached: return cached
+    return session_store.put('rwh_arrays', download_arrays(roi, params, criteria), key=key)
+
+def add_array_layer(m, arr, bounds, vis, name, shown=True):
+    min_lon, min_lat, max_lon, max_lat = bounds
+    folium.raster_layers.ImageOverlay(
+        image=raster.to_rgba(arr, vis), bounds=[[min_lat, min_lon], [max_lat, max_lon]],
+        mercator_project=True, name=name, show=shown
+    ).add_to(m)
+
+def analysis(roi, params):
+    """Live EE suitability: map layers, ROI mean and the criteria/index images; runs as a background job."""
+    criteria, final_idx = suitability_image(roi, params, rain_range())
+    mean_suit = final_idx.reduceRegion(ee.Reducer.mean(), roi, scale=1000, bestEffort=True).values().get(0).getInfo()
+    return {'layers': [map_utils.tile_layer(criteria.select('rain'), {'min':0, 'max':1, 'palette':['white','blue']}, 'Rainfall Input', False),
+                       map_utils.tile_layer(criteria.select('slope'), {'min':0, 'max':1, 'palette':['black','white']}, 'Slope Input', False),
+                       map_utils.tile_layer(final_idx, SUIT_VIS, 'RWH Suitability Index'),
+                       # High Potential Zones
+                       map_utils.tile_layer(final_idx.updateMask(final_idx.gt(HIGH_POTENTIAL)), {'palette':['cyan']}, f'High Potential Zones (>{HIGH_POTENTIAL})')],
+            'mean': mean_suit or 0, 'criteria': map_utils.image_json(criteria), 'export': map_utils.image_json(final_idx)}
 
 def render(m, roi, params, col_res):
     st.markdown("### Rainwater Harvesting Potential Results")
-    with st.spinner("Calculating Multi-Criteria Hydrological Suitability..."):
-        try:
-            # 1. Inputs
-            # Rainfall (Norm)
-            chirps = ee.ImageCollection("UCSB-CHG/CHIRPS/PENTAD").filterDate('2020-01-01', '2023-12-31').filterBounds(roi)
-            rain_mean = chirps.reduce(ee.Reducer.mean()).clip(roi)
-            min_max_r = rain_mean.reduceRegion(ee.Reducer.minMax(), roi, 5000, bestEffort=True).getInfo()
-            r_min = min_max_r.get('precipitation_mean_min', 0)
-            r_max = min_max_r.get('precipitation_mean_max', 2000)
-            norm_rain = rain_mean.unitScale(r_min, r_max)
-
-            # Slope (Norm: Flatter is better 2-8%)
-            dem = ee.Image("USGS/SRTMGL1_003").clip(roi)
-            slope = ee.Terrain.slope(dem)
-            # Invert: High slope = 0 suitability, Low slope = 1
-            norm_slope = slope.unitScale(0, 30).multiply(-1).add(1).clamp(0, 1)
-
-            # Drainage (Flow Acc)
-            flow_acc = ee.Image("WWF/HydroSHEDS/15ACC").clip(roi)
-            log_flow = flow_acc.log()
-            norm_drain = log_flow.unitScale(0, 12).clamp(0, 1)
-
-            # Soil (OpenLandMap)
-            soil_tex = ee.Image("OpenLandMap/SOL/SOL_TEXTURE-CLASS_USDA-TT_M/v02").clip(roi)
-            # Remap based on structure type
-            # Classes: 1:Clay... 12:Sand
-            if "Pond" in params['type']: 
-                # Prefer Clay (1,2,6) for storage
-                soil_suit = soil_tex.remap([1,2,3,4,5,6,7,8,9,10,11,12], 
-                                            [1.0, 0.9, 0.7, 0.6, 0.5, 0.9, 0.5, 0.4, 0.3, 0.4, 0.1, 0.2])
-            else: 
-                # Prefer Sand/Loam (9,10,11,12) for recharge
-                soil_suit = soil_tex.remap([1,2,3,4,5,6,7,8,9,10,11,12], 
-                                            [0.1, 0.2, 0.3, 0.4, 0.5, 0.3, 0.6, 0.7, 0.9, 0.9, 1.0, 0.9])
-            
-            # LULC (ESA WorldCover)
-            esa = ee.ImageCollection("ESA/WorldCover/v100").first().clip(roi)
-            # 40:Ag(1.0), 30:Grass(0.9), 50:Urban(0.0)
-            lulc_suit = esa.remap([10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 100],
-                                [0.6, 0.8, 0.9, 1.0, 0.0, 0.1, 0.2, 0.0, 0.5, 0.0, 0.1])
-
-            # 2. Weighted Overlay
-            ws = params['w']
-            final_idx = (norm_rain.multiply(ws['rain'])) \
-                .add(norm_slope.multiply(ws['slope'])) \
-                .add(soil_suit.multiply(ws['soil'])) \
-                .add(lulc_suit.multiply(ws['lulc'])) \
-                .add(norm_drain.multiply(ws['drain']))
-            
-            final_idx = final_idx.rename('suitability')
-            
-            # 3. Visualization
-            vis_suit = {'min': 0, 'max': 0.8, 'palette': ['red', 'orange', 'yellow', 'green', 'darkgreen']}
-            
-            m.addLayer(norm_rain, {'min':0, 'max':1, 'palette':['white','blue']}, 'Rainfall Input', False)
-            m.addLayer(norm_slope, {'min':0, 'max':1, 'palette':['black','white']}, 'Slope Input', False)
-            m.addLayer(final_idx, vis_suit, 'RWH Suitability Index')
-            m.add_colorbar(vis_suit, label="Suitability Index (0-1)")
-            
+    try:
+        # 1. Inputs (precomputed tiles first, live EE computation as fallback)
+        local = load_precomputed(roi, params)
+        ws = params['w']
+        vis_suit = SUIT_VIS
+        criteria = None
+
+        if local:
+            # 2. Precomputed tiles: every layer is drawn from the local arrays, no EE map requests
+            suit = local['suitability']
+            outside = np.isnan(suit)
+            add_array_layer(m, np.where(outside, np.nan, local['arrays']['rain']), local['bounds'], {'min':0, 'max':1, 'palette':['white','blue']}, 'Rainfall Input', False)
+            add_array_layer(m, np.where(outside, np.nan, local['arrays']['slope']), local['bounds'], {'min':0, 'max':1, 'palette':['black','white']}, 'Slope Input', False)
+            add_array_layer(m, suit, local['bounds'], vis_suit, 'RWH Suitability Index')
             # High Potential Zones
-            high_pot = final_idx.updateMask(final_idx.gt(0.65))
-            m.addLayer(high_pot, {'palette':['cyan']}, 'High Potential Zones (>0.65)')
-            
-            with col_res:
-                st.markdown('<div class="glass-card">', unsafe_allow_html=True)
-                st.markdown('<div class="card-label">MODEL STATS</div>', unsafe_allow_html=True)
-                
-                mean_suit = final_idx.reduceRegion(ee.Reducer.mean(), roi, scale=1000, bestEffort=True).values().get(0).getInfo()
-                st.metric("Avg Suitability", f"{mean_suit:.2f} / 1.0")
-                
-                st.markdown("**Criteria Weights:**")
-                st.progress(ws['rain'], text="Rain")
-                st.progress(ws['slope'], text="Slope")
-                st.progress(ws['soil'], text="Soil")
-                st.caption(f"Structure: {params['type']}")
-                st.markdown("</div>", unsafe_allow_html=True)
-            
-            return final_idx, vis_suit
-            
-        except Exception as e:
-            st.error(f"RWH Analysis Error: {e}")
-            return None, {}
+            add_array_layer(m, np.where(suit > HIGH_POTENTIAL, suit, np.nan), local['bounds'], {'palette': ['cyan']}, f'High Potential Zones (>{HIGH_POTENTIAL})')
+            mean_suit = float(np.nanmean(suit))
+            # The EE image is only the export handle on the tile path; it is never requested for display
+            _, final_idx = suitability_image(roi, params, local['rain_range'])
+        else:
+            # 2. Weighted overlay in EE, as a background job
+            result = progressive.analysis(('rwh', helpers.roi_fingerprint(roi), params), lambda: analysis(roi, params),
+                                          label="Calculating Multi-Criteria Hydrological Suitability...")
+            if result is None: return None, {}
+            map_utils.add_tiles(m, result['layers'])
+            mean_suit = result['mean']
+            criteria, final_idx = map_utils.image_from_json(result['criteria']), map_utils.image_from_json(result['export'])
+        m.add_colorbar(vis_suit, label="Suitability Index (0-1)")
+
+        with col_res:
+            st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+            st.markdown('<div class="card-label">MODEL STATS</div>', unsafe_allow_html=True)
+
+            st.metric("Avg Suitability", f"{mean_suit:.2f} / 1.0")
+
+            st.markdown("**Criteria Weights:**")
+            st.progress(ws['rain'], text="Rain")
+            st.progress(ws['slope'], text="Slope")
+            st.progress(ws['soil'], text="Soil")
+            st.caption(f"Structure: {params['type']}")
+            if local:
+                st.caption(f"Source: precomputed tiles (level {local['level']})")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+            st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+            st.markdown('<div class="card-label">SITE RANKING</div>', unsafe_allow_html=True)
+            c1, c2 = st.columns(2)
+            top_k = c1.number_input("Top K", 1, 500, 20)
+            spacing = c2.number_input("Min Spacing (m)", 0, 10000, 500, 100)
+            site_key = (helpers.roi_fingerprint(roi), str(params), top_k, spacing)
+            if st.button("Extract Candidate Sites"):
+                with st.spinner("Ranking candidate sites..."):
+                    data = get_arrays(roi, params, criteria, local)
+                    ranked, labels = sites.extract_sites(data['suitability'], data['bounds'], data['arrays']['drain'],
+                                                         threshold=HIGH_POTENTIAL, top_k=top_k, min_spacing_m=spacing)
+                    session_store.put('rwh_sites', (ranked, labels), key=site_key)
+
+            cached_sites = session_store.get('rwh_sites', key=site_key)
+            if cached_sites:
+                ranked = cached_sites[0]
+                if ranked:
+                    df_sites = sites.to_dataframe(ranked)
+                    st.dataframe(df_sites, hide_index=True, use_container_width=True)
+                    st.download_button("Download GeoJSON", sites.to_geojson(ranked), "rwh_sites.geojson", "application/geo+json")
+                    st.download_button("Download CSV", df_sites.to_csv(index=False).encode('utf-8'), "rwh_sites.csv", "text/csv")
+                    for s in ranked:
+                        folium.Marker([s['lat'], s['lon']], tooltip=f"#{s['rank']} | score {s['mean_score']} | {s['area_ha']} Ha").add_to(m)
+                else:
+                    st.warning(f"No zones above {HIGH_POTENTIAL} suitability in this ROI.")
+            st.markdown("</div>", unsafe_allow_html=True)
+
+            st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+            st.markdown('<div class="card-label">WEIGHT SENSITIVITY</div>', unsafe_allow_html=True)
+            n_samples = st.select_slider("Weight Samples", [250, 500, 1000, sensitivity.MAX_SAMPLES], 1000)
+            spread = st.radio("Spread", ["Narrow", "Medium", "Wide"], index=1, horizontal=True)
+            sens_key = (helpers.roi_fingerprint(roi), str(params), n_samples, spread)
+            if st.button("Run Sensitivity Analysis"):
+                with st.spinner(f"Evaluating {n_samples} weight sets..."):
+                    data = get_arrays(roi, params, criteria, local)
+                    stack = np.stack([np.asarray(data['arrays'][k], dtype=np.float32).ravel() for k in CRITERIA], axis=1)
+                    stack[np.isnan(data['suitability'].ravel())] = np.nan
+                    concentration = {"Narrow": 200.0, "Medium": 50.0, "Wide": 15.0}[spread]
+                    weights = sensitivity.sample_weights([ws[k] for k in CRITERIA], n_samples, concentration, seed=0)
+                    mean_s, std_s, prob_s = sensitivity.pixel_stats(stack, weights, threshold=HIGH_POTENTIAL)
+                    shape = data['suitability'].shape
+                    result = {'std': std_s.reshape(shape), 'prob': prob_s.reshape(shape), 'bounds': data['bounds']}
+                    if cached_sites and cached_sites[0]:
+                        result['ranks'] = sensitivity.rank_stability(stack, cached_sites[1], [x['label'] for x in cached_sites[0]], weights)
+                    session_store.put('rwh_sensitivity', result, key=sens_key)
+
+            result = session_store.get('rwh_sensitivity', key=sens_key)
+            if result:
+                add_array_layer(m, result['std'], result['bounds'], {'min': 0, 'max': 0.1, 'palette': ['white', 'purple']}, 'Suitability Std. Dev.', False)
+                add_array_layer(m, result['prob'], result['bounds'], {'min': 0, 'max': 1, 'palette': ['white', 'yellow', 'darkgreen']}, f'P(Suitability > {HIGH_POTENTIAL})', False)
+                st.metric("Mean Score Std. Dev.", f"{np.nanmean(result['std']):.3f}")
+                st.metric("Robust High Potential", f"{np.nanmean(np.where(np.isnan(result['prob']), np.nan, result['prob'] > 0.9)) * 100:.1f} %", help=f"Share of ROI above {HIGH_POTENTIAL} in >90% of weight samples")
+                if 'ranks' in result and cached_sites:
+                    r = result['ranks']
+                    st.dataframe({'Site': [x['rank'] for x in cached_sites[0]], 'Mean Rank': np.round(r['mean_rank'], 1),
+                                  'Rank 5-95%': [f"{a:.0f}-{b:.0f}" for a, b in zip(r['rank_p5'], r['rank_p95'])],
+                                  'P(Same Rank)': np.round(r['p_same_rank'], 2)}, hide_index=True, use_container_width=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+
+        return final_idx, vis_suit
+
+    except Exception as e:
+        st.error(f"RWH Analysis Error: {e}")
+        return None, {}
@@ -2,143 +2,219 @@ import streamlit as st
 import ee
 import pandas as pd
 from datetime import datetime
+import utils.helpers as helpers
+import utils.jobs as jobs
+import utils.map_utils as map_utils
+import utils.graph_opt as graph_opt
+import utils.ts_store as ts_store
+import utils.progressive as progressive
+import utils.pruning as pruning
+
+# Scientific indices: output band, temporal composite reducer, visualisation and legend
+INDICES = {
+    "Turbidity": {'band': 'ndti', 'reducer': 'mean', 'label': "Turbidity Index (NDTI)",
+                  'vis': {'min': -0.15, 'max': 0.15, 'palette': ['0000ff', '00ffff', 'ffff00', 'ff0000']}},
+    "TSS": {'band': 'tss', 'reducer': 'median', 'label': "TSS (Est. mg/L)",
+            'vis': {'min': 0, 'max': 50, 'palette': ['0000ff', '00ffff', 'ffff00', 'ff0000', '5c0000']}},
+    "Cyanobacteria": {'band': 'cyano', 'reducer': 'max', 'label': "Cyano Risk (Ratio > 1)",
+                      'vis': {'min': 0.8, 'max': 1.5, 'palette': ['0000ff', '00ff00', 'ff0000']}},
+    "Chlorophyll": {'band': 'ndci', 'reducer': 'mean', 'label': "Chlorophyll-a (NDCI)",
+                    'vis': {'min': -0.1, 'max': 0.2, 'palette': ['0000ff', '00ffff', '00ff00', 'ff0000']}},
+    "CDOM": {'band': 'cdom', 'reducer': 'median', 'label': "CDOM Proxy (Green/Blue)",
+             'vis': {'min': 0.5, 'max': 2.0, 'palette': ['0000ff', 'yellow', 'brown']}},
+}
+
+# Scenes cloudier than this over the ROI (scene classification) are dropped before the cloud join
+MAX_SCENE_CLOUD = 0.9
+
+# Working scale (m) and the largest ROI (in pixels at that scale) accepted before any request
+PIXEL_BUDGET = {'scale': 20, 'max_pixels': 1e8}
+
+def index_key(param):
+    for key in INDICES:
+        if key in param: return key
+    return None
+
+def calc_index(img, band):
+    if band == 'ndti':
+        out = img.normalizedDifference(['B4', 'B3'])
+    elif band == 'tss':
+        out = img.expression('2950 * (b4 ** 1.357)', {'b4': img.select('B4')})
+    elif band == 'cyano':
+        out = img.expression('b5 / b4', {'b5': img.select('B5'), 'b4': img.select('B4')})
+    elif band == 'ndci':
+        out = img.normalizedDifference(['B5', 'B4'])
+    else:
+        out = img.expression('b3 / b2', {'b3': img.select('B3'), 'b2': img.select('B2')})
+    return out.rename(band)
+
+def calc_all(img):
+    """All five index bands from one masked reflectance image."""
+    bands = [calc_index(img, spec['band']) for spec in INDICES.values()]
+    return ee.Image.cat(bands).copyProperties(img, ['system:time_start'])
+
+def composite(col, reducer):
+    if reducer == 'max': return col.max()
+    if reducer == 'median': return col.median()
+    return col.mean()
+
+def mask_clouds_and_water(img, cloud):
+    # Cloud Masking (using S2_CLOUD_PROBABILITY)
+    cloud_prob = ee.Image(img.get('cloud_mask')).select('probability')
+    is_cloud = cloud_prob.gt(cloud)
+
+    # Scale Bands to Reflectance (0 to 1)
+    bands = img.select(['B.*']).multiply(0.0001)
+
+    # Water Masking (NDWI > 0.0)
+    ndwi = bands.normalizedDifference(['B3', 'B8']).rename('ndwi')
+    is_water = ndwi.gt(0.0)
+
+    return bands.updateMask(is_cloud.Not()).updateMask(is_water).copyProperties(img, ['system:time_start'])
+
+def load_collection(roi, start, end, cloud, prune=True):
+    """Cloud- and water-masked S2 reflectance; prune=False skips the scene pruning request (series fetches)."""
+    s2_sr = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED").filterDate(start, end).filterBounds(roi)
+    if prune:
+        s2_sr = pruning.prune(s2_sr, roi, helpers.roi_geojson(roi), "COPERNICUS/S2_SR_HARMONIZED",
+                              max_cloud=MAX_SCENE_CLOUD, cloud=pruning.s2_cloud)
+    s2_cloud = ee.ImageCollection("COPERNICUS/S2_CLOUD_PROBABILITY").filterDate(start, end).filterBounds(roi)
+
+    # Join collections
+    s2_joined = ee.Join.saveFirst('cloud_mask').apply(
+        primary=s2_sr, secondary=s2_cloud,
+        condition=ee.Filter.equals(leftField='system:index', rightField='system:index')
+    )
+    return ee.ImageCollection(s2_joined).map(lambda img: mask_clouds_and_water(img, cloud))
+
+def series_fetcher(roi, cloud, bands, calc):
+    """fetch(start, end) for ts_store: per-scene ROI medians of `bands`, one row per date."""
+    def get_stats(img):
+        # One median reduction covers every band of the image
+        date = ee.Date(img.get('system:time_start')).format('YYYY-MM-dd')
+        vals = img.reduceRegion(reducer=ee.Reducer.median(), geometry=roi, scale=20, maxPixels=1e9)
+        return ee.Feature(None, vals.set('date', date))
+
+    def fetch(start, end):
+        # Only scenes in [start, end) not already in the local store; per-scene medians need no pruning
+        # (cloudy or empty scenes drop out through the mask and the notNull filter)
+        fc = load_collection(roi, start, end, cloud, prune=False).map(calc).map(get_stats).filter(ee.Filter.notNull(bands[:1]))
+        rows = fc.reduceColumns(ee.Reducer.toList(len(bands) + 1), ['date'] + bands).get('list').getInfo()
+        df = pd.DataFrame(rows, columns=['date'] + bands)
+        # Same-day scenes from neighbouring tiles collapse to one value per date
+        return df.groupby('date', as_index=False)[bands].mean()
+    return fetch
+
+def build(roi, params, key):
+    """Temporal composite of one index over the ROI."""
+    spec = INDICES[key]
+
+    def calc(img):
+        return calc_index(img, spec['band']).rename('value').copyProperties(img, ['system:time_start'])
+
+    final_col = load_collection(roi, params['start'], params['end'], params['cloud']).map(calc)
+    return composite(final_col, spec['reducer']).clip(roi)
+
+def series(roi, params):
+    """Per-scene ROI medians from the local store: every index band in all-indices mode, else 'value'."""
+    fingerprint = helpers.roi_fingerprint(roi)
+    if params.get('all_indices'):
+        bands = [s['band'] for s in INDICES.values()]
+        fetch = series_fetcher(roi, params['cloud'], bands, calc_all)
+        return ts_store.update(fingerprint, f"wq_all_cloud{params['cloud']}", params['start'], params['end'], fetch)
+    spec = INDICES[index_key(params['param'])]
+    calc = lambda img: calc_index(img, spec['band']).rename('value').copyProperties(img, ['system:time_start'])
+    return ts_store.update(fingerprint, f"wq_{params['param']}_cloud{params['cloud']}", params['start'], params['end'],
+                           series_fetcher(roi, params['cloud'], ['value'], calc))
+
+def analysis(roi, params):
+    """Composite tile layers and the ROI series (a coarse ROI median when progressive); runs as a background job."""
+    if params.get('all_indices'):
+        # Single pass: all five bands mapped once, composited per index, series reduced together
+        all_col = load_collection(roi, params['start'], params['end'], params['cloud']).map(calc_all)
+        composites = {k: composite(all_col.select(s['band']), s['reducer']).clip(roi) for k, s in INDICES.items()}
+    else:
+        key = index_key(params['param'])
+        composites = {key: build(roi, params, key)}
+    coarse = progressive.auto_scale(roi, 20) if params.get('progressive') else 20
+    out = {'layers': {k: map_utils.tile_layer(img, INDICES[k]['vis'], INDICES[k]['label']) for k, img in composites.items()},
+           'export': {k: map_utils.image_json(img) for k, img in composites.items()}, 'scale': coarse}
+    if coarse > 20:
+        out['preview'] = graph_opt.reduce_bands(composites, ee.Reducer.median(), roi, coarse, bestEffort=True)
+    else:
+        out['series'] = series(roi, params)
+    return out
+
+def report_page(roi, params):
+    """Report content: index composite and the per-scene ROI median trend."""
+    key = index_key(params['param'])
+    spec = INDICES[key]
+    layer = build(roi, params, key)
+    df = series(roi, dict(params, all_indices=False)).dropna(subset=['value'])
+    metrics = [("Period", f"{params['start']} to {params['end']}"), ("Cloud Threshold", params['cloud']), ("Clear Scenes", len(df))]
+    chart = None
+    if len(df):
+        metrics += [(f"Median {key}", f"{df['value'].median():.3f}"), (f"Latest {key}", f"{df['value'].iloc[-1]:.3f}")]
+        chart = {'kind': 'line', 'x': df['date'].astype(str).tolist(), 'y': df['value'].astype(float).tolist(), 'ylabel': spec['label']}
+    return {'title': f"Water Quality - {key}", 'image': layer, 'vis': spec['vis'], 'label': spec['label'], 'metrics': metrics, 'chart': chart}
 
 def render(m, roi, params, col_res):
-    st.markdown(f"### Water Quality ({params['param']})")
-    with st.spinner(f"Computing {params['param']} (Scientific Mode)..."):
-        try:
-            # 1. PRE-PROCESSING FUNCTION (Improved Masking)
-            def mask_clouds_and_water(img):
-                # Cloud Masking (using S2_CLOUD_PROBABILITY)
-                cloud_prob = ee.Image(img.get('cloud_mask')).select('probability')
-                is_cloud = cloud_prob.gt(params['cloud'])
-
-                # Scale Bands to Reflectance (0 to 1)
-                bands = img.select(['B.*']).multiply(0.0001)
-
-                # Water Masking (NDWI > 0.0)
-                ndwi = bands.normalizedDifference(['B3', 'B8']).rename('ndwi')
-                is_water = ndwi.gt(0.0)
-
-                return bands.updateMask(is_cloud.Not()).updateMask(is_water).copyProperties(img, ['system:time_start'])
-
-            # 2. LOAD COLLECTIONS
-            s2_sr = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED").filterDate(params['start'], params['end']).filterBounds(roi)
-            s2_cloud = ee.ImageCollection("COPERNICUS/S2_CLOUD_PROBABILITY").filterDate(params['start'], params['end']).filterBounds(roi)
-
-            # Join collections
-            s2_joined = ee.Join.saveFirst('cloud_mask').apply(
-                primary=s2_sr, secondary=s2_cloud,
-                condition=ee.Filter.equals(leftField='system:index', rightField='system:index')
-            )
-
-            processed_col = ee.ImageCollection(s2_joined).map(mask_clouds_and_water)
-
-            # 3. COMPUTE SCIENTIFIC INDICES
-            viz_params = {}
-            result_layer = None
-            layer_name = ""
-
-            if "Turbidity" in params['param']:
-                def calc_ndti(img):
-                    ndti = img.normalizedDifference(['B4', 'B3']).rename('value')
-                    return ndti.copyProperties(img, ['system:time_start'])
-
-                final_col = processed_col.map(calc_ndti)
-                result_layer = final_col.mean().clip(roi)
-                viz_params = {'min': -0.15, 'max': 0.15, 'palette': ['0000ff', '00ffff', 'ffff00', 'ff0000']}
-                layer_name = "Turbidity Index (NDTI)"
-
-            elif "TSS" in params['param']:
-                def calc_tss(img):
-                    tss = img.expression('2950 * (b4 ** 1.357)', {'b4': img.select('B4')}).rename('value')
-                    return tss.copyProperties(img, ['system:time_start'])
-
-                final_col = processed_col.map(calc_tss)
-                result_layer = final_col.median().clip(roi)
-                viz_params = {'min': 0, 'max': 50, 'palette': ['0000ff', '00ffff', 'ffff00', 'ff0000', '5c0000']}
-                layer_name = "TSS (Est. mg/L)"
-
-            elif "Cyanobacteria" in params['param']:
-                def calc_cyano(img):
-                    cyano = img.expression('b5 / b4', {
-                        'b5': img.select('B5'), 'b4': img.select('B4')
-                    }).rename('value')
-                    return cyano.copyProperties(img, ['system:time_start'])
-
-                final_col = processed_col.map(calc_cyano)
-                result_layer = final_col.max().clip(roi)
-                viz_params = {'min': 0.8, 'max': 1.5, 'palette': ['0000ff', '00ff00', 'ff0000']}
-                layer_name = "Cyano Risk (Ratio > 1)"
-
-            elif "Chlorophyll" in params['param']:
-                def calc_ndci(img):
-                    ndci = img.normalizedDifference(['B5', 'B4']).rename('value')
-                    return ndci.copyProperties(img, ['system:time_start'])
-
-                final_col = processed_col.map(calc_ndci)
-                result_layer = final_col.mean().clip(roi)
-                viz_params = {'min': -0.1, 'max': 0.2, 'palette': ['0000ff', '00ffff', '00ff00', 'ff0000']}
-                layer_name = "Chlorophyll-a (NDCI)"
-
-            elif "CDOM" in params['param']:
-                def calc_cdom(img):
-                    cdom = img.expression('b3 / b2', {
-                        'b3': img.select('B3'), 'b2': img.select('B2')
-                    }).rename('value')
-                    return cdom.copyProperties(img, ['system:time_start'])
-
-                final_col = processed_col.map(calc_cdom)
-                result_layer = final_col.median().clip(roi)
-                viz_params = {'min': 0.5, 'max': 2.0, 'palette': ['0000ff', 'yellow', 'brown']}
-                layer_name = "CDOM Proxy (Green/Blue)"
-
-            # 4. VISUALIZATION
-            if result_layer:
-                m.addLayer(result_layer, viz_params, layer_name)
-                m.add_colorbar(viz_params, label=layer_name)
-
-                # 5. CHARTING
-                with col_res:
-                    st.markdown('<div class="glass-card">', unsafe_allow_html=True)
-                    st.markdown(f'<div class="card-label">TREND ANALYSIS</div>', unsafe_allow_html=True)
-                    try:
-                        def get_stats(img):
-                            date = ee.Date(img.get('system:time_start')).format('YYYY-MM-dd')
-                            val = img.reduceRegion(
-                                reducer=ee.Reducer.median(),
-                                geometry=roi,
-                                scale=20,
-                                maxPixels=1e9
-                            ).values().get(0)
-                            return ee.Feature(None, {'date': date, 'value': val})
-
-                        fc = final_col.map(get_stats).filter(ee.Filter.notNull(['value']))
-                        data_list = fc.reduceColumns(ee.Reducer.toList(2), ['date', 'value']).get('list').getInfo()
-
-                        if data_list:
-                            df_chart = pd.DataFrame(data_list, columns=['Date', 'Value'])
-                            df_chart['Date'] = pd.to_datetime(df_chart['Date'])
-                            df_chart = df_chart.sort_values('Date').dropna()
-
-                            st.area_chart(df_chart, x='Date', y='Value', color="#005792")
-                            st.caption(f"Median {layer_name} over time")
-
-                            # Export Data CSV
-                            csv = df_chart.to_csv(index=False).encode('utf-8')
-                            st.download_button("Download CSV", csv, "water_quality_ts.csv", "text/csv")
-                        else:
-                            st.warning("No clear water pixels found (Try reducing cloud threshold).")
-
-                    except Exception as e:
-                        st.warning(f"Chart Error: {e}")
-                    st.markdown('</div>', unsafe_allow_html=True)
-                
-                return result_layer, viz_params
-            
-            else:
-                 return None, {}
-
-        except Exception as e:
-            st.error(f"Analysis Failed: {e}")
+    # In all-indices mode the sidebar selectbox only switches the displayed index
+    param = st.session_state.get('wq_param', params['param']) if params.get('all_indices') else params['param']
+    st.markdown(f"### Water Quality ({param})")
+    try:
+        key = index_key(param)
+        if key is None:
             return None, {}
+        spec = INDICES[key]
+
+        # 1. BUILD LAYERS (all five at once in all-indices mode, so switching index reuses the job)
+        run = {k: v for k, v in params.items() if k != 'param'} if params.get('all_indices') else params
+        job_key = ('water_quality', helpers.roi_fingerprint(roi), run)
+        result = progressive.analysis(job_key, lambda: analysis(roi, params), jobs.expiry(params['end']),
+                                      f"Computing {param} (Scientific Mode)...")
+        if result is None: return None, {}
+        map_utils.add_tiles(m, [result['layers'][key]])
+
+        # 2. VISUALIZATION
+        viz_params = spec['vis']
+        layer_name = spec['label']
+        m.add_colorbar(viz_params, label=layer_name)
+
+        # 3. CHARTING
+        def show_trend(df_series):
+            if params.get('all_indices') and len(df_series):
+                df_series = df_series[['date', spec['band']]].rename(columns={spec['band']: 'value'})
+            if len(df_series):
+                df_chart = df_series.rename(columns={'date': 'Date', 'value': 'Value'})[['Date', 'Value']].dropna()
+
+                st.area_chart(df_chart, x='Date', y='Value', color="#005792")
+                st.caption(f"Median {layer_name} over time")
+
+                # Export Data CSV
+                csv = df_chart.to_csv(index=False).encode('utf-8')
+                st.download_button("Download CSV", csv, "water_quality_ts.csv", "text/csv")
+            else:
+                st.warning("No clear water pixels found (Try reducing cloud threshold).")
+
+        with col_res:
+            st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+            st.markdown(f'<div class="card-label">TREND ANALYSIS</div>', unsafe_allow_html=True)
+            try:
+                # Progressive: a coarse ROI median of the composite first, the per-scene series in the background
+                if 'preview' in result:
+                    preliminary = result['preview'].get(key)
+                    show_preview = lambda: st.metric(f"ROI Median ({key})", "N/A" if preliminary is None else f"{preliminary:.3f}")
+                    progressive.refine(job_key + ('series',), lambda: series(roi, params), show_trend, show_preview, jobs.expiry(params['end']))
+                else:
+                    show_trend(result['series'])
+
+            except Exception as e:
+                st.warning(f"Chart Error: {e}")
+            st.markdown('</div>', unsafe_allow_html=True)
+
+        return map_utils.image_from_json(result['export'][key]), viz_params
+
+    except Exception as e:
+        st.error(f"Analysis Failed: {e}")
+        return None, {}
@@ -0,0 +1,84 @@
+"""Offline precompute of RWH criteria and suitability tiles per district.
+
+Usage:
+    python precompute_rwh.py --project my-ee-project --state "Maharashtra" [--district "Pune"] [--levels 4] [--workers 8]
+
+Writes level-0 tiles plus a pyramid into the local tile store read by modules.rwh.
+Tiles already on disk are skipped, so the pipeline can be re-run nightly to resume.
+"""
+import argparse
+import ee
+from concurrent.futures import ThreadPoolExecutor
+
+import utils.raster as raster
+import utils.tile_store as tile_store
+import modules.rwh as rwh
+
+CRITERIA_LAYERS = ['rain', 'slope', 'lulc', 'drain', 'soil_storage', 'soil_recharge']
+
+def all_layers():
+    return CRITERIA_LAYERS + [rwh.suitability_layer(s, z) for s in rwh.STRUCTURES for z in rwh.ZONE_WEIGHTS]
+
+def tile_layers(criteria):
+    """Criteria tile dict -> dict of layer name -> array, including all suitability rasters."""
+    layers = {k: criteria[k] for k in CRITERIA_LAYERS}
+    for structure in rwh.STRUCTURES:
+        arrays = {'rain': criteria['rain'], 'slope': criteria['slope'], 'lulc': criteria['lulc'],
+                  'drain': criteria['drain'], 'soil': criteria['soil_' + rwh.soil_key(structure)]}
+        for zone, ws in rwh.ZONE_WEIGHTS.items():
+            layers[rwh.suitability_layer(structure, zone)] = rwh.weighted_overlay_array(arrays, ws)
+    return layers
+
+def precompute_district(name, geometry, image, levels, workers):
+    bounds = raster.geojson_bounds(geometry.bounds().getInfo())
+    x0, y0, x1, y1 = raster.tile_range(bounds, 0)
+    tiles = [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+    last_layer = all_layers()[-1]
+    todo = [t for t in tiles if not tile_store.has_tile(rwh.TILE_STORE, last_layer, 0, *t)]
+    print(f"{name}: {len(tiles)} tiles, {len(todo)} to compute")
+
+    def run(tile):
+        x, y = tile
+        criteria = raster.compute_pixels(image, raster.tile_bounds(0, x, y), (raster.TILE_SIZE, raster.TILE_SIZE))
+        # Layers are written in all_layers() order, so the last one marks a complete tile
+        for layer, arr in tile_layers(criteria).items():
+            tile_store.write_tile(rwh.TILE_STORE, layer, 0, x, y, arr)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run, todo))
+
+    for layer in all_layers():
+        tile_store.build_pyramid(rwh.TILE_STORE, layer, tiles, levels)
+    return [float(b) for b in bounds]
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute RWH suitability tiles per district.")
+    parser.add_argument("--state", required=True)
+    parser.add_argument("--district", default=None)
+    parser.add_argument("--levels", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--project", required=True, help="Earth Engine cloud project")
+    args = parser.parse_args()
+
+    ee.Initialize(project=args.project)
+
+    # The same national range the live EE fallback normalises with
+    r_min, r_max = rwh.rain_range()
+    index = tile_store.load_index(rwh.TILE_STORE)
+    index['levels'] = min(index.get('levels', args.levels), args.levels)
+    index.setdefault('districts', {})
+
+    districts = ee.FeatureCollection("FAO/GAUL/2015/level2").filter(ee.Filter.eq('ADM1_NAME', args.state))
+    if args.district:
+        districts = districts.filter(ee.Filter.eq('ADM2_NAME', args.district))
+    names = districts.aggregate_array('ADM2_NAME').getInfo()
+
+    for name in names:
+        geometry = districts.filter(ee.Filter.eq('ADM2_NAME', name)).geometry()
+        image = rwh.criteria_image(geometry, r_min, r_max)
+        bounds = precompute_district(name, geometry, image, args.levels, args.workers)
+        index['districts'][f"{args.state}/{name}"] = {'bounds': bounds}
+        tile_store.save_index(rwh.TILE_STORE, index)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+from datetime import date, timedelta
+import numpy as np
+import pytest
+import utils.climatology as climatology
+
+# Synthetic mean daily rainfall per calendar slot (1..366, slot 60 = Feb 29) on a 2x3 grid
+DAILY = np.random.default_rng(0).gamma(2.0, 3.0, (367, 2, 3)).astype(np.float32)
+DAILY[0] = 0
+CUM = np.cumsum(DAILY, axis=0, dtype=np.float64).astype(np.float32)
+BOUNDS = (73.0, 18.0, 73.15, 18.1)
+
+@pytest.fixture(autouse=True)
+def synthetic_cumulative(monkeypatch):
+    monkeypatch.setattr(climatology, 'cumulative_window', lambda spec, y0, y1, bounds: (CUM, BOUNDS))
+
+def brute(start, end):
+    """Sum of the slot means of every day in [start, end); non-leap years never visit Feb 29."""
+    day, end, total = date.fromisoformat(start), date.fromisoformat(end), np.zeros(DAILY.shape[1:])
+    while day < end:
+        total += DAILY[climatology._slot(day)]
+        day += timedelta(days=1)
+    return total
+
+@pytest.mark.parametrize('start, end', [
+    ("2024-02-20", "2024-03-10"),   # leap year, crosses Feb 29
+    ("2023-02-20", "2023-03-10"),   # non-leap year, same calendar window
+    ("2023-02-28", "2023-03-01"),   # single day before the skipped slot
+    ("2023-03-01", "2023-03-02"),   # first day after it
+    ("2023-01-01", "2024-01-01"),   # one full non-leap year
+    ("2019-12-15", "2021-03-05"),   # multi-year: non-leap, full leap year, non-leap Feb
+    ("2100-02-01", "2100-03-15"),   # century year, not leap
+])
+def test_ltm_matches_day_by_day_sum(start, end):
+    total, bounds = climatology.ltm({}, 1991, 2020, BOUNDS, start, end)
+    # Differences of float32 cumulative sums (~2000 mm) carry ~1e-3 mm of rounding
+    np.testing.assert_allclose(total, brute(start, end), rtol=1e-5, atol=2e-3)
+    assert bounds == BOUNDS
+
+def test_feb29_only_counts_in_leap_years():
+    leap = climatology.ltm({}, 1991, 2020, BOUNDS, "2024-02-01", "2024-03-01")[0]
+    common = climatology.ltm({}, 1991, 2020, BOUNDS, "2023-02-01", "2023-03-01")[0]
+    np.testing.assert_allclose(leap - common, DAILY[climatology.FEB29], rtol=1e-4, atol=2e-3)
+
+def test_empty_window_is_zero():
+    assert not climatology.ltm({}, 1991, 2020, BOUNDS, "2023-05-01", "2023-05-01")[0].any()
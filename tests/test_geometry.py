@@ -0,0 +1,28 @@
+import utils.geometry as geometry
+
+SQUARE = [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+
+def test_fingerprint_ignores_ring_direction_and_start():
+    a = {'type': 'Polygon', 'coordinates': [SQUARE]}
+    b = {'type': 'MultiPolygon', 'coordinates': [[[[1, 1], [1, 0], [0, 0], [0, 1], [1, 1]]]]}
+    assert geometry.fingerprint(a) == geometry.fingerprint(b)
+
+def test_non_areal_geometries_do_not_collide():
+    shapes = [{'type': 'Point', 'coordinates': [73.8, 18.5]},
+              {'type': 'Point', 'coordinates': [73.9, 18.5]},
+              {'type': 'LineString', 'coordinates': [[73.8, 18.5], [73.9, 18.6]]},
+              {'type': 'LineString', 'coordinates': [[73.8, 18.5], [73.9, 18.7]]},
+              {'type': 'MultiPoint', 'coordinates': [[73.8, 18.5], [73.9, 18.6]]}]
+    prints = {geometry.fingerprint(g) for g in shapes}
+    assert len(prints) == len(shapes)
+    assert geometry.fingerprint({'type': 'Point', 'coordinates': [73.8000000001, 18.5]}) == geometry.fingerprint(shapes[0])
+
+def test_bare_point_is_buffered_like_point_and_buffer():
+    roi = geometry.normalize({'type': 'Point', 'coordinates': [73.85, 18.52]})
+    expected = geometry.bbox_polygon(geometry.summary(geometry.circle(73.85, 18.52, geometry.DEFAULT_RADIUS_M))['bounds'])
+    assert roi == expected
+    assert abs(geometry.summary(roi)['area_km2'] - 100) < 1
+
+def test_drawn_circle_keeps_its_radius():
+    roi = geometry.normalize({'type': 'Point', 'coordinates': [73.85, 18.52]}, radius=1000)
+    assert roi['type'] == 'Polygon' and len(roi['coordinates'][0]) == geometry.CIRCLE_VERTICES + 1
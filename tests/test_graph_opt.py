@@ -0,0 +1,91 @@
+import pytest
+import utils.graph_opt as graph_opt
+
+def call(name, **args):
+    return {'functionInvocationValue': {'functionName': name, 'arguments': args}}
+
+def const(v):
+    return {'constantValue': v}
+
+def ref(r):
+    return {'valueReference': r}
+
+def expand(expr):
+    """Fully inlined form of a compound expression, for comparing graphs laid out differently."""
+    values = expr['values']
+
+    def walk(value):
+        if 'valueReference' in value: return walk(values[value['valueReference']])
+        if 'arrayValue' in value: return ['array', [walk(v) for v in value['arrayValue']['values']]]
+        if 'dictionaryValue' in value: return ['dict', {k: walk(v) for k, v in value['dictionaryValue']['values'].items()}]
+        if 'functionDefinitionValue' in value:
+            fn = value['functionDefinitionValue']
+            return ['fndef', fn['argumentNames'], walk(ref(fn['body']))]
+        if 'functionInvocationValue' in value:
+            inv = value['functionInvocationValue']
+            fn = inv.get('functionName') or walk(ref(inv['functionReference']))
+            return ['call', fn, {k: walk(v) for k, v in inv.get('arguments', {}).items()}]
+        return value
+    return walk(ref(expr['result']))
+
+GEOM = call('GeometryConstructors.Rectangle', coordinates=const([0, 0, 1, 1]))
+OTHER = call('GeometryConstructors.Rectangle', coordinates=const([0, 0, 2, 2]))
+IMAGE = call('Image.load', id=const("a"))
+
+def test_nested_clips_collapse_through_footprint_preserving_calls():
+    # clip(select(clip(clip(load, g), g)), g) == select(clip(load, g)); a clip to another geometry stays
+    inner = call('Image.clip', input=call('Image.clip', input=IMAGE, geometry=ref('g')), geometry=ref('g'))
+    outer = call('Image.clip', input=call('Image.select', input=inner, bandSelectors=const(['b'])), geometry=ref('g'))
+    expr = {'result': '0', 'values': {'g': GEOM, '0': call('Image.clip', input=outer, geometry=OTHER)}}
+    out, stats = graph_opt.optimize_expression(expr)
+    expected = {'result': 'r', 'values': {'r': call('Image.clip', geometry=OTHER, input=call(
+        'Image.select', bandSelectors=const(['b']), input=call('Image.clip', input=IMAGE, geometry=GEOM)))}}
+    assert stats['clips_removed'] == 2
+    assert expand(out) == expand(expected)
+    assert stats['optimized_nodes'] == stats['distinct_nodes'] - 2
+
+def test_function_bodies_and_argument_references():
+    body = call('Image.clip', input=call('Image.clip', input={'argumentReference': '_x'}, geometry=ref('g')), geometry=ref('g'))
+    expr = {'result': '0', 'values': {
+        'g': GEOM, 'b': body,
+        '0': call('Collection.map', collection=call('ImageCollection.load', id=const("c")),
+                  baseAlgorithm={'functionDefinitionValue': {'argumentNames': ['_x'], 'body': 'b'}})}}
+    out, stats = graph_opt.optimize_expression(expr)
+    assert stats['clips_removed'] == 1
+    fn = out['values'][out['result']]['functionInvocationValue']['arguments']['baseAlgorithm']['functionDefinitionValue']
+    assert fn['argumentNames'] == ['_x']
+    # The body stays a top-level value, with the argument reference and geometry inlined in it
+    assert out['values'][fn['body']] == call('Image.clip', input={'argumentReference': '_x'}, geometry=GEOM)
+
+def test_single_use_values_are_inlined_and_shared_ones_referenced():
+    clipped = call('Image.clip', input=IMAGE, geometry=ref('g'))
+    expr = {'result': '0', 'values': {'g': GEOM, 'c': clipped, 'k': const(2),
+                                      '0': call('Image.add', image1=call('Image.multiply', image1=ref('c'), image2=ref('k')), image2=ref('c'))}}
+    out, stats = graph_opt.optimize_expression(expr)
+    assert expand(out) == expand(expr) and stats['clips_removed'] == 0
+    assert not any('constantValue' in v for v in out['values'].values())
+    # Root and the clipped image (used twice); the geometry is used once and inlined
+    assert stats['optimized_values'] == 2 < stats['values']
+    assert stats['tree_nodes'] == stats['optimized_tree_nodes']
+
+def test_optimized_graph_decodes_and_reencodes(monkeypatch):
+    ee = pytest.importorskip("ee")
+    if not hasattr(ee, 'deserializer'): pytest.skip("earthengine-api not installed")
+    from ee import apifunction, serializer, deserializer
+    signatures = {'Image.load': ['id'], 'Image.clip': ['input', 'geometry'], 'Image.select': ['input', 'bandSelectors'],
+                  'Image.add': ['image1', 'image2'], 'GeometryConstructors.Rectangle': ['coordinates']}
+    api = {name: apifunction.ApiFunction(name, {'args': [{'name': a, 'type': 'Object', 'optional': True} for a in args], 'returns': 'Object'})
+           for name, args in signatures.items()}
+    monkeypatch.setattr(apifunction.ApiFunction, '_api', api)
+    clipped = call('Image.clip', input=IMAGE, geometry=ref('g'))
+    expr = {'result': '0', 'values': {'g': GEOM, 'c': clipped, '0': call(
+        'Image.add', image1=call('Image.clip', input=call('Image.select', input=ref('c'), bandSelectors=const(['b'])), geometry=ref('g')), image2=ref('c'))}}
+    original = deserializer.decodeCloudApi(expr)
+    rebuilt, stats = graph_opt.optimize(original, with_stats=True)
+    assert stats['clips_removed'] == 1
+    out = serializer.encode(rebuilt, for_cloud_api=True)
+    assert expand(out) == expand(graph_opt.optimize_expression(expr)[0])
+    assert expand(out) != expand(expr)
+    # Nothing to drop: the same object comes back
+    plain = deserializer.decodeCloudApi({'result': '0', 'values': {'0': clipped, 'g': GEOM}})
+    assert graph_opt.optimize(plain) is plain
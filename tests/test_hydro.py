@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+import utils.hydro as hydro
+
+def series(dates, values):
+    return pd.DataFrame({'date': dates, 'value': np.asarray(values, dtype=np.float32)})
+
+def test_all_nan_series_has_every_key():
+    stats = hydro.exceedance_stats(series(['2024-07-01', '2024-07-02'], [np.nan, np.nan]))
+    assert stats['rainy_days'] == 0 and stats['heavy_days'] == 0
+    assert np.isnan(stats['max_1day_mm']) and np.isnan(stats['max_5day_mm'])
+
+def test_five_day_total_skips_windows_with_missing_days():
+    dates = pd.date_range('2024-07-01', periods=10).strftime('%Y-%m-%d')
+    stats = hydro.exceedance_stats(series(dates, [10, 10, 10, np.nan, 10, 50, 50, 0, 0, 0]))
+    assert stats['max_5day_mm'] == 110
+    assert stats['rainy_days'] == 6 and stats['max_1day_mm'] == 50
+
+def test_five_day_total_needs_consecutive_days():
+    stats = hydro.exceedance_stats(series(['2024-07-01', '2024-07-03', '2024-07-05', '2024-07-07', '2024-07-09'], [10] * 5))
+    assert np.isnan(stats['max_5day_mm'])
@@ -0,0 +1,31 @@
+import pytest
+import numpy as np
+
+pytest.importorskip("streamlit")
+pytest.importorskip("geemap")
+import modules.inventory as inventory
+
+def test_batches_cover_every_id_once_and_stay_balanced():
+    rng = np.random.default_rng(0)
+    costs = {f"p{i}": float(c) for i, c in enumerate(rng.pareto(1.5, 400) * 1e5 + 1e3)}
+    batches = inventory.balance_batches(costs, max_cost=2e6, max_features=50)
+    ids = [pid for b in batches for pid in b]
+    assert sorted(ids) == sorted(costs) and len(ids) == len(set(ids))
+    assert len(batches) >= max(np.ceil(sum(costs.values()) / 2e6), 400 / 50)
+    loads = [sum(costs[p] for p in b) for b in batches]
+    # LPT: no batch exceeds the mean by more than the largest single item
+    assert max(loads) <= np.mean(loads) + max(costs.values())
+
+def test_batch_count_follows_feature_cap_and_empty_input():
+    assert inventory.balance_batches({}) == []
+    batches = inventory.balance_batches({str(i): 1.0 for i in range(10)}, max_cost=1e9, max_features=3)
+    assert len(batches) == 4 and sorted(len(b) for b in batches) == [2, 2, 3, 3]
+    assert inventory.balance_batches({'big': 10.0, 'a': 1.0}, max_cost=100) == [['big', 'a']]
+
+def test_years_without_scenes_are_nan(monkeypatch):
+    monkeypatch.setattr(inventory, 'filter_ids', lambda fc, field, ids: fc)
+    monkeypatch.setattr(inventory, 'scene_years', lambda season, years, region, orbit="BOTH": [])
+    class Batch:
+        def geometry(self): return None
+    df = inventory.reduce_batch(Batch(), 'id', ['1', '2'], "Annual", [2012, 2013], "BOTH", -16)
+    assert list(df.columns) == ['id', 'y2012', 'y2013'] and df[['y2012', 'y2013']].isna().all().all()
@@ -0,0 +1,50 @@
+import time
+from datetime import date, timedelta
+import pytest
+import utils.jobs as jobs
+
+@pytest.fixture(autouse=True)
+def job_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'DB', str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setattr(jobs, '_READY', False)
+
+def wait(jid):
+    while jobs.status(jid) in ('queued', 'running'): time.sleep(0.01)
+    return jobs.status(jid)
+
+def test_expiry_only_for_recent_windows():
+    today = date.today()
+    assert jobs.expiry(today.isoformat()) == jobs.RECENT_TTL_S
+    assert jobs.expiry((today - timedelta(days=3)).isoformat(), lag_days=5) == jobs.RECENT_TTL_S
+    assert jobs.expiry((today - timedelta(days=30)).isoformat(), lag_days=5) is None
+
+def test_done_result_is_reused_until_ttl():
+    calls = []
+    fn = lambda: calls.append(1) or len(calls)
+    jid = jobs.submit(('k',), fn)
+    assert wait(jid) == 'done' and jobs.result(jid) == 1
+    jobs.submit(('k',), fn)
+    jobs.submit(('k',), fn, ttl=3600)
+    assert wait(jid) == 'done' and len(calls) == 1
+    jobs.submit(('k',), fn, ttl=0)
+    assert wait(jid) == 'done' and jobs.result(jid) == 2
+
+def test_failed_job_needs_retry():
+    def boom(): raise ValueError("no scenes")
+    jid = jobs.submit(('f',), boom)
+    assert wait(jid) == 'failed' and jobs.error(jid) == "no scenes"
+    jobs.submit(('f',), lambda: 1, ttl=0)
+    assert wait(jid) == 'failed'
+    jobs.submit(('f',), lambda: 1, retry=True)
+    assert wait(jid) == 'done' and jobs.result(jid) == 1
+
+def test_prune_drops_old_rows_then_oldest_beyond_budget(monkeypatch):
+    for k in 'abc':
+        wait(jobs.submit((k,), lambda: b"x" * 1000))
+    now = time.time()
+    jobs._execute("UPDATE jobs SET updated=? WHERE id=?", (now - (jobs.MAX_AGE_DAYS + 1) * 86400, jobs.job_id('a')))
+    jobs._execute("UPDATE jobs SET updated=? WHERE id=?", (now - 60, jobs.job_id('b')))
+    monkeypatch.setattr(jobs, 'MAX_BYTES', 1500)
+    jobs.prune(now)
+    assert jobs.status(jobs.job_id('a')) is None and jobs.status(jobs.job_id('b')) is None
+    assert jobs.result(jobs.job_id('c')) == b"x" * 1000
@@ -0,0 +1,63 @@
+import types
+import pandas as pd
+import pytest
+import utils.cache as cache
+import utils.pruning as pruning
+
+def meta(rows):
+    return pd.DataFrame(rows, columns=['id', 'date', 'coverage', 'cloud'])
+
+def test_same_date_scenes_kept_until_roi_is_covered():
+    df = meta([('a1', '2023-08-01', 0.6, 0.0), ('a2', '2023-08-01', 0.5, 0.0), ('a3', '2023-08-01', 0.3, 0.0),
+               ('b1', '2023-08-02', 1.0, 0.0), ('b2', '2023-08-02', 0.4, 0.0),
+               ('c1', '2023-08-03', 0.1, 0.0)])
+    assert pruning.select_scenes(df) == ['a1', 'a2', 'b1']
+    assert pruning.select_scenes(df, dedupe=False) == ['a1', 'a2', 'a3', 'b1', 'b2']
+
+def test_coverage_stop_is_at_0_999():
+    df = meta([('x1', '2023-08-01', 0.5, 0.0), ('x2', '2023-08-01', 0.499, 0.0), ('x3', '2023-08-01', 0.3, 0.0),
+               ('y1', '2023-08-02', 0.5, 0.0), ('y2', '2023-08-02', 0.498, 0.0), ('y3', '2023-08-02', 0.3, 0.0)])
+    assert pruning.select_scenes(df) == ['x1', 'x2', 'y1', 'y2', 'y3']
+
+def test_clearest_scene_first_and_cloud_cut():
+    df = meta([('cloudy', '2023-08-01', 1.0, 0.6), ('clear', '2023-08-01', 0.9, 0.0), ('murky', '2023-08-02', 1.0, 0.9)])
+    assert pruning.select_scenes(df) == ['clear', 'cloudy', 'murky']
+    assert pruning.select_scenes(df, max_cloud=0.5) == ['clear']
+
+class Collection:
+    """Stand-in for an ee.ImageCollection: scene ids and filters recorded client-side."""
+    def __init__(self, ids, filtered=None):
+        self.ids, self.filtered = ids, filtered
+
+    def aggregate_array(self, prop):
+        return types.SimpleNamespace(getInfo=lambda: list(self.ids))
+
+    def filter(self, f):
+        return Collection([i for i in self.ids if i in f], filtered=f)
+
+@pytest.fixture
+def stubbed(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(pruning, 'ee', types.SimpleNamespace(Filter=types.SimpleNamespace(inList=lambda prop, ids: list(ids))))
+    table = meta([('s1', '2023-08-01', 0.05, 0.0), ('s2', '2023-08-01', 0.8, 0.0), ('s3', '2023-08-05', 0.9, 0.0)])
+    calls = []
+    def scene_stats(col, roi, scale, cloud=None):
+        calls.append(list(col.ids))
+        return table[table['id'].isin(col.ids)]
+    monkeypatch.setattr(pruning, 'scene_stats', scene_stats)
+    return calls
+
+GEO = {'type': 'Polygon', 'coordinates': [[[73.0, 18.0], [73.1, 18.0], [73.1, 18.1], [73.0, 18.1], [73.0, 18.0]]]}
+
+def test_prune_filters_and_reuses_cached_stats(stubbed):
+    out = pruning.prune(Collection(['s1', 's2']), None, GEO, "S1")
+    assert out.ids == ['s2'] and stubbed == [['s1', 's2']]
+    # Only the unseen scene is reduced on the next run
+    out = pruning.prune(Collection(['s1', 's2', 's3']), None, GEO, "S1")
+    assert out.ids == ['s2', 's3'] and stubbed[1:] == [['s3']]
+
+def test_prune_falls_back_to_unpruned_collection(stubbed):
+    col = Collection(['s1'])
+    with pytest.warns(UserWarning, match="No S1 scene passed pruning"):
+        assert pruning.prune(col, None, GEO, "S1") is col
+    assert pruning.prune(col, None, GEO, "S1", min_coverage=0.01).ids == ['s1']
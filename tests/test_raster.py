@@ -0,0 +1,61 @@
+from collections import deque
+import numpy as np
+import utils.raster as raster
+import utils.geometry as geometry
+
+def bfs_count(mask, eight_connected):
+    """Reference component count by breadth-first search."""
+    h, w = mask.shape
+    seen = np.zeros_like(mask)
+    steps = [(0, 1), (1, 0), (0, -1), (-1, 0)] + ([(1, 1), (1, -1), (-1, 1), (-1, -1)] if eight_connected else [])
+    count, sizes = 0, []
+    for y in range(h):
+        for x in range(w):
+            if not mask[y, x] or seen[y, x]: continue
+            count += 1
+            seen[y, x] = True
+            queue, size = deque([(y, x)]), 0
+            while queue:
+                cy, cx = queue.popleft()
+                size += 1
+                for dy, dx in steps:
+                    ny, nx = cy + dy, cx + dx
+                    if 0 <= ny < h and 0 <= nx < w and mask[ny, nx] and not seen[ny, nx]:
+                        seen[ny, nx] = True
+                        queue.append((ny, nx))
+            sizes.append(size)
+    return count, sorted(sizes)
+
+def test_label_components_matches_bfs():
+    rng = np.random.default_rng(0)
+    for density in (0.2, 0.45, 0.6):
+        mask = rng.random((60, 70)) < density
+        for eight in (False, True):
+            labels, count = raster.label_components(mask, eight_connected=eight)
+            ref_count, ref_sizes = bfs_count(mask, eight)
+            assert count == ref_count
+            assert sorted(np.bincount(labels.ravel())[1:].tolist()) == ref_sizes
+            assert ((labels > 0) == mask).all()
+
+def test_label_components_empty():
+    labels, count = raster.label_components(np.zeros((4, 4), dtype=bool))
+    assert count == 0 and not labels.any()
+
+def test_polygon_mask_matches_point_in_polygon():
+    rng = np.random.default_rng(1)
+    shell = geometry.circle(75.0, 20.0, 5000, n=37)['coordinates'][0]
+    ring = np.asarray(shell)
+    ring[:-1] += rng.normal(0, 0.003, ring[:-1].shape)
+    ring[-1] = ring[0]
+    hole = geometry.circle(75.0, 20.0, 1500, n=12)['coordinates'][0]
+    geo = {'type': 'Polygon', 'coordinates': [ring.tolist(), hole]}
+    bounds, shape = (74.94, 19.94, 75.06, 20.06), (57, 83)
+    h, w = shape
+    xs = bounds[0] + (np.arange(w) + 0.5) * (bounds[2] - bounds[0]) / w
+    ys = bounds[3] - (np.arange(h) + 0.5) * (bounds[3] - bounds[1]) / h
+    px, py = np.meshgrid(xs, ys)
+    expected = geometry.points_inside(geo, np.column_stack([px.ravel(), py.ravel()])).reshape(shape)
+    assert (raster.polygon_mask(geo, bounds, shape) == expected).all()
+
+def test_polygon_mask_without_polygons_is_empty():
+    assert not raster.polygon_mask({'type': 'Point', 'coordinates': [75, 20]}, (74, 19, 76, 21), (8, 8)).any()
@@ -0,0 +1,38 @@
+import os
+import time
+from datetime import date
+import pytest
+import utils.cache as cache
+import utils.report as report
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path))
+
+def write(name, size, age_days):
+    path = cache.cache_path(report.ROOT, "fp", name)
+    with open(path, 'wb') as f: f.write(b'x' * size)
+    t = time.time() - age_days * 86400
+    os.utime(path, (t, t))
+    return path
+
+def test_window_end():
+    assert report._window_end({'start': '2023-06-01', 'end': '2023-09-30'}) == '2023-09-30'
+    assert report._window_end({'events': [('2023-06-15', '2023-06-27'), ('2023-06-27', '2023-07-09')]}) == '2023-07-09'
+    assert report._window_end({'year_start': 2018, 'year_end': 2023}) == '2024-01-01'
+    assert report._window_end({'type': 'Farm Pond', 'w': {'rain': 0.2}}) is None
+
+def test_recent_pages_expire():
+    old = write("old.pkl", 10, 1)
+    assert report._fresh(old, {'end': '2020-01-01'})
+    assert report._fresh(old, {'type': 'Farm Pond'})
+    assert not report._fresh(old, {'end': date.today().isoformat()})
+
+def test_prune_by_age_then_size(monkeypatch):
+    monkeypatch.setattr(report, 'MAX_BYTES', 250)
+    stale = write("stale.pkl", 10, report.MAX_AGE_DAYS + 1)
+    oldest = write("a.pkl", 100, 3)
+    kept = [write("b.pkl", 100, 2), write("c.pkl", 100, 1)]
+    report.prune_cache()
+    assert not os.path.exists(stale) and not os.path.exists(oldest)
+    assert all(os.path.exists(p) for p in kept)
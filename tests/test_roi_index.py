@@ -0,0 +1,35 @@
+import pytest
+import utils.roi_index as roi_index
+
+def square(x0, y0, x1, y1, clockwise=False, start=0):
+    ring = [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+    if clockwise: ring = ring[::-1]
+    ring = ring[start:] + ring[:start]
+    return {'type': 'Polygon', 'coordinates': [ring + ring[:1]]}
+
+@pytest.fixture(autouse=True)
+def index_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(roi_index, 'DB', str(tmp_path / "roi_index.sqlite"))
+
+def test_same_roi_redrawn_finds_exact_result():
+    roi_index.save_result(square(73.0, 18.0, 73.6, 18.4), 'sar_vv', "/cache/a.npy", (73.0, 18.0, 73.6, 18.4))
+    for redrawn in (square(73.0, 18.0, 73.6, 18.4, clockwise=True, start=2),
+                    square(73.0, 18.0, 73.6, 18.4, start=3),
+                    {'type': 'MultiPolygon', 'coordinates': [square(73.0, 18.0, 73.6, 18.4, True, 1)['coordinates']]}):
+        assert roi_index.find_result(redrawn, 'sar_vv') == ("/cache/a.npy", (73.0, 18.0, 73.6, 18.4), True)
+    assert roi_index.find_result(square(73.0, 18.0, 73.6, 18.4), 'sar_vh') is None
+
+def test_contained_roi_in_another_grid_cell_finds_outer_result():
+    roi_index.save_result(square(73.0, 18.0, 73.6, 18.4), 'sar_vv', "/cache/a.npy", (73.0, 18.0, 73.6, 18.4))
+    roi_index.save_result(square(73.2, 18.1, 73.5, 18.3), 'sar_vv', "/cache/b.npy", (73.2, 18.1, 73.5, 18.3))
+    # Bounding-box corner in cell (293, 73), away from the outer ROI's own corner cell
+    inner = square(73.3, 18.3, 73.4, 18.35, clockwise=True)
+    assert roi_index.find_result(inner, 'sar_vv') == ("/cache/a.npy", (73.0, 18.0, 73.6, 18.4), False)
+    # The smallest containing ROI wins
+    assert roi_index.find_result(square(73.3, 18.15, 73.4, 18.25), 'sar_vv')[0] == "/cache/b.npy"
+    assert roi_index.find_result(square(73.5, 18.3, 73.7, 18.35), 'sar_vv') is None
+
+def test_register_is_idempotent():
+    fp = roi_index.register(square(73.0, 18.0, 73.1, 18.1))
+    assert roi_index.register(square(73.0, 18.0, 73.1, 18.1, clockwise=True, start=1)) == fp
+    assert roi_index._execute("SELECT COUNT(*) FROM rois")[0][0] == 1
@@ -0,0 +1,72 @@
+import numpy as np
+import utils.sar_local as sar_local
+
+def brute_focal(arr, radius, fn):
+    """Reference focal filter: every pixel's circular (dx² + dy² <= r²) or elliptical ((ry, rx)) window, NaN ignored."""
+    h, w = arr.shape
+    ry, rx = radius if isinstance(radius, tuple) else (radius, radius)
+    r = int(np.floor(max(ry, rx)))
+    inside = (lambda dy, dx: dx * dx + dy * dy <= radius * radius) if rx == ry else (lambda dy, dx: (dx / rx) ** 2 + (dy / ry) ** 2 <= 1)
+    offsets = [(dy, dx) for dy in range(-r, r + 1) for dx in range(-r, r + 1) if inside(dy, dx)]
+    out = np.full((h, w), np.nan, dtype=np.float64)
+    for y in range(h):
+        for x in range(w):
+            vals = [arr[y + dy, x + dx] for dy, dx in offsets if 0 <= y + dy < h and 0 <= x + dx < w]
+            vals = np.array([v for v in vals if not np.isnan(v)])
+            if vals.size: out[y, x] = fn(vals)
+    return out
+
+def sample(seed=0, shape=(23, 31)):
+    rng = np.random.default_rng(seed)
+    arr = rng.normal(-15, 4, shape).astype(np.float32)
+    arr[rng.random(shape) < 0.1] = np.nan
+    arr[:3, :5] = np.nan
+    return arr
+
+def test_focal_mean_matches_brute_force():
+    arr = sample()
+    for radius in (1.0, 2.5, 3.7):
+        np.testing.assert_allclose(sar_local.focal_mean(arr, radius), brute_focal(arr, radius, np.mean), rtol=1e-5, atol=1e-4)
+
+def test_focal_median_matches_brute_force():
+    arr = sample(1)
+    for radius in (1.0, 2.5):
+        np.testing.assert_allclose(sar_local.focal_median(arr, radius), brute_focal(arr, radius, np.median), rtol=1e-5, atol=1e-4)
+
+def test_elliptical_kernel_matches_brute_force():
+    arr = sample(3)
+    for radius in ((1.5, 3.0), (2.2, 4.4)):
+        np.testing.assert_allclose(sar_local.focal_mean(arr, radius), brute_focal(arr, radius, np.mean), rtol=1e-5, atol=1e-4)
+        np.testing.assert_allclose(sar_local.focal_median(arr, radius), brute_focal(arr, radius, np.median), rtol=1e-5, atol=1e-4)
+
+def test_radius_is_metric_on_both_axes():
+    ry, rx = sar_local.radius_px(50)
+    assert ry == rx
+    ry, rx = sar_local.radius_px(50, (10.0, 59.0, 11.0, 61.0))
+    assert abs(rx / ry - 2.0) < 1e-6 and ry == sar_local.radius_px(50)[0]
+
+def test_focal_filters_chunk_seams(monkeypatch):
+    # Tiny chunks force many halo-padded row blocks; results must not depend on the chunking
+    arr = sample(2, (40, 17))
+    full_mean, full_median = sar_local.focal_mean(arr, 2.2), sar_local.focal_median(arr, 2.2)
+    monkeypatch.setattr(sar_local, 'CHUNK_MB', 1e-4)
+    np.testing.assert_array_equal(sar_local.focal_mean(arr, 2.2), full_mean)
+    np.testing.assert_array_equal(sar_local.focal_median(arr, 2.2), full_median)
+
+def test_size_filter_drops_small_regions():
+    mask = np.zeros((10, 10), dtype=bool)
+    mask[1:4, 1:4] = True      # 9 px, kept
+    mask[7, 7:9] = True        # 2 px, dropped
+    mask[5, 5] = True          # touches nothing 8-connected, dropped
+    out = sar_local.size_filter(mask, min_pixels=8)
+    assert out.sum() == 9 and out[1:4, 1:4].all()
+
+def test_flood_mask_ratio_threshold():
+    before = np.full((12, 12), -15.0, dtype=np.float32)
+    after = before.copy()
+    after[2:6, 2:6] = -20.0    # ratio 1.33 over 16 px
+    after[9, 9] = -20.0        # isolated pixel removed by the size filter
+    static = np.ones((12, 12), dtype=bool)
+    static[2, 2] = False
+    flooded = sar_local.flood_mask(before, after, static, 1.25)
+    assert flooded.sum() == 15 and not flooded[9, 9] and not flooded[2, 2]
@@ -0,0 +1,30 @@
+import numpy as np
+import utils.sensitivity as sensitivity
+
+BASE = [0.25, 0.2, 0.2, 0.15, 0.2]
+
+def test_pixel_stats_match_brute_force():
+    rng = np.random.default_rng(0)
+    stack = rng.random((20000, 5)).astype(np.float32)
+    stack[::37, 3] = np.nan
+    valid = ~np.isnan(stack).any(axis=1)
+    for concentration in (200.0, 15.0):
+        weights = sensitivity.sample_weights(BASE, 500, concentration, seed=1)
+        mean, std, prob = sensitivity.pixel_stats(stack, weights, threshold=0.65)
+        scores = stack[valid] @ weights
+        np.testing.assert_allclose(mean[valid], scores.mean(axis=1), atol=1e-5)
+        np.testing.assert_allclose(std[valid], scores.std(axis=1), atol=1e-4)
+        np.testing.assert_array_equal(prob[valid], (scores > 0.65).mean(axis=1).astype(np.float32))
+        assert np.isnan(prob[~valid]).all()
+
+def test_rank_stability_matches_per_site_means():
+    rng = np.random.default_rng(2)
+    labels = rng.integers(0, 30, (50, 40))
+    stack = rng.random((labels.size, 5)).astype(np.float32)
+    site_labels = [12, 3, 27]
+    weights = sensitivity.sample_weights(BASE, 200, 50.0, seed=0)
+    out = sensitivity.rank_stability(stack, labels, site_labels, weights)
+    crit = np.stack([stack[labels.ravel() == lab].mean(axis=0) for lab in site_labels])
+    ranks = np.argsort(np.argsort(-(crit @ weights), axis=0), axis=0) + 1
+    np.testing.assert_allclose(out['mean_rank'], ranks.mean(axis=1))
+    np.testing.assert_allclose(out['p_same_rank'], (ranks == np.arange(1, 4)[:, None]).mean(axis=1))
@@ -0,0 +1,78 @@
+import os
+import sys
+import types
+import importlib
+import numpy as np
+import pytest
+import utils.cache as cache
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """utils.session_store over a temporary cache, with a dict standing in for st.session_state."""
+    if 'streamlit' not in sys.modules:
+        try:
+            importlib.import_module('streamlit')
+        except ImportError:
+            monkeypatch.setitem(sys.modules, 'streamlit', types.ModuleType('streamlit'))
+    ss = importlib.import_module('utils.session_store')
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(ss, 'st', types.SimpleNamespace(session_state={}))
+    monkeypatch.setattr(ss, '_RESIDENT', type(ss._RESIDENT)())
+    monkeypatch.setattr(ss, '_SESSIONS', {})
+    monkeypatch.setattr(ss, '_STATS', dict.fromkeys(ss._STATS, 0))
+    monkeypatch.setattr(ss, '_DISK', {'bytes': None})
+    return ss
+
+def new_session(ss):
+    ss.st.session_state = {}
+
+def blob(i, n=1000):
+    return np.full(n, i, dtype=np.uint8)
+
+def test_session_budget_drops_oldest_reference(store, monkeypatch):
+    monkeypatch.setattr(store, 'SESSION_BYTES', 2500)
+    for i in range(3): store.put(f"v{i}", blob(i))
+    assert store.get("v0") is None
+    assert store.get("v1")[0] == 1 and store.get("v2")[0] == 2
+    assert store.metrics()['session_evictions'] == 1 and store.metrics()['session_items'] == 2
+
+def test_resident_lru_evicts_then_reloads_from_disk(store, monkeypatch):
+    monkeypatch.setattr(store, 'MEMORY_BYTES', 2500)
+    for i in range(3): store.put(f"v{i}", blob(i))
+    m = store.metrics()
+    assert m['resident_items'] == 2 and m['memory_evictions'] == 1
+    assert store.get("v0")[0] == 0
+    assert store.metrics()['loads'] == 1 and store.get("v2")[0] == 2 and store.metrics()['hits'] == 1
+
+def test_disk_budget_prunes_oldest_blobs(store, monkeypatch):
+    monkeypatch.setattr(store, 'DISK_BYTES', 3500)
+    paths = []
+    for i in range(5):
+        store.put(f"v{i}", blob(i))
+        paths.append(max((p for _, _, p in store._blobs()), key=os.path.getmtime))
+        # Distinct mtimes, oldest first
+        os.utime(paths[-1], (1000 + i, 1000 + i))
+    assert store.metrics()['disk_bytes'] <= 3500 and store.metrics()['disk_evictions'] > 0
+    assert not os.path.exists(paths[0]) and os.path.exists(paths[-1])
+    # A pruned blob the session still references is recomputed by the caller
+    store._RESIDENT.clear()
+    assert store.get("v0") is None and store.metrics()['misses'] == 1
+
+def test_request_key_lookup_across_sessions_and_restarts(store):
+    store.put('arrays', blob(7), key=('fp', 'params'))
+    assert store.get('arrays', key=('fp', 'other')) is None
+    # Another session after a restart: nothing in memory or in its session state
+    new_session(store)
+    store._RESIDENT.clear()
+    assert store.get('arrays') is None
+    assert store.get('arrays', key=('fp', 'params'))[0] == 7
+    assert store.metrics()['session_items'] == 1 and store.get('arrays')[0] == 7
+
+def test_stale_key_index_is_dropped(store):
+    store.put('arrays', blob(3), key=('fp', 'params'))
+    new_session(store)
+    store._RESIDENT.clear()
+    for _, _, path in store._blobs(): os.remove(path)
+    ref = store._ref_path(store.job_id(('fp', 'params')))
+    assert store.get('arrays', default="gone", key=('fp', 'params')) == "gone"
+    assert not os.path.exists(ref)
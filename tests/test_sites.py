@@ -0,0 +1,47 @@
+import math
+import numpy as np
+import utils.sites as sites
+
+BOUNDS = (73.0, 18.0, 73.04, 18.04)   # 40 x 40 px of 0.001 deg
+LAT0 = 18.02
+
+def suitability():
+    suit = np.full((40, 40), 0.3)
+    suit[2:5, 2:5] = 0.9
+    suit[3, 3] = 0.95          # A: mean ~0.906, peak at (3, 3)
+    suit[2:6, 8:12] = 0.8      # B: mean 0.8, peak 5-8 px east of A
+    suit[30:33, 30:33] = 0.85  # C: mean 0.85, far from both
+    suit[20, 0:2] = 0.99       # 2 px: below min_pixels
+    suit[0, 39] = np.nan
+    return suit
+
+def test_components_ranked_by_mean_and_spacing_enforced():
+    ranked, labels = sites.extract_sites(suitability(), BOUNDS, threshold=0.65, min_spacing_m=500, min_pixels=4)
+    assert [s['mean_score'] for s in ranked] == [0.906, 0.85, 0.8]
+    assert [s['pixels'] for s in ranked] == [9, 9, 16] and [s['rank'] for s in ranked] == [1, 2, 3]
+    assert ranked[0]['peak_score'] == 0.95 and labels.max() == 4
+    assert (ranked[0]['lon'], ranked[0]['lat']) == (73.0035, 18.0365)
+    # B's peak is ~530-850 m from A's: a 1 km spacing drops it, C stays
+    spaced, _ = sites.extract_sites(suitability(), BOUNDS, threshold=0.65, min_spacing_m=1000, min_pixels=4)
+    assert [s['mean_score'] for s in spaced] == [0.906, 0.85]
+    assert sites.extract_sites(suitability(), BOUNDS, top_k=1)[0][0]['mean_score'] == 0.906
+
+def test_drainage_distance_of_selected_sites():
+    drain = np.zeros((40, 40))
+    drain[:, 20] = 1.0
+    ranked, _ = sites.extract_sites(suitability(), BOUNDS, drain, min_spacing_m=500)
+    dx = 0.001 * sites.M_PER_DEG * math.cos(math.radians(LAT0))
+    # A's peak is in column 3, C's in column 30 or beyond: both measured horizontally to column 20
+    assert abs(ranked[0]['drain_dist_m'] - 17 * dx) < 0.1
+    assert ranked[1]['drain_dist_m'] >= 10 * dx - 0.1
+    assert sites.extract_sites(suitability(), BOUNDS, np.zeros((40, 40)))[0][0]['drain_dist_m'] is None
+
+def test_nearest_drainage_matches_brute_force():
+    rng = np.random.default_rng(0)
+    drain = (rng.random((40, 40)) > 0.97).astype(float)
+    index = sites._drainage_index(drain, BOUNDS, 500.0)
+    rows, cols = np.nonzero(drain >= sites.DRAIN_THRESHOLD)
+    x, y = sites._to_metres(73.0 + (cols + 0.5) * 0.001, 18.04 - (rows + 0.5) * 0.001, LAT0)
+    for px, py in rng.uniform([73.0, 18.0], [73.04, 18.04], (25, 2)):
+        qx, qy = sites._to_metres(px, py, LAT0)
+        assert abs(sites._nearest_drainage(index, qx, qy) - np.hypot(x - qx, y - qy).min()) < 1e-6
@@ -0,0 +1,73 @@
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+import utils.cache as cache
+import utils.ts_store as ts_store
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path))
+
+class Source:
+    """Daily series published up to `until` (exclusive), recording every fetch window."""
+    def __init__(self, until, nan_days=()):
+        self.until, self.nan_days, self.calls = until, set(nan_days), []
+
+    def __call__(self, start, end):
+        self.calls.append((start, end))
+        days = pd.date_range(start, end, inclusive='left')
+        days = days[days < pd.Timestamp(self.until)]
+        values = [np.nan if d.date().isoformat() in self.nan_days else 1.0 for d in days]
+        return pd.DataFrame({'date': days.strftime('%Y-%m-%d'), 'value': np.float32(values)})
+
+def manifest():
+    return ts_store._read_manifest(ts_store._dir('fp', 'rain'))
+
+def test_settled_window_is_fetched_once():
+    src = Source(date(2024, 3, 1))
+    df = ts_store.update('fp', 'rain', '2024-01-01', '2024-02-01', src, lag_days=5, daily=True)
+    assert len(df) == 31 and manifest() == {'start': '2024-01-01', 'end': '2024-02-01'}
+    ts_store.update('fp', 'rain', '2024-01-01', '2024-02-01', src, lag_days=5, daily=True)
+    ts_store.update('fp', 'rain', '2024-01-10', '2024-01-20', src, lag_days=5, daily=True)
+    assert src.calls == [('2024-01-01', '2024-02-01')]
+
+def test_extension_fetches_only_the_gaps():
+    src = Source(date(2024, 6, 1))
+    ts_store.update('fp', 'rain', '2024-02-01', '2024-03-01', src, lag_days=5, daily=True)
+    df = ts_store.update('fp', 'rain', '2024-01-01', '2024-04-01', src, lag_days=5, daily=True)
+    assert src.calls[1:] == [('2024-01-01', '2024-02-01'), ('2024-03-01', '2024-04-01')]
+    assert len(df) == 91 and df['date'].is_unique
+
+def test_days_inside_the_lag_are_refetched():
+    today = date.today()
+    start, end = (today - timedelta(days=20)).isoformat(), (today + timedelta(days=1)).isoformat()
+    settled = (today - timedelta(days=5)).isoformat()
+    src = Source(today + timedelta(days=1))
+    df = ts_store.update('fp', 'rain', start, end, src, lag_days=5, daily=True)
+    assert len(df) == 21 and manifest() == {'start': start, 'end': settled}
+    ts_store.update('fp', 'rain', start, end, src, lag_days=5, daily=True)
+    assert src.calls[-1] == (settled, end)
+
+def test_unpublished_and_nan_days_are_not_covered():
+    src = Source(date(2024, 1, 20), nan_days={'2024-01-10'})
+    df = ts_store.update('fp', 'rain', '2024-01-01', '2024-02-01', src, lag_days=5, daily=True)
+    assert manifest()['end'] == '2024-01-10' and len(df) == 19
+    # Published later: the gap from the NaN day onwards is fetched again and now covered
+    src.until, src.nan_days = date(2024, 3, 1), set()
+    df = ts_store.update('fp', 'rain', '2024-01-01', '2024-02-01', src, lag_days=5, daily=True)
+    assert src.calls[-1] == ('2024-01-10', '2024-02-01')
+    assert manifest()['end'] == '2024-02-01' and len(df) == 31 and not df['value'].isna().any()
+
+def test_head_gap_keeps_coverage_contiguous():
+    src = Source(date(2024, 6, 1), nan_days={'2024-01-05'})
+    ts_store.update('fp', 'rain', '2024-02-01', '2024-03-01', src, lag_days=5, daily=True)
+    ts_store.update('fp', 'rain', '2024-01-01', '2024-03-01', src, lag_days=5, daily=True)
+    assert manifest() == {'start': '2024-01-06', 'end': '2024-03-01'}
+
+def test_scene_series_ignore_missing_days():
+    # Scene series (daily=False) have gaps by nature; only the lag limits coverage
+    src = Source(date(2024, 3, 1))
+    fetch = lambda s, e: src(s, e).iloc[::3]
+    ts_store.update('fp', 'rain', '2024-01-01', '2024-02-01', fetch)
+    assert manifest() == {'start': '2024-01-01', 'end': '2024-02-01'}
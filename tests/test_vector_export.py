@@ -0,0 +1,82 @@
+import os
+import time
+import numpy as np
+import utils.cache as cache
+import utils.vector_export as vector_export
+
+def rect(x0, y0, x1, y1):
+    """CCW closed ring in grid coordinates."""
+    return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]], dtype=np.int64)
+
+def merge(rings, classes):
+    parts = [vector_export._unit_edges(r) for r in rings]
+    starts = np.vstack([p[0] for p in parts])
+    steps = np.vstack([p[1] for p in parts])
+    cls = np.concatenate([np.full(len(p[0]), c) for p, c in zip(parts, classes)])
+    return vector_export._cancel(starts, steps, cls)
+
+def ring_area(r):
+    return 0.5 * np.sum(r[:-1, 0] * r[1:, 1] - r[1:, 0] * r[:-1, 1])
+
+def test_square_split_by_a_tile_seam_merges():
+    starts, steps = merge([rect(0, 0, 2, 4), rect(2, 0, 4, 4)], [1, 1])
+    assert len(starts) == 16  # the 4 shared seam edges cancel in both directions
+    rings = vector_export._trace(starts, steps)
+    assert len(rings) == 1
+    assert len(rings[0]) == 5 and ring_area(rings[0]) == 16
+
+def test_different_classes_do_not_merge():
+    starts, steps = merge([rect(0, 0, 2, 4), rect(2, 0, 4, 4)], [1, 2])
+    assert len(starts) == 24
+    assert len(vector_export._trace(starts, steps)) == 2
+
+def test_ring_around_a_seam_keeps_its_hole():
+    # A 6x6 square with a 2x2 hole, cut into two tiles through the hole
+    left = [rect(0, 0, 3, 6)]
+    right = [rect(3, 0, 6, 6)]
+    hole_left, hole_right = rect(2, 2, 3, 4)[::-1], rect(3, 2, 4, 4)[::-1]
+    starts, steps = merge(left + [hole_left] + right + [hole_right], [1, 1, 1, 1])
+    rings = vector_export._trace(starts, steps)
+    polys = vector_export._assemble(rings)
+    assert len(polys) == 1 and len(polys[0]) == 2
+    assert ring_area(polys[0][0]) == 36 and ring_area(polys[0][1]) == -4
+
+def test_corner_touching_squares_stay_apart():
+    starts, steps = merge([rect(0, 0, 2, 2), rect(2, 2, 4, 4)], [1, 1])
+    rings = vector_export._trace(starts, steps)
+    assert sorted(ring_area(r) for r in rings) == [4, 4]
+
+def test_features_streams_tiles_and_merges_seams(monkeypatch):
+    # 8 x 4 px ROI in two 4 px tiles; each tile returns its whole window as one class-1 polygon
+    monkeypatch.setattr(vector_export, 'TILE_PX', 4)
+    monkeypatch.setattr(vector_export, 'MAX_IN_FLIGHT', 1)
+    res = 0.001
+
+    def fetch(image, tile, r):
+        x0, y0, x1, y1 = tile
+        w, e, s, n = x0 * res - 180, x1 * res - 180, 90 - y1 * res, 90 - y0 * res
+        return [{'properties': {'class': 1}, 'geometry': {'type': 'Polygon', 'coordinates': [[[w, s], [e, s], [e, n], [w, n], [w, s]]]}}]
+
+    monkeypatch.setattr(vector_export, '_fetch', fetch)
+    roi = {'type': 'Polygon', 'coordinates': [[[0, 0], [0.008, 0], [0.008, 0.004], [0, 0.004], [0, 0]]]}
+    feats = list(vector_export.features(None, roi, res * 111320.0, {1: 'Zone'}))
+    assert len(feats) == 1 and feats[0]['name'] == 'Zone'
+    ring = feats[0]['rings'][0]
+    assert np.allclose(ring.min(axis=0), [0, 0]) and np.allclose(ring.max(axis=0), [0.008, 0.004])
+
+def test_result_size_errors_trigger_a_split():
+    assert vector_export.TOO_MANY.search("Collection query aborted after accumulating over 5000 elements.")
+    assert vector_export.TOO_MANY.search("Too many pixels in the region.")
+    assert not vector_export.TOO_MANY.search("User memory limit exceeded (5000 MB).")
+
+def test_export_prunes_old_vectors(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(vector_export, 'features', lambda *a: iter(()))
+    monkeypatch.setattr(vector_export, 'WRITERS', {'GeoJSON': lambda feats, path: path})
+    stale = cache.cache_path(vector_export.ROOT, "fp", "old.geojson")
+    with open(stale, 'wb') as f: f.write(b'{}')
+    t = time.time() - (vector_export.MAX_AGE_DAYS + 1) * 86400
+    os.utime(stale, (t, t))
+    roi = {'type': 'Polygon', 'coordinates': [[[0, 0], [0.01, 0], [0.01, 0.01], [0, 0.01], [0, 0]]]}
+    path = vector_export.export(None, roi, 10, {1: 'Zone'}, 'GeoJSON')
+    assert path.startswith(os.path.join(str(tmp_path), vector_export.ROOT)) and not os.path.exists(stale)
@@ -0,0 +1,33 @@
+import os
+import time
+
+# Local cache root shared by tile stores, time series and staged rasters
+CACHE_DIR = os.environ.get(
+    "GEOSAROVAR_CACHE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".geosarovar_cache")
+)
+
+def cache_path(*parts):
+    """Returns a path under the cache root, creating its parent folder."""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+def prune(root, max_age_days, max_bytes, now=None):
+    """Removes files under <cache>/<root> older than max_age_days, then the oldest ones beyond max_bytes."""
+    now = now or time.time()
+    files = []
+    for folder, _, names in os.walk(os.path.join(CACHE_DIR, root)):
+        for name in names:
+            path = os.path.join(folder, name)
+            try:
+                info = os.stat(path)
+            except OSError: continue
+            files.append((info.st_mtime, info.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in sorted(files):
+        if now - mtime <= max_age_days * 86400 and total <= max_bytes: break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError: pass
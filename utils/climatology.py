@@ -0,0 +1,128 @@
+import os
+import ee
+import numpy as np
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import utils.raster as raster
+from utils.cache import cache_path
+from utils.tile_store import slug
+
+# Day-of-year cumulative rainfall climatology on a 366-day calendar (slot 60 = Feb 29).
+# Chunks of shape (367, chunk, chunk) hold cum[d] = mean rainfall (mm) of calendar days 1..d,
+# stored at <cache>/climatology/<dataset>_<y0>_<y1>/<cx>_<cy>.npy on the dataset's native grid.
+ROOT = "climatology"
+FEB29 = 60
+# Largest LTM grid sent inline as an ee.Array (~8 bytes of JSON per value)
+MAX_UPLOAD_PX = 40_000
+
+def _slot(day):
+    return (date(2000, day.month, day.day) - date(2000, 1, 1)).days + 1
+
+def _is_leap(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+def _calendar_image(spec, y0, y1):
+    """366-band image: mean daily rainfall (mm) per calendar day over the baseline years."""
+    if 'monthly' in spec:
+        # Sub-daily products: per-month means of the monthly aggregate, repeated over each month's days
+        # (12 filters over ~12 images per year instead of 366 over ~17,500 half-hourly scenes)
+        m = spec['monthly']
+        col = ee.ImageCollection(m['id']).filterDate(f"{y0}-01-01", f"{y1 + 1}-01-01").select(m['band'])
+        months = {k: col.filter(ee.Filter.calendarRange(k, k, 'month')).mean().multiply(m['daily_factor']).rename('p').toFloat()
+                  for k in range(1, 13)}
+        days = [date(2000, 1, 1) + timedelta(days=i) for i in range(366)]
+        return ee.ImageCollection.fromImages([months[d.month] for d in days]).toBands()
+
+    col = ee.ImageCollection(spec['id']).filterDate(f"{y0}-01-01", f"{y1 + 1}-01-01").select(spec['band'])
+
+    def day_mean(slot):
+        # 2000 is a leap year, so its day sequence maps slots onto month/day including Feb 29
+        day = ee.Date('2000-01-01').advance(ee.Number(slot).subtract(1), 'day')
+        month, dom = day.get('month'), day.get('day')
+        sub = col.filter(ee.Filter.calendarRange(month, month, 'month')).filter(ee.Filter.calendarRange(dom, dom, 'day_of_month'))
+        mean = ee.Image(ee.Algorithms.If(sub.size().gt(0), sub.mean(), ee.Image.constant(0)))
+        return mean.multiply(spec['daily_factor']).rename('p').toFloat()
+
+    return ee.ImageCollection(ee.List.sequence(1, 366).map(day_mean)).toBands()
+
+def _chunk_file(spec, y0, y1, cx, cy):
+    source = spec['monthly']['id'] if 'monthly' in spec else spec['id']
+    return cache_path(ROOT, f"{slug(source)}_{y0}_{y1}", f"{cx}_{cy}.npy")
+
+def _compute_chunk(spec, y0, y1, cx, cy):
+    n, res = spec['chunk'], spec['res']
+    bounds = (-180 + cx * n * res, 90 - (cy + 1) * n * res, -180 + (cx + 1) * n * res, 90 - cy * n * res)
+    bands = raster.compute_pixels(_calendar_image(spec, y0, y1), bounds, (n, n))
+    daily = np.stack([bands[b] for b in sorted(bands, key=lambda b: int(b.split('_')[0]))])
+    cum = np.concatenate([np.zeros((1, n, n), dtype=np.float32), np.cumsum(daily, axis=0)]).astype(np.float32)
+    np.save(_chunk_file(spec, y0, y1, cx, cy), cum)
+
+def cumulative_window(spec, y0, y1, bounds, max_workers=8):
+    """Cumulative climatology over bounds, computing missing chunks in EE first.
+
+    Returns (array of shape (367, h, w), grid bounds).
+    """
+    n, res = spec['chunk'], spec['res']
+    grid_bounds, (h, w) = raster.snap_bounds(bounds, res)
+    c0 = int(round((grid_bounds[0] + 180) / res))
+    r0 = int(round((90 - grid_bounds[3]) / res))
+    chunks = [(cx, cy) for cx in range(c0 // n, (c0 + w - 1) // n + 1) for cy in range(r0 // n, (r0 + h - 1) // n + 1)]
+
+    missing = [c for c in chunks if not os.path.exists(_chunk_file(spec, y0, y1, *c))]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(lambda c: _compute_chunk(spec, y0, y1, *c), missing))
+
+    out = np.empty((367, h, w), dtype=np.float32)
+    for cx, cy in chunks:
+        cum = np.load(_chunk_file(spec, y0, y1, cx, cy), mmap_mode='r')
+        # Intersection of this chunk with the window, in global pixel indices
+        gc0, gc1 = max(c0, cx * n), min(c0 + w, (cx + 1) * n)
+        gr0, gr1 = max(r0, cy * n), min(r0 + h, (cy + 1) * n)
+        out[:, gr0 - r0:gr1 - r0, gc0 - c0:gc1 - c0] = cum[:, gr0 - cy * n:gr1 - cy * n, gc0 - cx * n:gc1 - cx * n]
+    return out, grid_bounds
+
+def ltm(spec, y0, y1, bounds, start, end):
+    """Long-term mean rainfall (mm) for the window [start, end) from cumulative lookups.
+
+    Each calendar-year segment costs two lookups and a subtraction; Feb 29 is dropped for
+    segments in non-leap years. Returns (array, grid bounds).
+    """
+    cum, grid_bounds = cumulative_window(spec, y0, y1, bounds)
+    total = np.zeros(cum.shape[1:], dtype=np.float32)
+    day, end = date.fromisoformat(start), date.fromisoformat(end)
+    while day < end:
+        seg_end = min(end, date(day.year + 1, 1, 1))
+        s_slot, e_slot = _slot(day), _slot(seg_end - timedelta(days=1))
+        total += cum[e_slot] - cum[s_slot - 1]
+        if not _is_leap(day.year) and s_slot <= FEB29 <= e_slot:
+            total -= cum[FEB29] - cum[FEB29 - 1]
+        day = seg_end
+    return total, grid_bounds
+
+def _block_mean(arr, k):
+    """k x k block mean ignoring NaN (edges padded with NaN)."""
+    h, w = arr.shape
+    H, W = -(-h // k) * k, -(-w // k) * k
+    padded = np.full((H, W), np.nan, dtype=np.float32)
+    padded[:h, :w] = arr
+    blocks = padded.reshape(H // k, k, W // k, k)
+    valid = ~np.isnan(blocks)
+    count = valid.sum(axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, np.where(valid, blocks, 0).sum(axis=(1, 3)) / count, np.nan)
+
+def to_image(arr, bounds, res, max_pixels=MAX_UPLOAD_PX):
+    """Uploads a small lon/lat grid as one constant array image indexed by pixel position.
+
+    Grids above max_pixels are block-averaged first, so the request size stays bounded for any ROI.
+    """
+    k = int(np.ceil(np.sqrt(arr.size / max_pixels))) if arr.size > max_pixels else 1
+    if k > 1: arr, res = _block_mean(arr, k), res * k
+    h, w = arr.shape
+    values = np.where(np.isnan(arr), -1, np.round(arr, 2)).tolist()
+    lonlat = ee.Image.pixelLonLat()
+    col = lonlat.select('longitude').subtract(bounds[0]).divide(res).floor().clamp(0, w - 1)
+    row = ee.Image.constant(bounds[3]).subtract(lonlat.select('latitude')).divide(res).floor().clamp(0, h - 1)
+    img = ee.Image(ee.Array(values)).arrayGet(ee.Image.cat([row, col]).toInt())
+    return img.updateMask(img.gte(0)).rename('ltm')
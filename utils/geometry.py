@@ -0,0 +1,156 @@
+import json
+import hashlib
+import numpy as np
+
+# Client-side geometry canonicalisation: the same area always yields the same fingerprint whether it
+# came from a KML, a buffered point or the draw tool (ring direction, start vertex, float noise).
+DIGITS = 6  # ~0.1 m
+
+def polygons(geo_json):
+    """List of polygons (lists of [lon, lat] rings) from a Polygon, MultiPolygon or GeometryCollection."""
+    t = geo_json['type']
+    if t == 'Polygon': return [geo_json['coordinates']]
+    if t == 'MultiPolygon': return list(geo_json['coordinates'])
+    if t == 'GeometryCollection': return [p for g in geo_json['geometries'] for p in polygons(g)]
+    return []
+
+def signed_area(ring):
+    """Shoelace area in degree² (positive for counter-clockwise rings)."""
+    r = np.asarray(ring, dtype=np.float64)[:, :2]
+    x, y = r[:, 0], r[:, 1]
+    return 0.5 * float(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y))
+
+def canonical_ring(ring, ccw=True, digits=DIGITS):
+    """Quantised, de-duplicated, closed ring in the given orientation starting at its smallest vertex."""
+    pts = [(round(float(p[0]), digits), round(float(p[1]), digits)) for p in ring]
+    if len(pts) > 1 and pts[0] == pts[-1]: pts = pts[:-1]
+    pts = [p for i, p in enumerate(pts) if i == 0 or p != pts[i - 1]]
+    if len(pts) > 1 and pts[0] == pts[-1]: pts = pts[:-1]
+    if len(pts) < 3: return None
+    if (signed_area(pts) > 0) != ccw: pts = pts[::-1]
+    start = pts.index(min(pts))
+    pts = pts[start:] + pts[:start]
+    return [list(p) for p in pts + pts[:1]]
+
+def _quantised(geo_json, digits):
+    """Any GeoJSON geometry with its coordinates rounded (type and vertex order kept)."""
+    if geo_json['type'] == 'GeometryCollection':
+        return {'type': 'GeometryCollection', 'geometries': [_quantised(g, digits) for g in geo_json['geometries']]}
+    def walk(c):
+        if c and isinstance(c[0], (int, float)): return [round(float(v), digits) for v in c[:2]]
+        return [walk(x) for x in c]
+    return {'type': geo_json['type'], 'coordinates': walk(geo_json['coordinates'])}
+
+def canonical(geo_json, digits=DIGITS):
+    """Canonical GeoJSON: a MultiPolygon with CCW shells, CW holes (RFC 7946) and sorted parts.
+
+    Geometries without any areal part (points, lines, degenerate rings) keep their own type with
+    rounded coordinates, so they never collapse onto one empty MultiPolygon.
+    """
+    polys = []
+    for poly in polygons(geo_json):
+        shell = canonical_ring(poly[0], True, digits)
+        if shell is None: continue
+        holes = sorted(h for h in (canonical_ring(r, False, digits) for r in poly[1:]) if h)
+        polys.append([shell] + holes)
+    if not polys: return _quantised(geo_json, digits)
+    return {'type': 'MultiPolygon', 'coordinates': sorted(polys)}
+
+def fingerprint(geo_json):
+    text = json.dumps(canonical(geo_json), separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+def _edges(geo_json):
+    segs = []
+    for poly in polygons(geo_json):
+        for ring in poly:
+            r = np.asarray(ring, dtype=np.float64)[:, :2]
+            segs.append(np.hstack([r[:-1], r[1:]]))
+    return np.vstack(segs) if segs else np.zeros((0, 4))
+
+def points_inside(geo_json, pts):
+    """Even-odd point-in-polygon test for an (n, 2) array of lon/lat points."""
+    pts = np.asarray(pts, dtype=np.float64)
+    inside = np.zeros(len(pts), dtype=bool)
+    e = _edges(geo_json)
+    px, py = pts[:, 0:1], pts[:, 1:2]
+    x1, y1, x2, y2 = e[:, 0], e[:, 1], e[:, 2], e[:, 3]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_int = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    crosses = ((y1 > py) != (y2 > py)) & (px < x_int)
+    inside ^= (crosses.sum(axis=1) % 2).astype(bool)
+    return inside
+
+def contains(outer, inner):
+    """True if every part of `inner` lies inside `outer`: all vertices inside and no boundary crossings."""
+    a, b = _edges(outer), _edges(inner)
+    if not len(b) or not points_inside(outer, b[:, :2]).all(): return False
+    # Proper segment intersections between the two boundaries (orientation test)
+    def orient(p, q, r):
+        return np.sign((q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1]) - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0]))
+    q1, q2 = b[None, :, :2], b[None, :, 2:]
+    step = max(1, int(2e6 // len(b)))
+    for i in range(0, len(a), step):
+        p1, p2 = a[i:i + step, None, :2], a[i:i + step, None, 2:]
+        o1, o2 = orient(p1, p2, q1), orient(p1, p2, q2)
+        o3, o4 = orient(q1, q2, p1), orient(q1, q2, p2)
+        if np.any((o1 * o2 < 0) & (o3 * o4 < 0)): return False
+    return True
+
+EARTH_RADIUS = 6371008.8
+CIRCLE_VERTICES = 64
+MAX_VERTICES = 5000
+# Buffer of a bare point ROI (same default as the Point & Buffer sidebar mode)
+DEFAULT_RADIUS_M = 5000
+
+def circle(lon, lat, radius_m, n=CIRCLE_VERTICES):
+    """Geodesic circle polygon (e.g. the draw tool's circle, which arrives as a Point plus radius)."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    d = radius_m / EARTH_RADIUS
+    bearing = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    lat2 = np.arcsin(np.sin(lat1) * np.cos(d) + np.cos(lat1) * np.sin(d) * np.cos(bearing))
+    lon2 = lon1 + np.arctan2(np.sin(bearing) * np.sin(d) * np.cos(lat1), np.cos(d) - np.sin(lat1) * np.sin(lat2))
+    ring = np.degrees(np.column_stack([lon2, lat2])).tolist()
+    return {'type': 'Polygon', 'coordinates': [ring + ring[:1]]}
+
+def bbox_polygon(bounds):
+    min_lon, min_lat, max_lon, max_lat = bounds
+    return {'type': 'Polygon', 'coordinates': [[[min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat], [min_lon, min_lat]]]}
+
+def normalize(geo_json, radius=None):
+    """Polygon or MultiPolygon GeoJSON from any drawn/uploaded shape.
+
+    A circle (Point plus radius) becomes its geodesic polygon; a bare Point (marker) becomes the
+    bounding box of a DEFAULT_RADIUS_M buffer, like the Point & Buffer mode.
+    """
+    t = geo_json['type']
+    if t == 'Point':
+        lon, lat = geo_json['coordinates'][:2]
+        if radius: return circle(lon, lat, radius)
+        return bbox_polygon(summary(circle(lon, lat, DEFAULT_RADIUS_M))['bounds'])
+    if t == 'Polygon': return geo_json
+    polys = polygons(geo_json)
+    if not polys: return None
+    return {'type': 'Polygon', 'coordinates': polys[0]} if len(polys) == 1 else {'type': 'MultiPolygon', 'coordinates': polys}
+
+def ring_area(ring):
+    """Geodesic area (m²) enclosed by a lon/lat ring on the sphere."""
+    r = np.radians(np.asarray(ring, dtype=np.float64)[:, :2])
+    lon, lat = r[:, 0], r[:, 1]
+    dlon = np.roll(lon, -1) - lon
+    dlon = (dlon + np.pi) % (2 * np.pi) - np.pi
+    return abs(float(np.sum(dlon * (2 + np.sin(lat) + np.sin(np.roll(lat, -1)))))) * EARTH_RADIUS ** 2 / 2
+
+def summary(geo_json):
+    """Area (km²), bounding box, vertex and part counts, computed locally."""
+    polys = polygons(geo_json)
+    area = sum(ring_area(p[0]) - sum(ring_area(h) for h in p[1:]) for p in polys)
+    coords = np.vstack([np.asarray(r, dtype=np.float64)[:, :2] for p in polys for r in p]) if polys else np.zeros((0, 2))
+    bounds = tuple(float(v) for v in np.concatenate([coords.min(axis=0), coords.max(axis=0)])) if len(coords) else None
+    return {'area_km2': area / 1e6, 'bounds': bounds, 'vertices': int(len(coords)), 'parts': len(polys)}
+
+def estimate(geo_json, scale, max_pixels):
+    """Pixel count of the ROI at a module's working scale, and its share of the module's budget."""
+    s = summary(geo_json)
+    pixels = s['area_km2'] * 1e6 / scale ** 2
+    return dict(s, scale=scale, pixels=pixels, load=pixels / max_pixels)
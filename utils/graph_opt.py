@@ -0,0 +1,168 @@
+import json
+import ee
+
+# Client-side pass over the serialized EE expression graph before it is submitted: clips of an
+# image already clipped to the same geometry (directly or under footprint-preserving operations)
+# are dropped and the graph is re-encoded. ee.serializer already merges identical subexpressions;
+# nodes are interned here so geometry arguments compare by identity and subgraphs that become
+# identical once a clip is gone are merged too. Cloud API JSON values: constantValue,
+# valueReference, functionInvocationValue, arrayValue, dictionaryValue, functionDefinitionValue
+# and argumentReference; anything else is kept verbatim.
+
+# Per-pixel operations whose output footprint is that of the named image argument
+FOOTPRINT_PRESERVING = {'Image.rename': 'input', 'Image.select': 'input', 'Image.selfMask': 'image', 'Image.updateMask': 'image',
+                        'Image.toByte': 'value', 'Image.toInt': 'value', 'Image.toFloat': 'value', 'Image.toDouble': 'value'}
+# Node kinds never emitted as top-level values
+INLINED = {'const', 'argref', 'raw'}
+
+class _Graph:
+    def __init__(self, values, rewrite=True):
+        self.values = values
+        self.rewrite = rewrite
+        self.nodes = []      # id -> node tuple
+        self.ids = {}        # node tuple -> id (hash-consing table)
+        self.refs = {}       # serialized reference -> id
+        self.clips_removed = 0
+
+    def _intern(self, node):
+        if node not in self.ids:
+            self.ids[node] = len(self.nodes)
+            self.nodes.append(node)
+        return self.ids[node]
+
+    def add(self, value):
+        if 'valueReference' in value:
+            ref = value['valueReference']
+            if ref not in self.refs: self.refs[ref] = self.add(self.values[ref])
+            return self.refs[ref]
+        if 'constantValue' in value:
+            return self._intern(('const', json.dumps(value['constantValue'], sort_keys=True)))
+        if 'arrayValue' in value:
+            return self._intern(('array', tuple(self.add(v) for v in value['arrayValue'].get('values', []))))
+        if 'dictionaryValue' in value:
+            items = value['dictionaryValue'].get('values', {})
+            return self._intern(('dict', tuple(sorted((k, self.add(v)) for k, v in items.items()))))
+        if 'functionDefinitionValue' in value:
+            fn = value['functionDefinitionValue']
+            return self._intern(('fndef', tuple(fn.get('argumentNames', [])), self.add({'valueReference': fn['body']})))
+        if 'argumentReference' in value:
+            return self._intern(('argref', value['argumentReference']))
+        if 'functionInvocationValue' in value:
+            call = value['functionInvocationValue']
+            args = tuple(sorted((k, self.add(v)) for k, v in call.get('arguments', {}).items()))
+            if 'functionName' in call:
+                name = call['functionName']
+                if self.rewrite and name == 'Image.clip':
+                    a = dict(args)
+                    if 'input' in a and 'geometry' in a and self.clipped_to(a['input'], a['geometry']):
+                        self.clips_removed += 1
+                        return a['input']
+                return self._intern(('call', name, args))
+            return self._intern(('callref', self.add({'valueReference': call['functionReference']}), args))
+        return self._intern(('raw', json.dumps(value, sort_keys=True)))
+
+    def clipped_to(self, nid, geometry):
+        """True if node nid is (a footprint-preserving chain over) a clip to the same geometry node."""
+        node = self.nodes[nid]
+        while node[0] == 'call':
+            args = dict(node[2])
+            if node[1] == 'Image.clip' and args.get('geometry') == geometry: return True
+            arg = FOOTPRINT_PRESERVING.get(node[1])
+            if arg not in args: return False
+            node = self.nodes[args[arg]]
+        return False
+
+    def children(self, nid):
+        node = self.nodes[nid]
+        if node[0] == 'array': return list(node[1])
+        if node[0] in ('dict', 'call'): return [i for _, i in node[-1]]
+        if node[0] == 'fndef': return [node[2]]
+        if node[0] == 'callref': return [node[1]] + [i for _, i in node[2]]
+        return []
+
+    def emit(self, root):
+        """Compound Cloud API expression for root, laid out as ee.serializer does.
+
+        Nodes used more than once, function bodies and referenced functions are top-level values;
+        everything else, including every constant and argument reference, is inlined where it is used.
+        """
+        uses, top, stack = {root: 1}, {root}, [root]
+        while stack:
+            nid = stack.pop()
+            node = self.nodes[nid]
+            if node[0] == 'fndef': top.add(node[2])
+            if node[0] == 'callref': top.add(node[1])
+            for child in self.children(nid):
+                uses[child] = uses.get(child, 0) + 1
+                if uses[child] == 1: stack.append(child)
+        top |= {nid for nid, n in uses.items() if n > 1 and self.nodes[nid][0] not in INLINED}
+
+        def value(nid, inline=True):
+            if inline and nid in top: return {'valueReference': str(nid)}
+            node = self.nodes[nid]
+            kind = node[0]
+            if kind == 'const': return {'constantValue': json.loads(node[1])}
+            if kind == 'argref': return {'argumentReference': node[1]}
+            if kind == 'array': return {'arrayValue': {'values': [value(i) for i in node[1]]}}
+            if kind == 'dict': return {'dictionaryValue': {'values': {k: value(i) for k, i in node[1]}}}
+            if kind == 'fndef': return {'functionDefinitionValue': {'argumentNames': list(node[1]), 'body': str(node[2])}}
+            if kind == 'call': return {'functionInvocationValue': {'functionName': node[1], 'arguments': {k: value(i) for k, i in node[2]}}}
+            if kind == 'callref': return {'functionInvocationValue': {'functionReference': str(node[1]), 'arguments': {k: value(i) for k, i in node[2]}}}
+            return json.loads(node[1])
+        return {'result': str(root), 'values': {str(nid): value(nid, inline=False) for nid in sorted(top)}}, len(uses)
+
+def tree_size(expr):
+    """Nodes in the fully expanded expression (every shared reference counted at each use)."""
+    values, memo = expr['values'], {}
+
+    def size(value):
+        if 'valueReference' in value:
+            ref = value['valueReference']
+            if ref not in memo: memo[ref] = size(values[ref])
+            return memo[ref]
+        children = []
+        if 'arrayValue' in value: children = value['arrayValue'].get('values', [])
+        elif 'dictionaryValue' in value: children = list(value['dictionaryValue'].get('values', {}).values())
+        elif 'functionDefinitionValue' in value: children = [{'valueReference': value['functionDefinitionValue']['body']}]
+        elif 'functionInvocationValue' in value:
+            call = value['functionInvocationValue']
+            children = list(call.get('arguments', {}).values())
+            if 'functionReference' in call: children.append({'valueReference': call['functionReference']})
+        return 1 + sum(size(c) for c in children)
+    return size({'valueReference': expr['result']})
+
+def optimize_expression(expr):
+    """(optimized expression, stats) for a compound Cloud API expression."""
+    graph = _Graph(expr['values'])
+    out, nodes = graph.emit(graph.add({'valueReference': expr['result']}))
+    # Distinct nodes of the graph as submitted, for comparison with the rewritten one
+    plain = _Graph(expr['values'], rewrite=False)
+    plain.add({'valueReference': expr['result']})
+    stats = {'tree_nodes': tree_size(expr), 'optimized_tree_nodes': tree_size(out), 'distinct_nodes': len(plain.nodes),
+             'optimized_nodes': nodes, 'values': len(expr['values']), 'optimized_values': len(out['values']),
+             'clips_removed': graph.clips_removed}
+    return out, stats
+
+def optimize(obj, with_stats=False):
+    """obj rebuilt from its optimized graph; obj itself when no clip could be dropped.
+
+    Objects the client cannot encode or decode (ee.EEException) are also returned as they are.
+    """
+    try:
+        out, stats = optimize_expression(ee.serializer.encode(obj, for_cloud_api=True))
+        rebuilt = obj
+        if stats['clips_removed']:
+            rebuilt = ee.deserializer.decodeCloudApi(out)
+            if not isinstance(rebuilt, type(obj)): rebuilt = type(obj)(rebuilt)
+    except ee.EEException:
+        rebuilt, stats = obj, None
+    return (rebuilt, stats) if with_stats else rebuilt
+
+def band_reduction(images, reducer, geometry, scale, **kwargs):
+    """One multi-band reduceRegion over several derived images (not yet requested)."""
+    stack = ee.Image.cat([img.rename(name) for name, img in images.items()])
+    return stack.reduceRegion(reducer, geometry, scale, **kwargs)
+
+def reduce_bands(images, reducer, geometry, scale, **kwargs):
+    """Reduces several derived images with one multi-band reduceRegion; returns {name: value}."""
+    return optimize(band_reduction(images, reducer, geometry, scale, **kwargs)).getInfo()
@@ -1,13 +1,18 @@
 import ee
 import xml.etree.ElementTree as ET
 import re
+import threading
 import requests
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import matplotlib.colors as mcolors
 import numpy as np
 from io import BytesIO
+from collections import OrderedDict
 from PIL import Image
+import utils.geometry as geometry
+import utils.graph_opt as graph_opt
+import utils.pruning as pruning
 
 def parse_kml(content):
     try:
@@ -26,17 +31,48 @@ def process_coords(text):
     coords = [[float(x.split(',')[0]), float(x.split(',')[1])] for x in raw if len(x.split(',')) >= 2]
     return ee.Geometry.Polygon([coords]) if len(coords) > 2 else None
 
-def geojson_to_ee(geo_json):
-    """Converts a GeoJSON geometry dictionary to an Earth Engine Geometry."""
+# Client-side GeoJSON per serialized ROI, least recently used first; shared by every session
+_ROI_GEOJSON = OrderedDict()
+ROI_GEOJSON_MAX = 256
+_ROI_LOCK = threading.Lock()
+
+def _remember(key, geo_json):
+    with _ROI_LOCK:
+        _ROI_GEOJSON[key] = geo_json
+        _ROI_GEOJSON.move_to_end(key)
+        while len(_ROI_GEOJSON) > ROI_GEOJSON_MAX: _ROI_GEOJSON.popitem(last=False)
+    return geo_json
+
+def geojson_to_ee(geo_json, radius=None):
+    """Converts a GeoJSON geometry (Polygon, MultiPolygon, GeometryCollection, Point or circle) to an Earth Engine Geometry.
+
+    Points are buffered (see geometry.normalize), so every ROI is areal.
+    """
     try:
+        geo_json = geometry.normalize(geo_json, radius)
+        if geo_json is None: return None
         if geo_json['type'] == 'Polygon':
-            return ee.Geometry.Polygon(geo_json['coordinates'])
-        elif geo_json['type'] == 'Point':
-            return ee.Geometry.Point(geo_json['coordinates'])
-        return None
+            roi = ee.Geometry.Polygon(geo_json['coordinates'])
+        elif geo_json['type'] == 'MultiPolygon':
+            roi = ee.Geometry.MultiPolygon(geo_json['coordinates'])
+        else:
+            return None
+        # The client-side shape is already known, so later lookups need no server call
+        _remember(roi.serialize(), geo_json)
+        return roi
     except:
         return None
 
+def roi_geojson(roi):
+    """Client-side GeoJSON of an ROI, fetched once per distinct geometry."""
+    key = roi.serialize()
+    cached = _ROI_GEOJSON.get(key)
+    return _remember(key, cached if cached is not None else roi.getInfo())
+
+def roi_fingerprint(roi):
+    """Canonical short hash of an ROI, identical for the same area however it was drawn or loaded."""
+    return geometry.fingerprint(roi_geojson(roi))
+
 def detect_state_from_geometry(geometry):
     """
     Detects which Indian State the geometry center falls into using FAO GAUL.
@@ -50,11 +86,18 @@ def detect_state_from_geometry(geometry):
     except:
         return None
 
+def background_image(roi_geom, roi_json):
+    """True-colour Sentinel-2 median of the ROI for map backdrops."""
+    # Scenes mostly clear over the ROI itself, not just at tile level
+    s2_col = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED").filterBounds(roi_geom).filterDate('2023-01-01', '2023-12-31')
+    s2_col = pruning.prune(s2_col, roi_geom, roi_json, "COPERNICUS/S2_SR_HARMONIZED", min_coverage=0.5, max_cloud=0.2, cloud=pruning.s2_cloud)
+    return s2_col.median().visualize(min=0, max=3000, bands=['B4', 'B3', 'B2'])
+
 def generate_static_map_display(image, roi, vis_params, title, cmap_colors=None, is_categorical=False, class_names=None):
     try:
         if isinstance(roi, ee.Geometry):
             try:
-                roi_json = roi.getInfo()
+                roi_json = roi_geojson(roi)
                 roi_bounds = roi.bounds().getInfo()['coordinates'][0]
             except: return None
         else:
@@ -76,17 +119,15 @@ def generate_static_map_display(image, roi, vis_params, title, cmap_colors=None,
         if fig_height > 20: fig_height = 20
         if fig_height < 4: fig_height = 4
 
-        s2_background = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED")\
-            .filterBounds(roi).filterDate('2023-01-01', '2023-12-31')\
-            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20))\
-            .median().visualize(min=0, max=3000, bands=['B4', 'B3', 'B2'])
+        roi_geom = roi if isinstance(roi, ee.Geometry) else ee.Geometry(roi)
+        s2_background = background_image(roi_geom, roi_json)
 
         if 'palette' in vis_params or 'min' in vis_params:
             analysis_vis = image.visualize(**vis_params)
         else:
             analysis_vis = image
 
-        final_image = s2_background.blend(analysis_vis)
+        final_image = graph_opt.optimize(s2_background.blend(analysis_vis))
 
         thumb_url = final_image.getThumbURL({
             'region': roi_json, 'dimensions': 1000, 'format': 'png', 'crs': 'EPSG:4326'
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+# IMD daily rainfall categories (mm)
+RAINY_DAY_MM = 2.5
+HEAVY_MM = 64.5
+VERY_HEAVY_MM = 115.6
+
+def resample(df, freq):
+    """Aggregates a daily ('date', 'value') series to 'Daily', 'Pentad' or 'Monthly' totals."""
+    s = df.set_index('date')['value'].astype(np.float32)
+    if freq == "Monthly":
+        out = s.resample('MS').sum(min_count=1)
+    elif freq == "Pentad":
+        # CHIRPS-style pentads: days 1-5, 6-10, ..., 26-end of month
+        pentad = np.minimum((s.index.day - 1) // 5, 5)
+        starts = pd.to_datetime({'year': s.index.year, 'month': s.index.month, 'day': pentad * 5 + 1})
+        out = s.groupby(starts.values).sum(min_count=1)
+    else:
+        out = s
+    return out.rename_axis('date').reset_index(name='value')
+
+def exceedance_stats(df):
+    """Summary statistics of a daily rainfall series (mm); depths are NaN when no day has data."""
+    s = pd.Series(df['value'].to_numpy(dtype=np.float32), index=pd.to_datetime(df['date'])).sort_index()
+    s = s[~s.index.duplicated(keep='last')]
+    v = s.dropna().to_numpy()
+    if v.size == 0:
+        return {'total_mm': 0.0, 'rainy_days': 0, 'heavy_days': 0, 'very_heavy_days': 0, 'max_1day_mm': np.nan,
+                'max_5day_mm': np.nan, 'p50_mm': np.nan, 'p90_mm': np.nan, 'p95_mm': np.nan, 'p99_mm': np.nan}
+    # 5-day totals over consecutive calendar days only: windows with a missing day are NaN
+    daily = s.reindex(pd.date_range(s.index.min(), s.index.max(), freq='D'))
+    five_day = daily.rolling(5, min_periods=5).sum()
+    return {
+        'total_mm': float(v.sum()),
+        'rainy_days': int((v >= RAINY_DAY_MM).sum()),
+        'heavy_days': int((v >= HEAVY_MM).sum()),
+        'very_heavy_days': int((v >= VERY_HEAVY_MM).sum()),
+        'max_1day_mm': float(v.max()),
+        'max_5day_mm': float(five_day.max()) if five_day.notna().any() else np.nan,
+        'p50_mm': float(np.percentile(v, 50)),
+        'p90_mm': float(np.percentile(v, 90)),
+        'p95_mm': float(np.percentile(v, 95)),
+        'p99_mm': float(np.percentile(v, 99)),
+    }
+
+def exceedance_curve(df):
+    """Empirical exceedance probability (Weibull plotting position) of daily depths on rainy days."""
+    v = np.sort(df['value'].dropna().to_numpy(dtype=np.float32))[::-1]
+    v = v[v >= RAINY_DAY_MM]
+    prob = np.arange(1, v.size + 1) / (v.size + 1) * 100
+    return pd.DataFrame({'Exceedance (%)': prob, 'Depth (mm)': v})
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from utils.cache import cache_path
+from utils.ts_store import INGEST_LAG_DAYS
+
+# Background jobs that outlive Streamlit reruns and page reloads.
+# Workers run in a process-wide pool (not the script thread), so a widget change that restarts the
+# script never cancels server work; status and pickled results live in <cache>/jobs.sqlite.
+# Analyses (mode, params, ROI) are stored too so a reloaded page can reattach via ?job=<id>.
+DB = cache_path("jobs.sqlite")
+MAX_WORKERS = 4
+# Results over date windows that reach into the ingest lag are recomputed after this many seconds
+RECENT_TTL_S = 6 * 3600
+# Finished rows are dropped after MAX_AGE_DAYS, oldest first beyond MAX_BYTES of results
+MAX_AGE_DAYS = 30
+MAX_BYTES = int(os.environ.get("GEOSAROVAR_JOBS_MB", 1024)) << 20
+PRUNE_EVERY_S = 3600
+
+_POOL = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="job")
+_RUNNING = {}
+_LOCK = threading.Lock()
+_READY = False
+_PRUNED = {'at': 0.0}
+
+def _execute(sql, args=()):
+    global _READY
+    con = sqlite3.connect(DB, timeout=30)
+    try:
+        with con:
+            if not _READY:
+                con.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, result BLOB, error TEXT, created REAL, updated REAL)")
+                con.execute("CREATE TABLE IF NOT EXISTS analyses (id TEXT PRIMARY KEY, mode TEXT, params TEXT, roi TEXT, created REAL)")
+                _READY = True
+            return con.execute(sql, args).fetchall()
+    finally:
+        con.close()
+
+def job_id(*parts):
+    """Deterministic id: the same analysis inputs always map to the same job."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def _run(jid, fn):
+    _execute("UPDATE jobs SET status='running', updated=? WHERE id=?", (time.time(), jid))
+    try:
+        result = pickle.dumps(fn())
+        _execute("UPDATE jobs SET status='done', result=?, error=NULL, updated=? WHERE id=?", (result, time.time(), jid))
+    except Exception as e:
+        _execute("UPDATE jobs SET status='failed', error=?, updated=? WHERE id=?", (str(e), time.time(), jid))
+    finally:
+        with _LOCK:
+            _RUNNING.pop(jid, None)
+
+def expiry(end, lag_days=INGEST_LAG_DAYS):
+    """ttl for results over a window ending at `end` (YYYY-MM-DD, exclusive).
+
+    Windows reaching into the last lag_days can still gain scenes or days, so their results expire
+    after RECENT_TTL_S; older windows are final (None).
+    """
+    return RECENT_TTL_S if date.fromisoformat(str(end)[:10]) > date.today() - timedelta(days=lag_days) else None
+
+def prune(now=None):
+    """Removes finished jobs and saved analyses older than MAX_AGE_DAYS, then the oldest results beyond MAX_BYTES."""
+    now = now or time.time()
+    cutoff = now - MAX_AGE_DAYS * 86400
+    _execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (cutoff,))
+    _execute("DELETE FROM analyses WHERE created < ?", (cutoff,))
+    rows = _execute("SELECT id, IFNULL(LENGTH(result), 0) FROM jobs WHERE status IN ('done', 'failed') ORDER BY updated")
+    total = sum(size for _, size in rows)
+    for jid, size in rows:
+        if total <= MAX_BYTES: break
+        _execute("DELETE FROM jobs WHERE id=?", (jid,))
+        total -= size
+    _PRUNED['at'] = now
+
+def submit(key, fn, retry=False, ttl=None):
+    """Queues fn under the job id of `key` unless it is already finished or running; returns the id.
+
+    Jobs orphaned by a server restart are queued again; failed jobs only when retry is set, and
+    finished ones once they are older than ttl seconds (None: never).
+    """
+    jid = job_id(*key)
+    with _LOCK:
+        if time.time() - _PRUNED['at'] > PRUNE_EVERY_S: prune()
+        if jid in _RUNNING: return jid
+        row = _execute("SELECT status, updated FROM jobs WHERE id=?", (jid,))
+        if row:
+            state, updated = row[0]
+            if state == 'done' and (ttl is None or time.time() - updated < ttl): return jid
+            if state == 'failed' and not retry: return jid
+        now = time.time()
+        _execute("INSERT OR REPLACE INTO jobs (id, status, created, updated) VALUES (?, 'queued', ?, ?)", (jid, now, now))
+        _RUNNING[jid] = _POOL.submit(_run, jid, fn)
+    return jid
+
+def status(jid):
+    """'queued', 'running', 'done', 'failed', or None for unknown ids."""
+    row = _execute("SELECT status FROM jobs WHERE id=?", (jid,))
+    return row[0][0] if row else None
+
+def error(jid):
+    row = _execute("SELECT error FROM jobs WHERE id=?", (jid,))
+    return row[0][0] if row else None
+
+def result(jid):
+    row = _execute("SELECT result FROM jobs WHERE id=? AND status='done'", (jid,))
+    return pickle.loads(row[0][0]) if row else None
+
+def save_analysis(mode, params, roi_geojson):
+    aid = job_id(mode, params, roi_geojson)
+    _execute("INSERT OR IGNORE INTO analyses VALUES (?, ?, ?, ?, ?)",
+             (aid, mode, json.dumps(params, default=str), json.dumps(roi_geojson), time.time()))
+    return aid
+
+def load_analysis(aid):
+    row = _execute("SELECT mode, params, roi FROM analyses WHERE id=?", (aid,))
+    if not row: return None
+    mode, params, roi = row[0]
+    return {'mode': mode, 'params': json.loads(params), 'roi': json.loads(roi)}
@@ -3,6 +3,35 @@ try:
 except Exception:
     import geemap
     import streamlit as st
+import ee
+import folium
+import utils.graph_opt as graph_opt
+
+# Analyses run as background jobs (utils.progressive.analysis), so their results carry only plain
+# data: tile layers as {'name', 'url', 'shown'} and EE images serialized to JSON.
+
+def tile_layer(image, vis, name, shown=True):
+    """Map layer of an EE image as a plain tile URL (one getMapId request on the optimized graph)."""
+    return {'name': name, 'url': tile_graph(image, vis).getMapId()['tile_fetcher'].url_format, 'shown': shown}
+
+def tile_graph(image, vis):
+    """The image a map tile request renders: visualised with vis, passed through graph_opt."""
+    return graph_opt.optimize(image.visualize(**vis) if vis else image)
+
+def tile(layer):
+    return folium.TileLayer(tiles=layer['url'], attr='Google Earth Engine', name=layer['name'], overlay=True, control=True, show=layer['shown'])
+
+def add_tiles(m, layers):
+    """Adds tile layers from an analysis result to the map, without any EE request."""
+    for layer in layers: tile(layer).add_to(m)
+
+def image_json(image):
+    return image.serialize()
+
+def image_from_json(text):
+    """EE image back from image_json, e.g. the export handle of a finished analysis."""
+    return ee.Image(ee.deserializer.fromCloudApiJSON(text)) if text else None
+
 # Helper for Safe Map Loading (ROBUST FOLIUM VERSION)
 def get_safe_map(roi_method, map_style, is_calculated, height=500):
     # 1. Initialize Map (Folium Backend)
@@ -0,0 +1,76 @@
+import math
+import streamlit as st
+import utils.jobs as jobs
+
+# Every module analysis runs as a background job (utils.jobs) and the script thread only draws its
+# result. Preview-then-refine: modules show coarse metrics at an automatic scale first while the
+# full-resolution statistics run as a second job; a polling fragment swaps them in.
+TARGET_PIXELS = 2e5
+NICE_SCALES = [10, 20, 30, 60, 100, 250, 500, 1000, 2000, 5000]
+POLL_SECONDS = 2
+# Analysis results hold EE tile URLs, whose map ids are short-lived
+ANALYSIS_TTL_S = 4 * 3600
+
+def auto_scale(roi, native, target_pixels=TARGET_PIXELS):
+    """Coarsest-needed scale (m) so the ROI holds about target_pixels, never finer than native."""
+    area = roi.area(100).getInfo()
+    scale = math.sqrt(area / target_pixels)
+    return next((s for s in NICE_SCALES if s >= max(scale, native)), NICE_SCALES[-1])
+
+def analysis(key, fn, ttl=None, label="Running analysis..."):
+    """Result of the module analysis fn() run as a background job; None while pending or failed.
+
+    Reruns and reloads reattach to the same job. While it runs, a polling fragment shows the status
+    and triggers one full rerun once the job finishes.
+    """
+    ttl = ANALYSIS_TTL_S if ttl is None else min(ttl, ANALYSIS_TTL_S)
+    jid = jobs.submit(key, fn, ttl=ttl)
+    state = jobs.status(jid)
+    if state == 'done':
+        return jobs.result(jid)
+    if state == 'failed':
+        st.error(f"Analysis failed: {jobs.error(jid)}")
+        if st.button("Retry", key=f"retry_{jid}"):
+            jobs.submit(key, fn, retry=True, ttl=ttl)
+            st.rerun()
+        return None
+
+    @st.fragment(run_every=POLL_SECONDS)
+    def wait():
+        if jobs.status(jid) in ('queued', 'running'):
+            st.info(label)
+            return
+        st.rerun()
+
+    wait()
+    return None
+
+def refine(key, fn, show, preview, ttl=None):
+    """Renders preview() until the job for fn() finishes, then show(result).
+
+    The fragment polls only while the job is pending; once done, one full rerun removes the timer.
+    Finished results persist in the job store, so reruns and reloads reattach instead of recomputing
+    (until ttl seconds, see jobs.expiry).
+    """
+    jid = jobs.submit(key, fn, ttl=ttl)
+    pending = jobs.status(jid) in ('queued', 'running')
+
+    @st.fragment(run_every=POLL_SECONDS if pending else None)
+    def panel():
+        state = jobs.status(jid)
+        if state in ('queued', 'running'):
+            preview()
+            st.caption("Preliminary (coarse scale). Refining at full resolution...")
+            return
+        if pending:
+            st.rerun()
+        if state == 'failed':
+            preview()
+            st.warning(f"Refinement failed: {jobs.error(jid)}")
+            if st.button("Retry", key=f"retry_{jid}"):
+                jobs.submit(key, fn, retry=True, ttl=ttl)
+                st.rerun()
+        else:
+            show(jobs.result(jid))
+
+    panel()
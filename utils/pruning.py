@@ -0,0 +1,89 @@
+import os
+import math
+import warnings
+import ee
+import pandas as pd
+import utils.geometry as geometry
+from utils.cache import cache_path
+from utils.tile_store import slug
+
+# Scene pruning before compositing: per-scene ROI coverage and ROI-local cloud fraction from one
+# batched reduction, cached per ROI at <cache>/pruning/<fp>/<collection>.parquet so later runs
+# only reduce scenes they have not seen.
+ROOT = "pruning"
+MIN_COVERAGE = 0.2
+# Pixels per scene for the metadata reduction; coverage and cloud fractions need no more
+STATS_PIXELS = 1e4
+MIN_SCALE = 60
+
+def s2_cloud(img):
+    """Sentinel-2 SR scene classification: cloud shadow, medium/high cloud and cirrus."""
+    return img.select('SCL').remap([3, 8, 9, 10], [1, 1, 1, 1], 0)
+
+def _file(fingerprint, name):
+    return cache_path(ROOT, fingerprint, f"{slug(name)}.parquet")
+
+def _load(fingerprint, name):
+    path = _file(fingerprint, name)
+    if os.path.exists(path): return pd.read_parquet(path)
+    return pd.DataFrame({'id': pd.Series(dtype=str), 'date': pd.Series(dtype=str),
+                         'coverage': pd.Series(dtype=float), 'cloud': pd.Series(dtype=float)})
+
+def scene_stats(col, roi, scale, cloud=None):
+    """Coverage and cloud fraction of every scene over the ROI, in one request."""
+    def stats(img):
+        valid = img.select(0).mask().gt(0)
+        bands = [valid.unmask(0).rename('coverage')]
+        bands.append((cloud(img).And(valid) if cloud else valid.multiply(0)).unmask(0).rename('cloudy'))
+        vals = ee.Image.cat(bands).reduceRegion(ee.Reducer.mean(), roi, scale, bestEffort=True)
+        date = ee.Date(img.get('system:time_start')).format('YYYY-MM-dd')
+        return ee.Feature(None, vals.set('id', img.get('system:index')).set('date', date))
+
+    cols = ['id', 'date', 'coverage', 'cloudy']
+    rows = col.map(stats).reduceColumns(ee.Reducer.toList(len(cols)), cols).get('list').getInfo()
+    df = pd.DataFrame(rows, columns=cols)
+    # Cloud fraction of the covered part of the ROI
+    df['cloud'] = (df['cloudy'] / df['coverage'].where(df['coverage'] > 0)).fillna(1.0).clip(0, 1)
+    return df.drop(columns='cloudy')
+
+def select_scenes(meta, min_coverage=MIN_COVERAGE, max_cloud=None, dedupe=True):
+    """Ids of scenes passing the thresholds; same-date scenes are dropped once the ROI is covered."""
+    ok = meta[meta['coverage'] >= min_coverage]
+    if max_cloud is not None:
+        ok = ok[ok['cloud'] <= max_cloud]
+    if not dedupe: return ok['id'].tolist()
+    ok = ok.assign(clear=ok['coverage'] * (1 - ok['cloud'])).sort_values(['date', 'clear'], ascending=[True, False])
+    keep = []
+    for _, day in ok.groupby('date'):
+        covered = 0.0
+        for pid, cov in zip(day['id'], day['coverage']):
+            # Footprints are unknown here, so later scenes are kept until the coverage could add up to 1
+            if covered >= 0.999: break
+            keep.append(pid)
+            covered += cov
+    return keep
+
+def prune(col, roi, geo_json, name, min_coverage=MIN_COVERAGE, max_cloud=None, cloud=None, dedupe=True):
+    """Filters a collection to the scenes worth compositing over the ROI.
+
+    Costs one metadata request, so it is meant for composites, not per-scene series. If no scene
+    passes, the unpruned collection is returned with a warning rather than an empty one.
+    """
+    fingerprint = geometry.fingerprint(geo_json)
+    ids = col.aggregate_array('system:index').getInfo()
+    if not ids: return col
+    meta = _load(fingerprint, name)
+    missing = sorted(set(ids) - set(meta['id']))
+    if missing:
+        area = geometry.summary(geo_json)['area_km2'] * 1e6
+        scale = max(MIN_SCALE, math.sqrt(area / STATS_PIXELS))
+        fresh = scene_stats(col.filter(ee.Filter.inList('system:index', missing)), roi, scale, cloud)
+        meta = pd.concat([meta, fresh], ignore_index=True).drop_duplicates('id', keep='last')
+        path = _file(fingerprint, name)
+        meta.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+    keep = select_scenes(meta[meta['id'].isin(ids)], min_coverage, max_cloud, dedupe)
+    if not keep:
+        warnings.warn(f"No {name} scene passed pruning over the ROI; using all {len(ids)} scene(s)")
+        return col
+    return col.filter(ee.Filter.inList('system:index', keep))
@@ -0,0 +1,212 @@
+import ee
+import math
+import string
+import numpy as np
+import matplotlib.colors as mcolors
+from concurrent.futures import ThreadPoolExecutor
+import utils.geometry as geometry
+
+# Global EPSG:4326 tile grid (origin at -180, 90). Level 0 is 1 arc-second (~30 m, SRTM native).
+TILE_SIZE = 256
+BASE_RES = 1 / 3600
+NODATA = -9999.0
+
+def level_res(z):
+    return BASE_RES * (2 ** z)
+
+def tile_range(bounds, z):
+    """Returns the inclusive (x0, y0, x1, y1) tile indices covering the bounds at level z."""
+    span = level_res(z) * TILE_SIZE
+    min_lon, min_lat, max_lon, max_lat = bounds
+    x0 = int(math.floor((min_lon + 180) / span))
+    x1 = int(math.floor((max_lon + 180) / span))
+    y0 = int(math.floor((90 - max_lat) / span))
+    y1 = int(math.floor((90 - min_lat) / span))
+    return x0, y0, x1, y1
+
+def tile_bounds(z, x, y):
+    span = level_res(z) * TILE_SIZE
+    min_lon = -180 + x * span
+    max_lat = 90 - y * span
+    return (min_lon, max_lat - span, min_lon + span, max_lat)
+
+def snap_bounds(bounds, res):
+    """Expands bounds outwards to whole pixels of the global grid at `res` degrees."""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    c0 = math.floor((min_lon + 180) / res)
+    c1 = math.ceil((max_lon + 180) / res)
+    r0 = math.floor((90 - max_lat) / res)
+    r1 = math.ceil((90 - min_lat) / res)
+    return (-180 + c0 * res, 90 - r1 * res, -180 + c1 * res, 90 - r0 * res), (r1 - r0, c1 - c0)
+
+def geojson_bounds(geo_json):
+    """Returns (min_lon, min_lat, max_lon, max_lat) of any GeoJSON geometry."""
+    coords = []
+    def walk(c):
+        if isinstance(c[0], (int, float)): coords.append(c[:2])
+        else:
+            for part in c: walk(part)
+    if geo_json['type'] == 'GeometryCollection':
+        for g in geo_json['geometries']: walk(g['coordinates'])
+    else:
+        walk(geo_json['coordinates'])
+    arr = np.asarray(coords, dtype=np.float64)
+    return (arr[:, 0].min(), arr[:, 1].min(), arr[:, 0].max(), arr[:, 1].max())
+
+def polygon_mask(geo_json, bounds, shape):
+    """Rasterises a (Multi)Polygon onto a lon/lat grid: even-odd rule on pixel centres, scanline fill.
+
+    Each edge only visits the rows it spans, so the cost is O(edges + crossings + pixels).
+    Geometries without polygons (e.g. a bare Point) give an empty mask.
+    """
+    h, w = shape
+    min_lon, min_lat, max_lon, max_lat = bounds
+    rx, ry = (max_lon - min_lon) / w, (max_lat - min_lat) / h
+    mask = np.zeros(shape, dtype=bool)
+    for poly in geometry.polygons(geo_json):
+        rings = [np.asarray(ring, dtype=np.float64)[:, :2] for ring in poly]
+        x1, y1, x2, y2 = np.vstack([np.hstack([r[:-1], r[1:]]) for r in rings]).T
+        keep = y1 != y2
+        x1, y1, x2, y2 = x1[keep], y1[keep], x2[keep], y2[keep]
+        # Rows whose centre max_lat - (r + 0.5) * ry lies in [min(y1, y2), max(y1, y2))
+        lo, hi = np.minimum(y1, y2), np.maximum(y1, y2)
+        r0 = np.clip(np.floor((max_lat - hi) / ry - 0.5) + 1, 0, h).astype(np.int64)
+        r1 = np.clip(np.floor((max_lat - lo) / ry - 0.5), -1, h - 1).astype(np.int64)
+        n = np.maximum(r1 - r0 + 1, 0)
+        if not n.sum(): continue
+        edge = np.repeat(np.arange(len(n)), n)
+        rows = r0[edge] + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        py = max_lat - (rows + 0.5) * ry
+        x_int = x1[edge] + (py - y1[edge]) * (x2[edge] - x1[edge]) / (y2[edge] - y1[edge])
+        # Crossing at x_int toggles every pixel centre left of it: count crossings right of each pixel
+        cols = np.clip(np.ceil((x_int - min_lon) / rx - 0.5), 0, w).astype(np.int64)
+        hits = np.bincount(rows * (w + 1) + cols, minlength=h * (w + 1)).reshape(h, w + 1)
+        right = np.cumsum(hits[:, ::-1], axis=1)[:, ::-1]
+        mask |= (right[:, 1:] & 1).astype(bool)
+    return mask
+
+def _css_color(c):
+    # EE palettes allow bare hex ('ff0000'); matplotlib needs '#ff0000'
+    return '#' + c if len(c) == 6 and all(ch in string.hexdigits for ch in c) else c
+
+def to_rgba(arr, vis):
+    """Colours an array with an EE-style vis dict ({'min', 'max', 'palette'}); NaN is transparent."""
+    palette = vis.get('palette', ['black', 'white'])
+    if isinstance(palette, str): palette = [palette]
+    palette = [_css_color(c) for c in palette]
+    if len(palette) == 1: palette = palette * 2
+    cmap = mcolors.LinearSegmentedColormap.from_list("vis", palette)
+    norm = mcolors.Normalize(vmin=vis.get('min', 0), vmax=vis.get('max', 1), clip=True)
+    rgba = cmap(norm(np.nan_to_num(arr, nan=vis.get('min', 0))))
+    rgba[..., 3] = np.where(np.isnan(arr), 0, 1)
+    return (rgba * 255).astype(np.uint8)
+
+def compute_pixels(image, bounds, shape):
+    """Downloads an EE image window as a dict of float32 arrays (one per band), masked pixels as NaN."""
+    h, w = shape
+    min_lon, min_lat, max_lon, max_lat = bounds
+    request = {
+        'expression': image.toFloat().unmask(NODATA, False),
+        'fileFormat': 'NUMPY_NDARRAY',
+        'grid': {
+            'dimensions': {'width': w, 'height': h},
+            'affineTransform': {
+                'scaleX': (max_lon - min_lon) / w, 'shearX': 0, 'translateX': min_lon,
+                'shearY': 0, 'scaleY': -(max_lat - min_lat) / h, 'translateY': max_lat
+            },
+            'crsCode': 'EPSG:4326',
+        },
+    }
+    data = ee.data.computePixels(request)
+    out = {}
+    for band in data.dtype.names:
+        arr = np.asarray(data[band], dtype=np.float32)
+        arr[arr == NODATA] = np.nan
+        out[band] = arr
+    return out
+
+def fetch_array(image, bounds, res, block=512, max_workers=8):
+    """Downloads an EE image over bounds at `res` degrees in concurrent blocks.
+
+    Returns (dict of band arrays, snapped bounds).
+    """
+    grid_bounds, (h, w) = snap_bounds(bounds, res)
+    min_lon, _, _, max_lat = grid_bounds
+    jobs = []
+    for r in range(0, h, block):
+        for c in range(0, w, block):
+            bh, bw = min(block, h - r), min(block, w - c)
+            b = (min_lon + c * res, max_lat - (r + bh) * res, min_lon + (c + bw) * res, max_lat - r * res)
+            jobs.append((r, c, b, (bh, bw)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        parts = list(pool.map(lambda j: compute_pixels(image, j[2], j[3]), jobs))
+
+    out = {}
+    for (r, c, _, (bh, bw)), part in zip(jobs, parts):
+        for band, arr in part.items():
+            if band not in out: out[band] = np.full((h, w), np.nan, dtype=np.float32)
+            out[band][r:r + bh, c:c + bw] = arr
+    return out, grid_bounds
+
+def window_slices(bounds, shape, sub_bounds):
+    """Row/column slices of the pixels of a grid covering sub_bounds, and the bounds they span."""
+    h, w = shape
+    min_lon, min_lat, max_lon, max_lat = bounds
+    rx, ry = (max_lon - min_lon) / w, (max_lat - min_lat) / h
+    c0 = max(0, int(np.floor((sub_bounds[0] - min_lon) / rx + 1e-6)))
+    c1 = min(w, int(np.ceil((sub_bounds[2] - min_lon) / rx - 1e-6)))
+    r0 = max(0, int(np.floor((max_lat - sub_bounds[3]) / ry + 1e-6)))
+    r1 = min(h, int(np.ceil((max_lat - sub_bounds[1]) / ry - 1e-6)))
+    window = (min_lon + c0 * rx, max_lat - r1 * ry, min_lon + c1 * rx, max_lat - r0 * ry)
+    return (slice(r0, r1), slice(c0, c1)), window
+
+def pixel_area_rows(bounds, shape):
+    """Geodesic (spherical) area in m² of one pixel in each row of a lon/lat grid."""
+    h, w = shape
+    min_lon, min_lat, max_lon, max_lat = bounds
+    radius = 6371008.8
+    lat_edges = np.radians(np.linspace(max_lat, min_lat, h + 1))
+    dlon = np.radians((max_lon - min_lon) / w)
+    return radius ** 2 * dlon * np.abs(np.sin(lat_edges[:-1]) - np.sin(lat_edges[1:]))
+
+def label_components(mask, eight_connected=True):
+    """Labels connected True regions with a vectorised union-find.
+
+    Returns (labels, count) where labels is int32 with 0 as background.
+    """
+    h, w = mask.shape
+    idx = np.flatnonzero(mask.ravel())
+    if idx.size == 0: return np.zeros(mask.shape, dtype=np.int32), 0
+    node = np.full(h * w, -1, dtype=np.int64)
+    node[idx] = np.arange(idx.size)
+    grid = node.reshape(h, w)
+
+    # Edges to the right/down neighbours (plus both down diagonals for 8-connectivity)
+    offsets = [(0, 1), (1, 0)] + ([(1, 1), (1, -1)] if eight_connected else [])
+    us, vs = [], []
+    for dy, dx in offsets:
+        c0, c1 = max(0, -dx), w - max(0, dx)
+        a = grid[:h - dy, c0:c1]
+        b = grid[dy:, c0 + dx:c1 + dx]
+        keep = (a >= 0) & (b >= 0)
+        us.append(a[keep]); vs.append(b[keep])
+    u, v = np.concatenate(us), np.concatenate(vs)
+
+    # Hook larger roots onto smaller ones, then pointer-jump until every node points at its root
+    parent = np.arange(idx.size)
+    while u.size:
+        ru, rv = parent[u], parent[v]
+        pending = ru != rv
+        u, v, ru, rv = u[pending], v[pending], ru[pending], rv[pending]
+        if not u.size: break
+        np.minimum.at(parent, np.maximum(ru, rv), np.minimum(ru, rv))
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent): break
+            parent = jumped
+
+    _, compact = np.unique(parent, return_inverse=True)
+    labels = np.zeros(h * w, dtype=np.int32)
+    labels[idx] = compact + 1
+    return labels.reshape(h, w), int(compact.max()) + 1
@@ -0,0 +1,224 @@
+import os
+import re
+import time
+import uuid
+import json
+import pickle
+import multiprocessing
+from io import BytesIO
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import requests
+import numpy as np
+import pandas as pd
+import matplotlib.image as mpimg
+import matplotlib.dates as mdates
+import matplotlib.colors as mcolors
+import matplotlib.patches as mpatches
+from matplotlib.cm import ScalarMappable
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+import utils.helpers as helpers
+import utils.geometry as geometry
+import utils.graph_opt as graph_opt
+import utils.jobs as jobs
+from utils.cache import cache_path, prune
+from utils.tile_store import slug
+
+# Multi-page PDF reports. Analyses (module.report_page) run concurrently in threads, each page is
+# drawn in a worker process and written to the PDF in order as soon as it is ready. The S2 backdrop
+# and each page's fetched content are cached per ROI at <cache>/report/<fp>/ and reused next time;
+# pages over windows still inside the ingest lag expire (jobs.expiry), and the folder is pruned by
+# age and size before each build.
+ROOT = "report"
+MAX_AGE_DAYS = 30
+MAX_BYTES = int(os.environ.get("GEOSAROVAR_REPORT_MB", 512)) << 20
+ANALYSIS_WORKERS = 8
+RENDER_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+PAGE_SIZE = (8.27, 11.69)  # A4 portrait, inches
+DPI = 150
+THUMB_PX = 1000
+ACCENT = '#00204a'
+
+def _color(c):
+    """EE palettes allow bare hex ('0000ff'); matplotlib needs the '#'."""
+    return '#' + c if re.fullmatch(r'[0-9a-fA-F]{6}', c) else c
+
+def _thumb(image, geo_json):
+    url = graph_opt.optimize(image).getThumbURL({'region': geo_json, 'dimensions': THUMB_PX, 'format': 'png', 'crs': 'EPSG:4326'})
+    response = requests.get(url, timeout=120)
+    response.raise_for_status()
+    return response.content
+
+def background_png(roi, geo_json):
+    """Sentinel-2 backdrop of the ROI as PNG bytes, fetched once per ROI."""
+    path = cache_path(ROOT, geometry.fingerprint(geo_json), "background.png")
+    if not os.path.exists(path):
+        png = _thumb(helpers.background_image(roi, geo_json), geo_json)
+        with open(path + ".tmp", 'wb') as f: f.write(png)
+        os.replace(path + ".tmp", path)
+    with open(path, 'rb') as f: return f.read()
+
+def _window_end(params):
+    """Latest date the analysis window reaches (exclusive), or None for undated analyses."""
+    dates = re.findall(r'\d{4}-\d{2}-\d{2}', json.dumps(params, default=str))
+    if 'year_end' in params: dates.append(f"{int(params['year_end']) + 1}-01-01")
+    return max(dates) if dates else None
+
+def _fresh(path, params):
+    if not os.path.exists(path): return False
+    end = _window_end(params)
+    ttl = jobs.expiry(end) if end else None
+    return ttl is None or time.time() - os.path.getmtime(path) < ttl
+
+def prune_cache(now=None):
+    """Removes report files older than MAX_AGE_DAYS, then the oldest ones beyond MAX_BYTES."""
+    prune(ROOT, MAX_AGE_DAYS, MAX_BYTES, now)
+
+def page_data(roi, geo_json, mode, module, params):
+    """(content, seconds, cached) of one analysis page: metrics, chart and the overlay PNG."""
+    t0 = time.time()
+    path = cache_path(ROOT, geometry.fingerprint(geo_json), f"{jobs.job_id(mode, params)}.pkl")
+    if _fresh(path, params):
+        with open(path, 'rb') as f: return pickle.load(f), time.time() - t0, True
+    try:
+        page = module.report_page(roi, params)
+        data = {k: page.get(k) for k in ('title', 'vis', 'label', 'legend', 'metrics', 'chart')}
+        data['overlay'] = _thumb(page['image'].visualize(**page['vis']), geo_json) if page.get('image') is not None else None
+    except Exception as e:
+        # Failures become an error page and are not cached
+        return {'title': mode, 'error': f"Analysis failed: {e}"}, time.time() - t0, False
+    with open(path + ".tmp", 'wb') as f: pickle.dump(data, f)
+    os.replace(path + ".tmp", path)
+    return data, time.time() - t0, False
+
+def _draw_map(fig, page):
+    ax = fig.add_axes([0.08, 0.44, 0.84, 0.45])
+    min_lon, min_lat, max_lon, max_lat = page['bounds']
+    extent = [min_lon, max_lon, min_lat, max_lat]
+    for png in (page.get('background'), page.get('overlay')):
+        if png: ax.imshow(mpimg.imread(BytesIO(png), format='png'), extent=extent, interpolation='nearest')
+    ax.set_xlim(min_lon, max_lon); ax.set_ylim(min_lat, max_lat)
+    ax.set_aspect(1 / np.cos(np.radians((min_lat + max_lat) / 2)))
+    ax.tick_params(labelsize=7)
+
+    vis = page.get('vis') or {}
+    if page.get('legend'):
+        patches = [mpatches.Patch(color=_color(c), label=n) for n, c in page['legend']]
+        ax.legend(handles=patches, loc='upper center', bbox_to_anchor=(0.5, -0.06), frameon=False, ncol=min(len(patches), 4), fontsize=8)
+    elif 'palette' in vis and 'min' in vis:
+        cmap = mcolors.LinearSegmentedColormap.from_list("custom", [_color(c) for c in vis['palette']])
+        norm = mcolors.Normalize(vmin=vis['min'], vmax=vis['max'])
+        cbar = fig.colorbar(ScalarMappable(norm=norm, cmap=cmap), ax=ax, orientation='horizontal', fraction=0.04, pad=0.07)
+        cbar.set_label(page.get('label') or '', fontsize=8)
+        cbar.ax.tick_params(labelsize=7)
+
+def _draw_metrics(fig, metrics, top=0.36):
+    fig.text(0.08, top, "KEY FIGURES", fontsize=9, fontweight='bold', color=ACCENT)
+    for i, (label, value) in enumerate(metrics or []):
+        y = top - 0.03 - i * 0.024
+        fig.text(0.08, y, str(label), fontsize=8, color='#444444')
+        fig.text(0.44, y, str(value), fontsize=8, fontweight='bold', ha='right', color='black')
+
+def _draw_chart(fig, chart):
+    ax = fig.add_axes([0.56, 0.12, 0.36, 0.23])
+    x, y = chart['x'], chart['y']
+    if chart['kind'] == 'bar':
+        ax.bar([str(v) for v in x], y, color=chart.get('colors') or '#005792')
+        step = int(np.ceil(len(x) / 8))
+        ax.set_xticks(range(0, len(x), step), [str(v) for v in x][::step], rotation=45, ha='right')
+    else:
+        dates = pd.to_datetime(pd.Series(x), errors='coerce')
+        if dates.notna().all():
+            x = dates
+            locator = mdates.AutoDateLocator(maxticks=6)
+            ax.xaxis.set_major_locator(locator)
+            ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        ax.plot(x, y, color='#005792', marker='.', linewidth=1)
+        ax.fill_between(x, y, alpha=0.15, color='#005792')
+    ax.set_xlabel(chart.get('xlabel') or '', fontsize=8); ax.set_ylabel(chart.get('ylabel') or '', fontsize=8)
+    ax.tick_params(labelsize=7)
+
+def render_page(page):
+    """Draws one A4 page and returns (PNG bytes, seconds); runs in a worker process."""
+    t0 = time.time()
+    fig = Figure(figsize=PAGE_SIZE, dpi=DPI, facecolor='white')
+    FigureCanvasAgg(fig)
+    fig.text(0.08, 0.95, page['title'], fontsize=17, fontweight='bold', color=ACCENT)
+    fig.text(0.08, 0.928, page.get('subtitle', ''), fontsize=8, color='#555555')
+    fig.text(0.92, 0.03, f"GeoSarovar  |  {page['number']}", fontsize=7, ha='right', color='#777777')
+
+    if page.get('contents'):
+        # Cover page: ROI summary and the list of analyses
+        _draw_metrics(fig, page['metrics'], top=0.86)
+        fig.text(0.08, 0.62, "CONTENTS", fontsize=9, fontweight='bold', color=ACCENT)
+        for i, title in enumerate(page['contents']):
+            fig.text(0.08, 0.59 - i * 0.024, f"{i + 2:>3}   {title}", fontsize=9, family='monospace')
+    elif page.get('error'):
+        fig.text(0.08, 0.86, page['error'], fontsize=9, color='#b00020', wrap=True)
+    else:
+        _draw_map(fig, page)
+        _draw_metrics(fig, page.get('metrics'))
+        if page.get('chart'): _draw_chart(fig, page['chart'])
+
+    buf = BytesIO()
+    fig.savefig(buf, format='png', dpi=DPI, facecolor='white')
+    return buf.getvalue(), time.time() - t0
+
+def _write_page(pdf, png):
+    # Pixels placed 1:1 at the page DPI, so the PDF embeds the raster without resampling
+    fig = Figure(figsize=PAGE_SIZE, dpi=DPI)
+    fig.figimage(mpimg.imread(BytesIO(png), format='png'), resize=False)
+    pdf.savefig(fig, dpi=DPI)
+
+def build(roi, items, title):
+    """Writes a PDF for [(mode, module, params), ...] over the ROI; returns (path, per-page timings)."""
+    geo_json = helpers.roi_geojson(roi)
+    s = geometry.summary(geo_json)
+    fp = geometry.fingerprint(geo_json)
+    stamp = datetime.now().strftime('%Y-%m-%d %H:%M')
+    path = cache_path(ROOT, fp, f"{slug(title) or 'report'}.pdf")
+    cover = {'title': title, 'subtitle': f"Generated {stamp}", 'number': 1, 'contents': [mode for mode, _, _ in items],
+             'metrics': [("Area", f"{s['area_km2']:,.2f} km²"), ("Parts", s['parts']), ("Vertices", s['vertices']),
+                         ("Bounds", ", ".join(f"{v:.4f}" for v in s['bounds'])), ("Analyses", len(items))]}
+    timings = []
+    prune_cache()
+    ctx = multiprocessing.get_context('spawn')
+    with ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS) as threads, \
+            ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=ctx) as procs:
+        # 1. Every analysis and the backdrop start at once
+        bg = threads.submit(background_png, roi, geo_json)
+        pending = [threads.submit(page_data, roi, geo_json, mode, module, params) for mode, module, params in items]
+        renders = [(procs.submit(render_page, cover), cover, 0.0, False)]
+        try:
+            background = bg.result()
+        except Exception:
+            background = None
+
+        # 2. Pages go to the render pool in order as their analyses finish
+        for i, fut in enumerate(pending):
+            data, secs, cached = fut.result()
+            page = dict(data, number=i + 2, bounds=s['bounds'], background=background,
+                        subtitle=f"{items[i][0]}  |  {stamp}")
+            renders.append((procs.submit(render_page, page), page, secs, cached))
+
+        # 3. Streamed into the PDF in page order, under a private name so concurrent builds of the
+        # same report never write into one file
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with PdfPages(tmp) as pdf:
+                for n, (fut, page, secs, cached) in enumerate(renders, start=1):
+                    try:
+                        png, render_secs = fut.result()
+                    except Exception as e:
+                        # A page that fails to draw becomes an error page instead of aborting the build
+                        png, render_secs = render_page(dict({k: page.get(k) for k in ('title', 'subtitle', 'number')}, error=f"Page rendering failed: {e}"))
+                    t0 = time.time()
+                    _write_page(pdf, png)
+                    timings.append({'Page': n, 'Title': page['title'], 'Analysis (s)': round(secs, 2), 'Cached': cached,
+                                    'Render (s)': round(render_secs, 2), 'Write (s)': round(time.time() - t0, 2)})
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp): os.remove(tmp)
+    return path, pd.DataFrame(timings)
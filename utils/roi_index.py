@@ -0,0 +1,60 @@
+import json
+import time
+import math
+import sqlite3
+import utils.geometry as geometry
+import utils.raster as raster
+from utils.cache import cache_path
+
+# Grid index of analysed ROIs and the cached rasters computed for them (<cache>/roi_index.sqlite).
+# Each ROI is listed under every GRID_DEG cell its bounding box touches; a new ROI looks up the
+# cell of its bounding-box corner, so any cached ROI that contains it is among the candidates.
+DB = cache_path("roi_index.sqlite")
+GRID_DEG = 0.25
+
+def _execute(sql, args=()):
+    con = sqlite3.connect(DB, timeout=30)
+    try:
+        with con:
+            con.execute("CREATE TABLE IF NOT EXISTS rois (fp TEXT PRIMARY KEY, geojson TEXT, min_lon REAL, min_lat REAL, max_lon REAL, max_lat REAL, created REAL)")
+            con.execute("CREATE TABLE IF NOT EXISTS cells (cell TEXT, fp TEXT, PRIMARY KEY (cell, fp))")
+            con.execute("CREATE TABLE IF NOT EXISTS results (fp TEXT, kind TEXT, path TEXT, bounds TEXT, created REAL, PRIMARY KEY (fp, kind))")
+            return con.execute(sql, args).fetchall()
+    finally:
+        con.close()
+
+def _cell(lon, lat):
+    return f"{math.floor(lon / GRID_DEG)}_{math.floor(lat / GRID_DEG)}"
+
+def register(geo_json):
+    """Adds an ROI to the index (idempotent) and returns its canonical fingerprint."""
+    fp = geometry.fingerprint(geo_json)
+    if _execute("SELECT 1 FROM rois WHERE fp=?", (fp,)): return fp
+    b = raster.geojson_bounds(geo_json)
+    _execute("INSERT OR IGNORE INTO rois VALUES (?, ?, ?, ?, ?, ?, ?)", (fp, json.dumps(geo_json), *map(float, b), time.time()))
+    for i in range(math.floor(b[0] / GRID_DEG), math.floor(b[2] / GRID_DEG) + 1):
+        for j in range(math.floor(b[1] / GRID_DEG), math.floor(b[3] / GRID_DEG) + 1):
+            _execute("INSERT OR IGNORE INTO cells VALUES (?, ?)", (f"{i}_{j}", fp))
+    return fp
+
+def save_result(geo_json, kind, path, bounds):
+    """Records a cached raster at `path` (covering `bounds`) for the ROI under a parameter kind."""
+    fp = register(geo_json)
+    _execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", (fp, kind, path, json.dumps(list(bounds)), time.time()))
+
+def find_result(geo_json, kind):
+    """(path, bounds, exact) of a cached raster of this kind for the ROI or an ROI containing it; else None."""
+    fp = geometry.fingerprint(geo_json)
+    row = _execute("SELECT path, bounds FROM results WHERE fp=? AND kind=?", (fp, kind))
+    if row: return row[0][0], tuple(json.loads(row[0][1])), True
+
+    b = raster.geojson_bounds(geo_json)
+    rows = _execute(
+        "SELECT r.geojson, s.path, s.bounds FROM cells c JOIN rois r ON r.fp = c.fp JOIN results s ON s.fp = c.fp "
+        "WHERE c.cell=? AND s.kind=? AND r.min_lon<=? AND r.min_lat<=? AND r.max_lon>=? AND r.max_lat>=? "
+        "ORDER BY (r.max_lon - r.min_lon) * (r.max_lat - r.min_lat)",
+        (_cell(b[0], b[1]), kind, *map(float, b)))
+    for outer, path, bounds in rows:
+        if geometry.contains(json.loads(outer), geo_json):
+            return path, tuple(json.loads(bounds)), False
+    return None
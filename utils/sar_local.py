@@ -0,0 +1,202 @@
+import os
+import json
+import math
+import warnings
+import hashlib
+import numpy as np
+import utils.raster as raster
+import utils.geometry as geometry
+import utils.roi_index as roi_index
+from utils.cache import cache_path
+
+# Local re-implementation of the Sentinel-1 water/flood graphs on staged chips.
+# Stacks are stored as (scenes, h, w) float32 .npy files under <cache>/sar/ and memory-mapped,
+# with a JSON sidecar holding the grid bounds and band names, and registered in the ROI index.
+ROOT = "sar"
+SAR_RES = raster.BASE_RES / 3  # ~10 m at the equator
+MAX_STAGE_PIXELS = 1e8
+CHUNK_MB = 64
+
+def stack_key(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+def _load(path):
+    meta_path = path[:-len(".npy")] + ".json"
+    if not (os.path.exists(path) and os.path.exists(meta_path)): return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return np.load(path, mmap_mode='r'), meta
+
+def stage_stack(kind, geo_json, image, res=SAR_RES):
+    """Memory-mapped (bands, h, w) stack of an EE image over the ROI, downloaded at most once.
+
+    `kind` identifies the image apart from the ROI; a stack of the same kind staged for an ROI
+    that contains this one is cropped locally instead of downloaded again.
+    """
+    kind = f"sar_{stack_key(*kind)}"
+    found = roi_index.find_result(geo_json, kind)
+    staged = _load(found[0]) if found else None
+    if staged:
+        stack, meta = staged
+        if found[2]: return staged
+        (rows, cols), window = raster.window_slices(meta['bounds'], stack.shape[1:], raster.geojson_bounds(geo_json))
+        return stack[:, rows, cols], dict(meta, bounds=list(window))
+
+    bounds = raster.geojson_bounds(geo_json)
+    n = image.bandNames().size().getInfo()
+    _, (h, w) = raster.snap_bounds(bounds, res)
+    if n == 0: raise ValueError("No scenes to stage.")
+    if n * h * w > MAX_STAGE_PIXELS:
+        raise ValueError(f"{n} scenes of {h}x{w} px exceed the local staging budget.")
+
+    bands, grid_bounds = raster.fetch_array(image, bounds, res)
+    path = cache_path(ROOT, f"{kind}_{geometry.fingerprint(geo_json)}.npy")
+    tmp = path + ".tmp.npy"
+    out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(len(bands), h, w))
+    for i, arr in enumerate(bands.values()):
+        out[i] = arr
+    out.flush()
+    del out
+    os.replace(tmp, path)
+    with open(path[:-len(".npy")] + ".json", 'w') as f:
+        json.dump({'bounds': list(grid_bounds), 'bands': list(bands), 'res': res}, f)
+    roi_index.save_result(geo_json, kind, path, grid_bounds)
+    return _load(path)
+
+def radius_px(meters, bounds=None, res=SAR_RES):
+    """(ry, rx) pixels of a metric radius on the res-degree grid, at the latitude of bounds' centre.
+
+    Grid pixels narrow in metres away from the equator, so the x radius grows by 1/cos(lat) and the
+    kernel stays a circle on the ground, as in EE's metre-based focal filters.
+    """
+    ry = meters / (res * 111320.0)
+    lat = (bounds[1] + bounds[3]) / 2 if bounds else 0.0
+    return ry, ry / max(math.cos(math.radians(lat)), 1e-6)
+
+def _circle(radius):
+    """(dy, half-width) rows of the kernel: pixel offsets with dx²+dy² <= r², or (dx/rx)²+(dy/ry)² <= 1 for radius=(ry, rx)."""
+    ry, rx = radius if isinstance(radius, tuple) else (radius, radius)
+    if rx == ry: return [(dy, int(np.floor(np.sqrt(rx ** 2 - dy ** 2)))) for dy in range(-int(np.floor(ry)), int(np.floor(ry)) + 1)]
+    return [(dy, int(np.floor(rx * np.sqrt(1 - (dy / ry) ** 2)))) for dy in range(-int(np.floor(ry)), int(np.floor(ry)) + 1)]
+
+def _halo(kernel):
+    return max(max(abs(dy), hw) for dy, hw in kernel)
+
+def _row_chunks(h, w, halo, per_pixel_bytes):
+    rows = max(1, int(CHUNK_MB * 2 ** 20 // max(1, w * per_pixel_bytes)))
+    for r0 in range(0, h, rows):
+        yield r0, min(h, r0 + rows)
+
+def _halo_block(arr, r0, r1, halo):
+    """Rows [r0, r1) of arr with `halo` NaN-padded pixels on every side."""
+    h, w = arr.shape
+    block = np.full((r1 - r0 + 2 * halo, w + 2 * halo), np.nan, dtype=np.float32)
+    s0, s1 = max(0, r0 - halo), min(h, r1 + halo)
+    block[s0 - (r0 - halo):s1 - (r0 - halo), halo:halo + w] = arr[s0:s1]
+    return block
+
+def focal_mean(arr, radius):
+    """Circular focal mean ignoring NaN, via per-row running sums over halo-padded chunks."""
+    h, w = arr.shape
+    kernel = _circle(radius)
+    halo = _halo(kernel)
+    out = np.empty((h, w), dtype=np.float32)
+    for r0, r1 in _row_chunks(h, w, halo, 32):
+        block = _halo_block(arr, r0, r1, halo)
+        valid = ~np.isnan(block)
+        zeros = np.zeros((block.shape[0], 1))
+        cs_v = np.concatenate([zeros, np.cumsum(np.where(valid, block, 0), axis=1, dtype=np.float64)], axis=1)
+        cs_n = np.concatenate([zeros, np.cumsum(valid, axis=1, dtype=np.float64)], axis=1)
+        n = r1 - r0
+        total, count = np.zeros((n, w)), np.zeros((n, w))
+        for dy, hw in kernel:
+            rows = slice(halo + dy, halo + dy + n)
+            hi, lo = slice(halo + hw + 1, halo + hw + 1 + w), slice(halo - hw, halo - hw + w)
+            total += cs_v[rows, hi] - cs_v[rows, lo]
+            count += cs_n[rows, hi] - cs_n[rows, lo]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[r0:r1] = np.where(count > 0, total / count, np.nan)
+    return out
+
+def focal_median(arr, radius):
+    """Circular focal median ignoring NaN, over halo-padded chunks of sliding windows."""
+    h, w = arr.shape
+    kernel = _circle(radius)
+    halo = _halo(kernel)
+    size = 2 * halo + 1
+    offsets = np.zeros((size, size), dtype=bool)
+    for dy, hw in kernel:
+        offsets[halo + dy, halo - hw:halo + hw + 1] = True
+    out = np.empty((h, w), dtype=np.float32)
+    for r0, r1 in _row_chunks(h, w, halo, 4 * int(offsets.sum())):
+        windows = np.lib.stride_tricks.sliding_window_view(_halo_block(arr, r0, r1, halo), (size, size))
+        vals = windows[..., offsets]
+        # Partial sort for full windows; only windows touching NaN (edges, nodata) take nanmedian
+        med = _partition_median(vals)
+        gaps = np.isnan(vals).any(axis=-1)
+        if gaps.any():
+            med[gaps] = _nanmedian(vals[gaps], axis=-1)
+        out[r0:r1] = med
+    return out
+
+def _partition_median(vals):
+    k = vals.shape[-1]
+    if k % 2: return np.partition(vals, k // 2, axis=-1)[..., k // 2]
+    part = np.partition(vals, [k // 2 - 1, k // 2], axis=-1)
+    return (part[..., k // 2 - 1] + part[..., k // 2]) / 2
+
+def size_filter(mask, min_pixels=8):
+    """Drops 8-connected True regions smaller than min_pixels (connectedPixelCount().gte)."""
+    labels, count = raster.label_components(mask)
+    if count == 0: return mask
+    sizes = np.bincount(labels.ravel())
+    keep = sizes >= min_pixels
+    keep[0] = False
+    return keep[labels]
+
+def area_ha(mask, bounds):
+    return float((mask.sum(axis=1) * raster.pixel_area_rows(bounds, mask.shape)).sum() / 10000)
+
+def _reduce_scenes(stack, fn):
+    """Per-pixel reduction over scenes, in row chunks so the memmap is never fully loaded."""
+    n, h, w = stack.shape
+    out = np.empty((h, w), dtype=np.float32)
+    for r0, r1 in _row_chunks(h, w, 0, 4 * n):
+        out[r0:r1] = fn(np.asarray(stack[:, r0:r1]))
+    return out
+
+def _nanmedian(block, axis=0):
+    # All-NaN windows stay NaN without a warning
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(block, axis=axis)
+
+def _mosaic(block):
+    # ee.ImageCollection.mosaic: later scenes on top, masked pixels fall through
+    out = block[0].copy()
+    for scene in block[1:]:
+        out = np.where(np.isnan(scene), out, scene)
+    return out
+
+def water_composite(stack, radius):
+    """Encroachment path: per-scene focal median, then the per-pixel minimum."""
+    out = None
+    for scene in stack:
+        f = focal_median(np.asarray(scene), radius)
+        out = f if out is None else np.fmin(out, f)
+    return out
+
+def water_mask(composite, threshold=-16.0):
+    with np.errstate(invalid='ignore'):
+        return composite < threshold
+
+def flood_composites(pre, post, radius):
+    """Flood path: filtered pre-event median and post-event mosaic."""
+    before = _reduce_scenes(pre, _nanmedian)
+    after = _reduce_scenes(post, _mosaic)
+    return focal_mean(before, radius), focal_mean(after, radius)
+
+def flood_mask(before_f, after_f, static, threshold, min_pixels=8):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        flooded = (after_f / before_f) > threshold
+    return size_filter(flooded & static, min_pixels)
@@ -0,0 +1,87 @@
+import numpy as np
+
+# Largest weight sample count offered: each sample is one score per valid pixel
+MAX_SAMPLES = 2000
+
+def sample_weights(base, n, concentration=50.0, seed=None):
+    """Samples n Dirichlet weight vectors centred on `base` (a 1-D weight vector).
+
+    Higher concentration keeps samples closer to base. Returns a (len(base), n) float32 matrix.
+    """
+    base = np.asarray(base, dtype=np.float64)
+    base = base / base.sum()
+    alpha = np.maximum(base * concentration, 1e-3)
+    rng = np.random.default_rng(seed)
+    return rng.dirichlet(alpha, n).T.astype(np.float32)
+
+def pixel_stats(stack, weights, threshold=0.65, chunk_mb=4):
+    """Per-pixel score distribution under sampled weights.
+
+    stack is (pixels, criteria) with criteria in [0, 1] and weights is (criteria, samples).
+    Mean and standard deviation come from the sample mean/covariance of the weights (identical
+    to the per-sample scores since the overlay is linear). The exceedance probability is exact:
+    pixels whose every sampled score provably lies on one side of the threshold are settled from
+    bounds, the rest are scored against all samples as chunked (chunk x samples) matrix products.
+    Returns (mean, std, prob) with NaN where any criterion is missing.
+    """
+    n_pix = stack.shape[0]
+    mean = np.full(n_pix, np.nan, dtype=np.float32)
+    std = np.full(n_pix, np.nan, dtype=np.float32)
+    prob = np.full(n_pix, np.nan, dtype=np.float32)
+    valid = np.flatnonzero(~np.isnan(stack).any(axis=1))
+    if valid.size == 0: return mean, std, prob
+
+    x = stack[valid].astype(np.float32)
+    w_mean = weights.mean(axis=1)
+    w_cov = np.cov(weights, bias=True).astype(np.float32)
+    mu = x @ w_mean
+    mean[valid] = mu
+    std[valid] = np.sqrt(np.maximum(((x @ w_cov) * x).sum(axis=1), 0))
+
+    # Bounds on every sample's score: weights sum to one, so x.(w - w_mean) = (x - mean(x)).(w - w_mean)
+    # and Cauchy-Schwarz bounds the spread; per-criterion weight ranges and min/max(x) bound it too
+    spread = np.sqrt(((weights - w_mean[:, None]) ** 2).sum(axis=0)).max()
+    radius = np.sqrt(((x - x.mean(axis=1, keepdims=True)) ** 2).sum(axis=1)) * spread + 1e-5
+    lo = np.maximum.reduce([mu - radius, x.min(axis=1), x @ weights.min(axis=1)]) - 1e-5
+    hi = np.minimum.reduce([mu + radius, x.max(axis=1), x @ weights.max(axis=1)]) + 1e-5
+    p = (lo > threshold).astype(np.float32)
+    open_ = np.flatnonzero((lo <= threshold) & (hi > threshold))
+
+    n_samples = weights.shape[1]
+    chunk = max(1, int(chunk_mb * 2**20 // (n_samples * 4)))
+    for i in range(0, len(open_), chunk):
+        rows = open_[i:i + chunk]
+        p[rows] = (x[rows] @ weights > threshold).sum(axis=1, dtype=np.int32) / n_samples
+    prob[valid] = p
+    return mean, std, prob
+
+def rank_stability(stack, labels, site_labels, weights):
+    """Rank distribution of extracted sites under sampled weights.
+
+    A site's score is the mean overlay over its pixels, so it equals the site-mean criteria
+    vector times the weights. Returns a dict of arrays aligned with site_labels: mean_rank,
+    rank_std, p5/p95 rank and the probability of keeping the baseline (list) rank.
+    """
+    flat = labels.ravel()
+    k = len(site_labels)
+    # Position of each pixel's label in site_labels (-1 for pixels outside the listed sites)
+    lookup = np.full(max(int(flat.max(initial=0)), max(site_labels, default=0)) + 1, -1, dtype=np.int64)
+    lookup[np.asarray(site_labels, dtype=np.int64)] = np.arange(k)
+    pos = lookup[flat]
+    pick = pos >= 0
+    pos = pos[pick]
+    values = stack[pick]
+    counts = np.bincount(pos, minlength=k)
+    site_crit = np.stack([np.bincount(pos, weights=np.nan_to_num(values[:, j]), minlength=k) for j in range(stack.shape[1])], axis=1)
+    site_crit /= np.maximum(counts, 1)[:, None]
+
+    scores = site_crit.astype(np.float32) @ weights
+    ranks = np.argsort(np.argsort(-scores, axis=0), axis=0) + 1
+    baseline = np.arange(1, k + 1)[:, None]
+    return {
+        'mean_rank': ranks.mean(axis=1),
+        'rank_std': ranks.std(axis=1),
+        'rank_p5': np.percentile(ranks, 5, axis=1),
+        'rank_p95': np.percentile(ranks, 95, axis=1),
+        'p_same_rank': (ranks == baseline).mean(axis=1),
+    }
@@ -0,0 +1,194 @@
+import os
+import time
+import uuid
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+import streamlit as st
+from utils.cache import cache_path
+from utils.jobs import job_id
+
+# Bounded store for large session results (staged arrays, downloaded grids, ranked sites).
+# Each value is pickled once into a content-addressed blob at <cache>/blobs/<h[:2]>/<h>.pkl shared by
+# all sessions; st.session_state only keeps {name: (digest, bytes, key id)} references. Values put with
+# a request key are also indexed at <cache>/blobs/keys/<id>.ref, so any session, including one started
+# after a restart, finds the blob for the same request before computing it. Recently used blobs stay
+# unpickled in a process-wide LRU; a session over its byte budget drops its oldest references.
+# Values handed out are shared between sessions and must not be mutated.
+ROOT = "blobs"
+MB = 1 << 20
+SESSION_BYTES = int(os.environ.get("GEOSAROVAR_SESSION_MB", 256)) * MB
+MEMORY_BYTES = int(os.environ.get("GEOSAROVAR_MEMORY_MB", 1024)) * MB
+DISK_BYTES = int(os.environ.get("GEOSAROVAR_DISK_MB", 8192)) * MB
+SESSION_IDLE_S = 3600
+
+_LOCK = threading.Lock()
+_RESIDENT = OrderedDict()   # digest -> (value, bytes), least recently used first
+_SESSIONS = {}              # session id -> (referenced bytes, last seen)
+_STATS = {'hits': 0, 'loads': 0, 'misses': 0, 'memory_evictions': 0, 'session_evictions': 0, 'disk_evictions': 0}
+_DISK = {'bytes': None}
+
+def _path(digest):
+    return cache_path(ROOT, digest[:2], f"{digest}.pkl")
+
+def _ref_path(kid):
+    return cache_path(ROOT, "keys", f"{kid}.ref")
+
+def _blobs():
+    """[(mtime, bytes, path)] of every blob on disk."""
+    folder = os.path.dirname(os.path.dirname(_path("00")))
+    out = []
+    for root, _, files in os.walk(folder):
+        for f in files:
+            if not f.endswith(".pkl"): continue
+            try:
+                s = os.stat(os.path.join(root, f))
+                out.append((s.st_mtime, s.st_size, os.path.join(root, f)))
+            except OSError: pass
+    return out
+
+def _disk_bytes():
+    if _DISK['bytes'] is None: _DISK['bytes'] = sum(b for _, b, _ in _blobs())
+    return _DISK['bytes']
+
+def _prune_disk():
+    # Oldest-touched blobs go first, down to 80% of the budget
+    blobs = sorted(_blobs())
+    total = sum(b for _, b, _ in blobs)
+    for _, size, path in blobs:
+        if total <= DISK_BYTES * 0.8: break
+        try:
+            os.remove(path)
+            total -= size
+            _STATS['disk_evictions'] += 1
+        except OSError: pass
+    _DISK['bytes'] = total
+
+def _keep(digest, value, size):
+    """Adds a value to the in-memory LRU and evicts the least recently used beyond MEMORY_BYTES."""
+    _RESIDENT[digest] = (value, size)
+    _RESIDENT.move_to_end(digest)
+    resident = sum(b for _, b in _RESIDENT.values())
+    while resident > MEMORY_BYTES and len(_RESIDENT) > 1:
+        _, (_, b) = _RESIDENT.popitem(last=False)
+        resident -= b
+        _STATS['memory_evictions'] += 1
+
+def _refs():
+    if '_store_refs' not in st.session_state:
+        st.session_state['_store_refs'] = OrderedDict()
+        st.session_state['_store_sid'] = uuid.uuid4().hex
+    return st.session_state['_store_refs']
+
+def _account(refs):
+    _SESSIONS[st.session_state['_store_sid']] = (sum(r[1] for r in refs.values()), time.time())
+
+def _reference(refs, name, digest, size, kid):
+    """Points name at a blob, dropping this session's oldest other references while over budget."""
+    refs[name] = (digest, size, kid)
+    refs.move_to_end(name)
+    while sum(r[1] for r in refs.values()) > SESSION_BYTES and len(refs) > 1:
+        refs.popitem(last=False)
+        _STATS['session_evictions'] += 1
+    _account(refs)
+
+def _load(digest, size):
+    """Blob value from memory or disk; raises OSError (or an unpickling error) if it was pruned."""
+    if digest in _RESIDENT:
+        _RESIDENT.move_to_end(digest)
+        _STATS['hits'] += 1
+        return _RESIDENT[digest][0]
+    path = _path(digest)
+    with open(path, 'rb') as f: value = pickle.load(f)
+    os.utime(path)
+    _keep(digest, value, size)
+    _STATS['loads'] += 1
+    return value
+
+def put(name, value, key=None):
+    """Stores value under name for this session (and under the request key for all sessions); returns it."""
+    blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.sha256(blob).hexdigest()
+    size = len(blob)
+    refs = _refs()
+    with _LOCK:
+        # 1. Content-addressed blob, written once whichever session produced it
+        path = _path(digest)
+        if not os.path.exists(path):
+            used = _disk_bytes()
+            with open(path + ".tmp", 'wb') as f: f.write(blob)
+            os.replace(path + ".tmp", path)
+            _DISK['bytes'] = used + size
+            if _DISK['bytes'] > DISK_BYTES: _prune_disk()
+        else:
+            os.utime(path)
+        _keep(digest, value, size)
+
+        # 2. Request key index, then the session reference
+        kid = job_id(key) if key is not None else None
+        if kid:
+            ref = _ref_path(kid)
+            with open(ref + ".tmp", 'w') as f: f.write(f"{digest} {size}")
+            os.replace(ref + ".tmp", ref)
+        _reference(refs, name, digest, size, kid)
+    return value
+
+def get(name, default=None, key=None):
+    """Value stored under name, from memory or disk; default if gone.
+
+    With a request key, only a value put under that same key is returned: this session's reference
+    if it matches, else the blob any session stored for the key.
+    """
+    refs = _refs()
+    kid = job_id(key) if key is not None else None
+    with _LOCK:
+        # 1. This session's reference
+        ref = refs.get(name)
+        if ref and (kid is None or ref[2] == kid):
+            try:
+                value = _load(ref[0], ref[1])
+                refs.move_to_end(name)
+                _account(refs)
+                return value
+            except (OSError, pickle.UnpicklingError, EOFError):
+                # Pruned from disk since: fall through to the index, else the caller recomputes
+                del refs[name]
+                _account(refs)
+        if kid is None:
+            if ref: _STATS['misses'] += 1
+            return default
+
+        # 2. Blob stored for the same request by any session
+        path = _ref_path(kid)
+        try:
+            with open(path) as f: digest, size = f.read().split()
+        except OSError:
+            return default
+        try:
+            value = _load(digest, int(size))
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+            try: os.remove(path)
+            except OSError: pass
+            _STATS['misses'] += 1
+            return default
+        _reference(refs, name, digest, int(size), kid)
+        return value
+
+def pop(name):
+    """Drops this session's reference to name; the shared blob stays for other sessions."""
+    refs = _refs()
+    with _LOCK:
+        refs.pop(name, None)
+        _account(refs)
+
+def metrics():
+    """Memory and disk usage of the store, this session's share and the hit counters."""
+    refs = _refs()
+    now = time.time()
+    with _LOCK:
+        for sid in [s for s, (_, seen) in _SESSIONS.items() if now - seen > SESSION_IDLE_S]: del _SESSIONS[sid]
+        return dict(_STATS, session_bytes=sum(r[1] for r in refs.values()), session_items=len(refs),
+                    resident_bytes=sum(b for _, b in _RESIDENT.values()), resident_items=len(_RESIDENT),
+                    disk_bytes=_disk_bytes(), active_sessions=len(_SESSIONS),
+                    referenced_bytes=sum(b for b, _ in _SESSIONS.values()))
@@ -0,0 +1,116 @@
+import heapq
+import json
+import math
+import numpy as np
+import pandas as pd
+import utils.raster as raster
+
+# Pixels with normalised flow accumulation at or above this count as drainage lines
+DRAIN_THRESHOLD = 0.5
+M_PER_DEG = 111320.0
+
+def _to_metres(lon, lat, lat0):
+    return lon * M_PER_DEG * math.cos(math.radians(lat0)), lat * M_PER_DEG
+
+def _drainage_index(drain, bounds, cell_m):
+    """Grid bucket index (sorted cell keys) over drainage pixel centres, in metres."""
+    h, w = drain.shape
+    min_lon, min_lat, max_lon, max_lat = bounds
+    lat0 = (min_lat + max_lat) / 2
+    rows, cols = np.nonzero(np.nan_to_num(drain) >= DRAIN_THRESHOLD)
+    lon = min_lon + (cols + 0.5) * (max_lon - min_lon) / w
+    lat = max_lat - (rows + 0.5) * (max_lat - min_lat) / h
+    x, y = _to_metres(lon, lat, lat0)
+    cx, cy = np.floor(x / cell_m).astype(np.int64), np.floor(y / cell_m).astype(np.int64)
+    keys = cy * 10**9 + cx
+    order = np.argsort(keys, kind='stable')
+    return {'x': x[order], 'y': y[order], 'keys': keys[order], 'cell': cell_m}
+
+def _nearest_drainage(index, x, y, max_rings=50):
+    if index['x'].size == 0: return None
+    cell = index['cell']
+    cx, cy = int(math.floor(x / cell)), int(math.floor(y / cell))
+    keys = index['keys']
+    best = math.inf
+    for ring in range(max_rings + 1):
+        for yy in range(cy - ring, cy + ring + 1):
+            # Only the ring's boundary cells are new at this radius
+            xs = range(cx - ring, cx + ring + 1) if abs(yy - cy) == ring else (cx - ring, cx + ring)
+            for xx in set(xs):
+                key = yy * 10**9 + xx
+                lo, hi = np.searchsorted(keys, key, 'left'), np.searchsorted(keys, key, 'right')
+                if hi > lo:
+                    d = np.hypot(index['x'][lo:hi] - x, index['y'][lo:hi] - y).min()
+                    best = min(best, d)
+        if best <= ring * cell: break
+    return None if best == math.inf else float(best)
+
+def extract_sites(suit, bounds, drain=None, threshold=0.65, top_k=20, min_spacing_m=500, min_pixels=4):
+    """Extracts ranked candidate sites from a suitability array.
+
+    Connected high-potential components are scored by mean suitability (area breaks ties),
+    the top-K are taken from a heap, and a grid index enforces min_spacing_m between site peaks.
+    Returns (sites, labels): site dicts ordered by rank and the component label raster.
+    """
+    h, w = suit.shape
+    min_lon, min_lat, max_lon, max_lat = bounds
+    labels, n = raster.label_components(np.nan_to_num(suit, nan=-1) > threshold)
+    if n == 0: return [], labels
+
+    # 1. Per-component statistics with bincount
+    flat = labels.ravel()
+    pix = np.flatnonzero(flat)
+    lab = flat[pix] - 1
+    score = suit.ravel()[pix].astype(np.float64)
+    area = np.bincount(lab, weights=raster.pixel_area_rows(bounds, suit.shape)[pix // w], minlength=n)
+    count = np.bincount(lab, minlength=n)
+    mean = np.bincount(lab, weights=score, minlength=n) / count
+
+    # Peak pixel = last entry per label when sorted by (label, score)
+    order = np.lexsort((score, lab))
+    ends = np.r_[np.flatnonzero(np.diff(lab[order])), lab.size - 1]
+    peak = pix[order][ends]
+    peak_score = score[order][ends]
+    peak_lon = min_lon + (peak % w + 0.5) * (max_lon - min_lon) / w
+    peak_lat = max_lat - (peak // w + 0.5) * (max_lat - min_lat) / h
+
+    # 2. Top-K via heap with spatial non-maximum suppression on a grid index
+    lat0 = (min_lat + max_lat) / 2
+    heap = [(-mean[i], -area[i], i) for i in np.flatnonzero(count >= min_pixels)]
+    heapq.heapify(heap)
+    cell = max(min_spacing_m, 1.0)
+    grid = {}
+    chosen = []
+    while heap and len(chosen) < top_k:
+        _, _, i = heapq.heappop(heap)
+        x, y = _to_metres(peak_lon[i], peak_lat[i], lat0)
+        cx, cy = int(x // cell), int(y // cell)
+        near = [p for dx in (-1, 0, 1) for dy in (-1, 0, 1) for p in grid.get((cx + dx, cy + dy), [])]
+        if any(math.hypot(x - px, y - py) < min_spacing_m for px, py in near): continue
+        grid.setdefault((cx, cy), []).append((x, y))
+        chosen.append((i, x, y))
+
+    # 3. Distance to drainage for the selected sites only
+    index = _drainage_index(drain, bounds, max(min_spacing_m, 500.0)) if drain is not None else None
+    sites = []
+    for rank, (i, x, y) in enumerate(chosen, start=1):
+        dist = _nearest_drainage(index, x, y) if index else None
+        sites.append({
+            'rank': rank, 'lon': round(float(peak_lon[i]), 6), 'lat': round(float(peak_lat[i]), 6),
+            'area_ha': round(float(area[i]) / 10000, 2), 'mean_score': round(float(mean[i]), 3),
+            'peak_score': round(float(peak_score[i]), 3), 'pixels': int(count[i]),
+            'drain_dist_m': None if dist is None else round(dist, 1), 'label': int(i) + 1,
+        })
+    return sites, labels
+
+def to_dataframe(sites):
+    cols = ['rank', 'lon', 'lat', 'area_ha', 'mean_score', 'peak_score', 'drain_dist_m', 'pixels']
+    return pd.DataFrame(sites, columns=cols)
+
+def to_geojson(sites):
+    features = [{
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [s['lon'], s['lat']]},
+        'properties': {k: v for k, v in s.items() if k not in ('lon', 'lat', 'label')},
+    } for s in sites]
+    return json.dumps({'type': 'FeatureCollection', 'features': features})
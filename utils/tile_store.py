@@ -0,0 +1,92 @@
+import os
+import re
+import json
+import numpy as np
+import utils.raster as raster
+from utils.cache import cache_path
+
+# Local pyramid tile store: <cache>/tiles/<store>/<layer>/<z>/<x>/<y>.npy on the utils.raster grid.
+ROOT = "tiles"
+
+def slug(text):
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+def _tile_file(store, layer, z, x, y):
+    return cache_path(ROOT, store, layer, str(z), str(x), f"{y}.npy")
+
+def has_tile(store, layer, z, x, y):
+    return os.path.exists(_tile_file(store, layer, z, x, y))
+
+def write_tile(store, layer, z, x, y, arr):
+    np.save(_tile_file(store, layer, z, x, y), arr.astype(np.float32))
+
+def read_tile(store, layer, z, x, y):
+    path = _tile_file(store, layer, z, x, y)
+    return np.load(path, mmap_mode='r') if os.path.exists(path) else None
+
+def load_index(store):
+    path = cache_path(ROOT, store, "index.json")
+    if not os.path.exists(path): return {}
+    with open(path) as f: return json.load(f)
+
+def save_index(store, index):
+    path = cache_path(ROOT, store, "index.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f: json.dump(index, f, indent=1)
+    os.replace(tmp, path)
+
+def _downsample(arr):
+    # 2x2 block mean ignoring NaN
+    h, w = arr.shape
+    blocks = arr.reshape(h // 2, 2, w // 2, 2)
+    valid = ~np.isnan(blocks)
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3))
+    count = valid.sum(axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan).astype(np.float32)
+
+def build_pyramid(store, layer, tiles, max_level):
+    """Rebuilds parent tiles of the given level-0 (x, y) tiles up to max_level."""
+    n = raster.TILE_SIZE
+    half = n // 2
+    level_tiles = set(tiles)
+    for z in range(1, max_level + 1):
+        parents = {(x // 2, y // 2) for x, y in level_tiles}
+        for px, py in parents:
+            out = np.full((n, n), np.nan, dtype=np.float32)
+            for dx in (0, 1):
+                for dy in (0, 1):
+                    child = read_tile(store, layer, z - 1, 2 * px + dx, 2 * py + dy)
+                    if child is not None:
+                        out[dy * half:(dy + 1) * half, dx * half:(dx + 1) * half] = _downsample(np.asarray(child))
+            write_tile(store, layer, z, px, py, out)
+        level_tiles = parents
+
+def pick_level(bounds, max_level, max_pixels=2_000_000):
+    """Finest pyramid level at which the bounds fit within max_pixels."""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    for z in range(max_level + 1):
+        res = raster.level_res(z)
+        if ((max_lon - min_lon) / res) * ((max_lat - min_lat) / res) <= max_pixels: return z
+    return max_level
+
+def read_window(store, layer, bounds, z):
+    """Mosaics and crops the tiles covering bounds at level z.
+
+    Returns (array, window bounds) or None if any tile is missing.
+    """
+    n = raster.TILE_SIZE
+    x0, y0, x1, y1 = raster.tile_range(bounds, z)
+    mosaic = np.empty(((y1 - y0 + 1) * n, (x1 - x0 + 1) * n), dtype=np.float32)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            tile = read_tile(store, layer, z, x, y)
+            if tile is None: return None
+            mosaic[(y - y0) * n:(y - y0 + 1) * n, (x - x0) * n:(x - x0 + 1) * n] = tile
+
+    res = raster.level_res(z)
+    grid_bounds, (h, w) = raster.snap_bounds(bounds, res)
+    origin_lon, _, _, origin_lat = raster.tile_bounds(z, x0, y0)
+    c0 = int(round((grid_bounds[0] - origin_lon) / res))
+    r0 = int(round((origin_lat - grid_bounds[3]) / res))
+    return mosaic[r0:r0 + h, c0:c0 + w], grid_bounds
@@ -0,0 +1,98 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from utils.cache import cache_path
+from utils.tile_store import slug
+
+# Columnar per-ROI time series: <cache>/timeseries/roi=<fp>/series=<name>/part-*.parquet
+# Date windows are half-open [start, end) like ee.ImageCollection.filterDate.
+ROOT = "timeseries"
+# Scenes can be ingested a few days after acquisition, so the newest days are never marked complete
+# (default for scene series; daily products pass their own publication lag)
+INGEST_LAG_DAYS = 5
+
+def _dir(fingerprint, series):
+    return os.path.dirname(cache_path(ROOT, f"roi={fingerprint}", f"series={slug(series)}", "manifest.json"))
+
+def _read_manifest(folder):
+    path = os.path.join(folder, "manifest.json")
+    if not os.path.exists(path): return None
+    with open(path) as f: return json.load(f)
+
+def _write_manifest(folder, manifest):
+    path = os.path.join(folder, "manifest.json")
+    with open(path + ".tmp", "w") as f: json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+def load(fingerprint, series, start, end):
+    """Reads stored rows with start <= date < end, one row per date (latest write wins)."""
+    folder = _dir(fingerprint, series)
+    files = sorted(f for f in os.listdir(folder) if f.endswith(".parquet")) if os.path.isdir(folder) else []
+    if not files: return pd.DataFrame(columns=['date'])
+    # recent.parquet sorts after part-* so its re-fetched rows win
+    df = pd.concat([pd.read_parquet(os.path.join(folder, f)) for f in files], ignore_index=True)
+    df['date'] = pd.to_datetime(df['date'])
+    df = df.drop_duplicates('date', keep='last')
+    df = df[(df['date'] >= pd.Timestamp(start)) & (df['date'] < pd.Timestamp(end))]
+    return df.sort_values('date').reset_index(drop=True)
+
+def _good_days(part, start, end):
+    """(days of [start, end), mask of days that have a row with every value present)."""
+    days = pd.date_range(start, end, inclusive='left')
+    good = np.zeros(len(days), dtype=bool)
+    if len(part):
+        dates = pd.to_datetime(part['date'])[part.drop(columns='date').notna().all(axis=1).to_numpy()]
+        idx = days.get_indexer(pd.DatetimeIndex(dates.unique()))
+        good[idx[idx >= 0]] = True
+    return days, good
+
+def update(fingerprint, series, start, end, fetch, lag_days=INGEST_LAG_DAYS, daily=False):
+    """Fetches only the parts of [start, end) not yet stored, appends them, and returns the window.
+
+    fetch(start, end) must return a DataFrame with a 'date' column ('YYYY-MM-DD') plus value columns.
+    Stored coverage stays one contiguous interval; days inside the dataset's settle lag (lag_days)
+    are re-fetched each run. For daily series (daily=True) a day with no row or a NaN value is not
+    yet published either, so coverage stops short of it and it is re-fetched next time.
+    """
+    folder = _dir(fingerprint, series)
+    manifest = _read_manifest(folder) or {'start': start, 'end': start}
+    settled = (datetime.now().date() - timedelta(days=lag_days)).isoformat()
+    cov_start, cov_end = manifest['start'], manifest['end']
+    provisional = []
+
+    def store(part, lo, hi):
+        rows = part[(part['date'] >= lo) & (part['date'] < hi)] if len(part) else part
+        if len(rows): rows.to_parquet(os.path.join(folder, f"part-{lo}_{hi}.parquet"), index=False)
+        if len(part): provisional.append(part[(part['date'] < lo) | (part['date'] >= hi)])
+
+    # 1. Before the stored interval: covered back to the last missing day
+    if start < cov_start:
+        part = fetch(start, cov_start)
+        first = start
+        if daily:
+            days, good = _good_days(part, start, cov_start)
+            if not good.all(): first = (days[np.flatnonzero(~good)[-1]] + pd.Timedelta(days=1)).date().isoformat()
+        store(part, first, cov_start)
+        cov_start = first
+
+    # 2. After it: covered up to the settle lag and the first missing day
+    if end > cov_end:
+        part = fetch(cov_end, end)
+        stop = min(end, max(cov_end, settled))
+        if daily:
+            days, good = _good_days(part, cov_end, stop)
+            if not good.all(): stop = days[np.flatnonzero(~good)[0]].date().isoformat()
+        store(part, cov_end, stop)
+        cov_end = stop
+
+    # Rows outside the coverage are kept only until the next fetch (recent.parquet wins on load)
+    if start < manifest['start'] or end > manifest['end']:
+        recent = os.path.join(folder, "recent.parquet")
+        rows = pd.concat(provisional, ignore_index=True) if provisional else pd.DataFrame()
+        if len(rows): rows.to_parquet(recent, index=False)
+        elif os.path.exists(recent): os.remove(recent)
+
+    _write_manifest(folder, {'start': cov_start, 'end': cov_end})
+    return load(fingerprint, series, start, end)
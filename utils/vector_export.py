@@ -0,0 +1,318 @@
+import os
+import re
+import json
+import math
+import time
+import struct
+import sqlite3
+import zipfile
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import ee
+import numpy as np
+import utils.geometry as geometry
+import utils.raster as raster
+from utils.cache import cache_path, prune
+
+# Vector export of classified zones. The ROI is vectorised in TILE_PX tiles on a global EPSG:4326
+# pixel grid, fetched concurrently; polygons cut by tile seams are merged locally by cancelling
+# their shared unit edges, simplified (Visvalingam) and streamed to GeoJSON, Shapefile or GeoPackage.
+ROOT = "vectors"
+TILE_PX = 1024
+MIN_TILE_PX = 64
+# Pixels in the whole vectorisation; larger ROIs are vectorised at a coarser scale
+VECTOR_PIXELS = 4e7
+# Visvalingam area threshold in pixel² (removes the single-pixel stair steps)
+SIMPLIFY_PX2 = 0.6
+MAX_WORKERS = 8
+# Exported files are kept for MAX_AGE_DAYS within MAX_BYTES, like the report cache
+MAX_AGE_DAYS = 30
+MAX_BYTES = int(os.environ.get("GEOSAROVAR_VECTOR_MB", 512)) << 20
+# Tiles fetched ahead of the consumer; finished tiles are released as soon as they are streamed
+MAX_IN_FLIGHT = 2 * MAX_WORKERS
+# Result-size errors that a smaller tile avoids: getInfo's element limit ("Collection query aborted
+# after accumulating over 5000 elements") and reduceToVectors' own limits ("Too many ...")
+TOO_MANY = re.compile(r'accumulating over \d+ elements|too many', re.IGNORECASE)
+FORMATS = {"GeoJSON": (".geojson", "application/geo+json"),
+           "Shapefile": (".zip", "application/zip"),
+           "GeoPackage": (".gpkg", "application/geopackage+sqlite3")}
+WGS84_WKT = ('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],'
+             'PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]')
+
+def vector_scale(geo_json, native):
+    """Working scale (m): the module's native scale unless the ROI would exceed VECTOR_PIXELS."""
+    area = geometry.summary(geo_json)['area_km2'] * 1e6
+    return max(native, math.sqrt(area / VECTOR_PIXELS))
+
+def _tiles(bounds, res):
+    """Tiles as integer grid windows (x0, y0, x1, y1), x east and y south from (-180, 90)."""
+    x0, x1 = math.floor((bounds[0] + 180) / res), math.ceil((bounds[2] + 180) / res)
+    y0, y1 = math.floor((90 - bounds[3]) / res), math.ceil((90 - bounds[1]) / res)
+    return [(x, y, min(x + TILE_PX, x1), min(y + TILE_PX, y1))
+            for y in range(y0 - y0 % TILE_PX, y1, TILE_PX) for x in range(x0 - x0 % TILE_PX, x1, TILE_PX)]
+
+def _fetch(image, tile, res):
+    """Polygons of one tile; tiles over the server's feature limit are split in four."""
+    x0, y0, x1, y1 = tile
+    rect = ee.Geometry.Rectangle([x0 * res - 180, 90 - y1 * res, x1 * res - 180, 90 - y0 * res], 'EPSG:4326', False)
+    try:
+        fc = image.reduceToVectors(geometry=rect, crs='EPSG:4326', crsTransform=[res, 0, -180, 0, -res, 90],
+                                   geometryType='polygon', eightConnected=False, labelProperty='class', maxPixels=1e9)
+        return fc.getInfo()['features']
+    except ee.EEException as e:
+        if not TOO_MANY.search(str(e)) or min(x1 - x0, y1 - y0) <= MIN_TILE_PX: raise
+        xm, ym = (x0 + x1) // 2, (y0 + y1) // 2
+        return [f for t in [(x0, y0, xm, ym), (xm, y0, x1, ym), (x0, ym, xm, y1), (xm, ym, x1, y1)] for f in _fetch(image, t, res)]
+
+def _to_grid(ring, res):
+    """Lon/lat ring to integer pixel-corner coordinates (x east, y north), CCW orientation kept as given."""
+    r = np.asarray(ring, dtype=np.float64)[:, :2]
+    return np.column_stack([np.rint((r[:, 0] + 180) / res), np.rint((r[:, 1] - 90) / res)]).astype(np.int64)
+
+def _from_grid(ring, res):
+    return np.column_stack([ring[:, 0] * res - 180, ring[:, 1] * res + 90])
+
+def _oriented(ring, ccw):
+    area = 0.5 * np.sum(ring[:-1, 0] * ring[1:, 1] - ring[1:, 0] * ring[:-1, 1])
+    return ring if (area > 0) == ccw else ring[::-1]
+
+def _unit_edges(ring):
+    """Directed unit edges (start, step) of an axis-aligned closed ring."""
+    d = ring[1:] - ring[:-1]
+    n = np.abs(d).sum(axis=1)
+    step = np.sign(d)
+    seg = np.repeat(np.arange(len(n)), n)
+    k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    return ring[:-1][seg] + step[seg] * k[:, None], step[seg]
+
+def _cancel(starts, steps, classes):
+    """Drops unit edges traversed in both directions by same-class polygons (their shared seams)."""
+    ends = starts + steps
+    lo = np.minimum(starts, ends)
+    horiz = (steps[:, 1] == 0).astype(np.int64)
+    sign = np.where(horiz == 1, steps[:, 0], steps[:, 1])
+    keys = np.column_stack([classes, lo, horiz])
+    _, inv = np.unique(keys, axis=0, return_inverse=True)
+    net = np.bincount(inv.ravel(), weights=sign)
+    keep = net[inv.ravel()] != 0
+    return starts[keep], steps[keep]
+
+def _trace(starts, steps):
+    """Closes the remaining unit edges into rings, turning left first so corner-touching parts stay apart."""
+    out = {}
+    for i, s in enumerate(map(tuple, starts)): out.setdefault(s, []).append(i)
+    used = np.zeros(len(starts), dtype=bool)
+    rings = []
+    for first in range(len(starts)):
+        if used[first]: continue
+        e, corners, closed = first, [], False
+        while True:
+            used[e] = True
+            end = tuple(starts[e] + steps[e])
+            cands = [c for c in out.get(end, []) if not used[c] or c == first]
+            if not cands: break
+            # Turn rank: left 0, straight 1, right 2
+            dx, dy = steps[e]
+            nxt = min(cands, key=lambda c: 1 - int(np.sign(dx * steps[c][1] - dy * steps[c][0])))
+            if (steps[nxt] != steps[e]).any(): corners.append(end)
+            if nxt == first:
+                closed = True
+                break
+            e = nxt
+        if closed and len(corners) >= 4:
+            ring = np.array(corners, dtype=np.int64)
+            rings.append(np.vstack([ring, ring[:1]]))
+    return rings
+
+def _assemble(rings):
+    """Groups traced rings into polygons: CCW shells, each CW hole under its smallest enclosing shell."""
+    area = [0.5 * np.sum(r[:-1, 0] * r[1:, 1] - r[1:, 0] * r[:-1, 1]) for r in rings]
+    shells = sorted((i for i, a in enumerate(area) if a > 0), key=lambda i: area[i])
+    polys = {i: [rings[i]] for i in shells}
+    for i, a in enumerate(area):
+        if a >= 0: continue
+        r = rings[i]
+        d = np.sign(r[1] - r[0])
+        # A point just left of the first hole edge lies in the filled part of the enclosing shell
+        probe = (r[0] + d * 0.5 + np.array([-d[1], d[0]]) * 0.25)[None, :]
+        for s in shells:
+            if geometry.points_inside({'type': 'Polygon', 'coordinates': [rings[s].tolist()]}, probe)[0]:
+                polys[s].append(r)
+                break
+    return list(polys.values())
+
+def simplify_ring(ring, tolerance):
+    """Visvalingam–Whyatt on a closed ring, removing every local-minimum triangle below tolerance per round."""
+    pts = ring[:-1].astype(np.float64)
+    idx = np.arange(len(pts))
+    while len(idx) > 4:
+        p = pts[idx]
+        a, b = np.roll(p, 1, axis=0), np.roll(p, -1, axis=0)
+        area = 0.5 * np.abs((a[:, 0] - p[:, 0]) * (b[:, 1] - p[:, 1]) - (b[:, 0] - p[:, 0]) * (a[:, 1] - p[:, 1]))
+        # Unique ranks break ties, so neighbouring vertices are never removed in the same round
+        rank = np.empty(len(area), dtype=np.int64)
+        rank[np.argsort(area, kind='stable')] = np.arange(len(area))
+        drop = (area < tolerance) & (rank < np.roll(rank, 1)) & (rank < np.roll(rank, -1))
+        if not drop.any(): break
+        over = drop.sum() - (len(idx) - 4)
+        if over > 0: drop[np.flatnonzero(drop)[-over:]] = False
+        idx = idx[~drop]
+    out = pts[idx]
+    return np.vstack([out, out[:1]])
+
+def _feature(poly, cls, names, res):
+    # Area from the exact pixel outline; only the written geometry is simplified
+    exact = [_from_grid(r, res) for r in poly]
+    area = geometry.ring_area(exact[0]) - sum(geometry.ring_area(h) for h in exact[1:])
+    rings = [_from_grid(simplify_ring(r, SIMPLIFY_PX2), res) for r in poly]
+    return {'class': int(cls), 'name': names.get(int(cls), str(cls)), 'area_ha': round(area / 1e4, 4), 'rings': rings}
+
+def _grid_polygons(feat, res):
+    geom = feat['geometry']
+    polys = [geom['coordinates']] if geom['type'] == 'Polygon' else geom['coordinates']
+    return [[_oriented(_to_grid(r, res), i == 0) for i, r in enumerate(poly)] for poly in polys]
+
+def features(image, geo_json, scale, names):
+    """Streams zone polygons as dicts (class, name, area_ha, lon/lat rings); seam-cut parts come last, merged."""
+    res = scale / 111320.0
+    tiles = _tiles(raster.geojson_bounds(geo_json), res)
+    starts, steps, classes = [], [], []
+    pending = iter(tiles)
+    futures = {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        while True:
+            for t in islice(pending, MAX_IN_FLIGHT - len(futures)): futures[pool.submit(_fetch, image, t, res)] = t
+            if not futures: break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for fut in done:
+                # Each tile's features are dropped once streamed, not kept until the end of the export
+                (x0, y0, x1, y1), feats = futures.pop(fut), fut.result()
+                for feat in feats:
+                    cls = feat['properties'].get('class', 1)
+                    for poly in _grid_polygons(feat, res):
+                        shell = poly[0]
+                        # Grid y is north-positive here, so the tile's rows map to -y1 .. -y0
+                        on_seam = np.isin(shell[:, 0], [x0, x1]).any() or np.isin(shell[:, 1], [-y0, -y1]).any()
+                        if not on_seam:
+                            yield _feature(poly, cls, names, res)
+                            continue
+                        # Seam edges are kept compact: int32 grid corners, int8 steps
+                        for ring in poly:
+                            s, d = _unit_edges(ring)
+                            starts.append(s.astype(np.int32)); steps.append(d.astype(np.int8)); classes.append(np.full(len(s), cls, dtype=np.int32))
+            del done, fut, feats
+    if not starts: return
+    starts, steps, classes = np.vstack(starts), np.vstack(steps), np.concatenate(classes)
+    for cls in np.unique(classes):
+        sel = classes == cls
+        s, d = _cancel(starts[sel], steps[sel], classes[sel])
+        for poly in _assemble(_trace(s, d)):
+            yield _feature(poly, cls, names, res)
+
+def write_geojson(feats, path):
+    with open(path, 'w') as f:
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        for i, feat in enumerate(feats):
+            if i: f.write(',\n')
+            json.dump({'type': 'Feature', 'properties': {k: feat[k] for k in ('class', 'name', 'area_ha')},
+                       'geometry': {'type': 'Polygon', 'coordinates': [np.round(r, 7).tolist() for r in feat['rings']]}}, f)
+        f.write('\n]}\n')
+    return path
+
+DBF_FIELDS = [('CLASS', 'N', 5, 0), ('NAME', 'C', 40, 0), ('AREA_HA', 'N', 18, 4)]
+
+def _shp_header(length_bytes, bbox):
+    return struct.pack('>7i', 9994, 0, 0, 0, 0, 0, length_bytes // 2) + struct.pack('<2i4d4d', 1000, 5, *bbox, 0, 0, 0, 0)
+
+def _dbf_header(count):
+    t = time.localtime()
+    record = 1 + sum(f[2] for f in DBF_FIELDS)
+    head = struct.pack('<4BIHH20x', 3, t.tm_year - 1900, t.tm_mon, t.tm_mday, count, 33 + 32 * len(DBF_FIELDS), record)
+    for name, kind, size, dec in DBF_FIELDS:
+        head += struct.pack('<11sc4xBB14x', name.encode(), kind.encode(), size, dec)
+    return head + b'\r'
+
+def write_shapefile(feats, path):
+    """Zipped polygon shapefile; record headers stream out and the file headers are patched at the end."""
+    base = path[:-4]
+    bbox = [np.inf, np.inf, -np.inf, -np.inf]
+    count, offset = 0, 100
+    with open(base + '.shp', 'wb') as shp, open(base + '.shx', 'wb') as shx, open(base + '.dbf', 'wb') as dbf:
+        shp.write(b'\0' * 100); shx.write(b'\0' * 100); dbf.write(_dbf_header(0))
+        for feat in feats:
+            # Shapefile rings: clockwise shells, counter-clockwise holes
+            rings = [r[::-1] for r in feat['rings']]
+            pts = np.vstack(rings)
+            box = [*pts.min(axis=0), *pts.max(axis=0)]
+            bbox = [min(bbox[0], box[0]), min(bbox[1], box[1]), max(bbox[2], box[2]), max(bbox[3], box[3])]
+            parts = np.cumsum([0] + [len(r) for r in rings[:-1]])
+            content = struct.pack('<i4d2i', 5, *box, len(rings), len(pts)) + parts.astype('<i4').tobytes() + pts.astype('<f8').tobytes()
+            count += 1
+            shp.write(struct.pack('>2i', count, len(content) // 2) + content)
+            shx.write(struct.pack('>2i', offset // 2, len(content) // 2))
+            offset += 8 + len(content)
+            dbf.write(b' ' + f"{feat['class']:>5d}".encode() + feat['name'].encode('ascii', 'replace')[:40].ljust(40)
+                      + f"{feat['area_ha']:>18.4f}".encode()[:18])
+        dbf.write(b'\x1a')
+        if not count: bbox = [0, 0, 0, 0]
+        shp.seek(0); shp.write(_shp_header(offset, bbox))
+        shx.seek(0); shx.write(_shp_header(100 + 8 * count, bbox))
+        dbf.seek(0); dbf.write(_dbf_header(count))
+    with open(base + '.prj', 'w') as f: f.write(WGS84_WKT)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for ext in ('.shp', '.shx', '.dbf', '.prj'):
+            z.write(base + ext, os.path.basename(base) + ext)
+            os.remove(base + ext)
+    return path
+
+def _gpkg_geometry(rings):
+    """GeoPackage binary: 'GP' header with an XY envelope, then little-endian WKB Polygon."""
+    pts = np.vstack(rings)
+    (minx, miny), (maxx, maxy) = pts.min(axis=0), pts.max(axis=0)
+    wkb = struct.pack('<BII', 1, 3, len(rings))
+    for r in rings: wkb += struct.pack('<I', len(r)) + r.astype('<f8').tobytes()
+    return b'GP' + struct.pack('<BBi4d', 0, 0b011, 4326, minx, maxx, miny, maxy) + wkb, (minx, miny, maxx, maxy)
+
+def write_geopackage(feats, path, table="zones", batch=500):
+    if os.path.exists(path): os.remove(path)
+    con = sqlite3.connect(path)
+    try:
+        con.execute("PRAGMA application_id = 1196444487")
+        con.execute("PRAGMA user_version = 10200")
+        con.execute("CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, "
+                    "organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)")
+        con.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", [
+            ("WGS 84 geodetic", 4326, "EPSG", 4326, WGS84_WKT, None),
+            ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+            ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None)])
+        con.execute("CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, "
+                    "description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), "
+                    "min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER)")
+        con.execute("CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, "
+                    "srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL, PRIMARY KEY (table_name, column_name))")
+        con.execute(f"CREATE TABLE {table} (fid INTEGER PRIMARY KEY AUTOINCREMENT, geom POLYGON, class INTEGER, name TEXT, area_ha DOUBLE)")
+        con.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', 'POLYGON', 4326, 0, 0)", (table,))
+        bbox = [np.inf, np.inf, -np.inf, -np.inf]
+        rows = []
+        for feat in feats:
+            blob, box = _gpkg_geometry(feat['rings'])
+            bbox = [min(bbox[0], box[0]), min(bbox[1], box[1]), max(bbox[2], box[2]), max(bbox[3], box[3])]
+            rows.append((blob, feat['class'], feat['name'], feat['area_ha']))
+            if len(rows) >= batch:
+                con.executemany(f"INSERT INTO {table} (geom, class, name, area_ha) VALUES (?, ?, ?, ?)", rows)
+                rows = []
+        if rows: con.executemany(f"INSERT INTO {table} (geom, class, name, area_ha) VALUES (?, ?, ?, ?)", rows)
+        con.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, srs_id) "
+                    "VALUES (?, 'features', ?, ?, ?, ?, ?, 4326)", (table, table, *(float(v) if np.isfinite(v) else None for v in bbox)))
+        con.commit()
+    finally:
+        con.close()
+    return path
+
+WRITERS = {"GeoJSON": write_geojson, "Shapefile": write_shapefile, "GeoPackage": write_geopackage}
+
+def export(image, geo_json, scale, names, fmt, name="zones"):
+    """Vectorises a classified image over the ROI and writes it under <cache>/vectors; returns the file path."""
+    prune(ROOT, MAX_AGE_DAYS, MAX_BYTES)
+    path = cache_path(ROOT, geometry.fingerprint(geo_json), name + FORMATS[fmt][0])
+    return WRITERS[fmt](features(image, geo_json, vector_scale(geo_json, scale), names), path)